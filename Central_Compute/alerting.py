@@ -0,0 +1,335 @@
+"""Streaming fire alerts evaluated on every reading as it arrives.
+
+AlertEngine keeps a RollingWindow per node and metric and checks the
+rules for that metric whenever a reading lands in it. A rule looks at the
+window mean or its rate of rise and uses two thresholds: it raises at
+raise_at and only clears again once the statistic falls to clear_at, so
+a value hovering around one threshold does not flap. An active alert is
+never raised twice, listeners only hear about transitions:
+
+    engine = AlertEngine()
+    message_parser.add_reading_listener(engine.observe)
+    engine.add_listener(router.dispatch)
+
+Windows and alert state are keyed by the client_id of the connection the
+readings came from, not by node name: firmware ships fixed names, so
+several live nodes can share one. Alerts still carry the node name. When
+a connection goes away, forget(client_id) drops its windows and turns its
+active alerts into "expired" transitions.
+
+AlertRouter sends every transition to the nodes that subscribed with an
+alert_subscribe message, through the Broadcaster outboxes of their
+existing connections. Nodes answer with alert_ack; the time from the
+reading reaching the server to the alert being queued and to the ack
+coming back is recorded per stage in ServerMetrics.alert_latency.
+"""
+import logging
+import time
+from collections import deque
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 60.0  # Seconds of readings behind each statistic
+MIN_HOLD = 10.0  # Seconds an alert stays raised before it may clear
+MIN_RATE_READINGS = 3  # Readings needed before a rate of rise is trusted
+MIN_RATE_SPAN = 10.0  # Seconds the window must cover for a rate of rise
+ACK_TIMEOUT = 30.0  # Seconds an alert waits for acks before it is written off
+
+MEAN = "mean"
+RATE = "rate"  # Least-squares rate of rise in units per minute
+STATS = (MEAN, RATE)
+
+RAISED = "raised"
+CLEARED = "cleared"
+EXPIRED = "expired"  # The node went away while the alert was raised
+
+# Stages of ServerMetrics.alert_latency, measured from the reading's arrival
+DISPATCH = "dispatch"  # Alert queued for every subscriber
+ACK = "ack"  # Subscriber acknowledged it
+
+class RollingWindow:
+    """Readings of one metric over the last span seconds with O(1) statistics.
+
+    Running sums of t, v, t * t and t * v are updated as readings enter and
+    leave, so the mean and the least-squares slope cost the same however
+    many readings the window holds. Times are relative to an origin that
+    moves up to the oldest reading once per span, which keeps the sums
+    small and drops the rounding error they pick up.
+    """
+
+    __slots__ = ("span", "readings", "origin", "n", "sum_t", "sum_v", "sum_tt", "sum_tv")
+
+    def __init__(self, span=WINDOW):
+        self.span = span
+        self.readings = deque()  # (timestamp, value), oldest first
+        self._rebase(0.0)
+
+    def __len__(self):
+        return self.n
+
+    def add(self, timestamp, value):
+        readings = self.readings
+        cutoff = timestamp - self.span
+        while readings and readings[0][0] < cutoff:
+            old_timestamp, old_value = readings.popleft()
+            self._update(old_timestamp - self.origin, old_value, -1)
+        readings.append((timestamp, value))
+        if readings[0][0] - self.origin > self.span or len(readings) == 1:
+            self._rebase(readings[0][0])
+        else:
+            self._update(timestamp - self.origin, value, 1)
+
+    def mean(self):
+        return self.sum_v / self.n if self.n else None
+
+    def rate(self):
+        """Slope of the least-squares line through the window, units per second"""
+        n = self.n
+        if n < MIN_RATE_READINGS or self.readings[-1][0] - self.readings[0][0] < MIN_RATE_SPAN:
+            return None
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return None
+        return (n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+    def _update(self, t, value, sign):
+        self.n += sign
+        self.sum_t += sign * t
+        self.sum_v += sign * value
+        self.sum_tt += sign * t * t
+        self.sum_tv += sign * t * value
+
+    def _rebase(self, origin):
+        """Recompute the sums from scratch relative to a new origin"""
+        self.origin = origin
+        self.n = 0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        for timestamp, value in self.readings:
+            self._update(timestamp - origin, value, 1)
+
+class AlertRule:
+    """Raise when a window statistic reaches raise_at, clear at clear_at"""
+
+    __slots__ = ("name", "metric", "stat", "raise_at", "clear_at")
+
+    def __init__(self, name, metric, stat, raise_at, clear_at):
+        if stat not in STATS:
+            raise ValueError(f"stat must be one of {', '.join(STATS)}")
+        if clear_at >= raise_at:
+            raise ValueError("clear_at must be below raise_at")
+        self.name = name
+        self.metric = metric
+        self.stat = stat
+        self.raise_at = raise_at
+        self.clear_at = clear_at
+
+    def measure(self, window):
+        if self.stat == MEAN:
+            return window.mean()
+        rate = window.rate()
+        return None if rate is None else rate * 60
+
+DEFAULT_RULES = (
+    AlertRule("temperature_high", "temperature", MEAN, 45, 40),
+    AlertRule("temperature_rise", "temperature", RATE, 8, 4),  # Degrees per minute, as rate-of-rise heat detectors
+    AlertRule("smoke_high", "smoke_level", MEAN, 100, 80),
+)
+
+class AlertEngine:
+    """Per-node rolling windows and alert state, updated reading by reading"""
+
+    def __init__(self, rules=DEFAULT_RULES, window=WINDOW, min_hold=MIN_HOLD):
+        self.window = window
+        self.min_hold = min_hold
+        self.rules = {}  # metric -> rules on it
+        for rule in rules:
+            self.rules.setdefault(rule.metric, []).append(rule)
+        self.windows = {}  # (client_id, metric) -> RollingWindow
+        self.active = {}  # (client_id, rule name) -> the alert that raised it
+        self.listeners = []
+        self.next_id = 1
+        self.raised = 0
+        self.cleared = 0
+        self.expired = 0
+
+    def add_listener(self, listener):
+        """Call listener(alert) for every alert raised, cleared or expired"""
+        self.listeners.append(listener)
+
+    def observe(self, node, message, timestamp=None, client_id=None):
+        """Feed the metrics of one reading, returns the alerts it raised or cleared.
+
+        The signature matches MessageParser reading listeners. timestamp is
+        when the reading reached the server. State is kept per client_id,
+        per node name when there is none.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        source = node if client_id is None else client_id
+        alerts = []
+        for metric, rules in self.rules.items():
+            value = message.get(metric)
+            if metric == "smoke_level" and value is None:
+                value = message.get("smoke")
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            window = self.windows.get((source, metric))
+            if window is None:
+                window = self.windows[(source, metric)] = RollingWindow(self.window)
+            window.add(timestamp, float(value))
+
+            for rule in rules:
+                measured = rule.measure(window)
+                if measured is None:
+                    continue
+                key = (source, rule.name)
+                active = self.active.get(key)
+                if active is None:
+                    if measured >= rule.raise_at:
+                        alert = self._alert(node, rule, RAISED, measured, rule.raise_at, timestamp)
+                        self.active[key] = alert
+                        self.raised += 1
+                        alerts.append(alert)
+                elif measured <= rule.clear_at and timestamp - active["timestamp"] >= self.min_hold:
+                    alert = self._alert(node, rule, CLEARED, measured, rule.clear_at, timestamp)
+                    del self.active[key]
+                    self.cleared += 1
+                    alerts.append(alert)
+
+        self._notify(alerts)
+        return alerts
+
+    def active_alerts(self):
+        return list(self.active.values())
+
+    def forget(self, source, now=None):
+        """Drop the windows of a connection that went away and expire its active alerts.
+
+        source is the client_id the readings were observed with.
+
+        An expired alert is not cleared: nobody is measuring any more, so
+        the condition is unknown rather than over. Listeners get an
+        "expired" transition, subscribers drop it from their active set
+        and a reconnecting node starts from empty windows. Returns the
+        expired alerts.
+        """
+        now = time.time() if now is None else now
+        for metric in self.rules:
+            self.windows.pop((source, metric), None)
+        alerts = []
+        for key in [key for key in self.active if key[0] == source]:
+            alert = dict(self.active.pop(key), alert_id=self.next_id, state=EXPIRED, value=None, timestamp=now)
+            self.next_id += 1
+            self.expired += 1
+            alerts.append(alert)
+        self._notify(alerts)
+        return alerts
+
+    def _notify(self, alerts):
+        for alert in alerts:
+            node = alert["node"]
+            if alert["state"] == RAISED:
+                logger.warning(f"Alert {alert['rule']} raised at {node}: {alert['stat']} {alert['value']:.2f}")
+            else:
+                logger.info(f"Alert {alert['rule']} {alert['state']} at {node}")
+            for listener in self.listeners:
+                try:
+                    listener(alert)
+                except Exception as e:
+                    logger.error(f"Alert listener failed for {alert['rule']} at {node}: {e}")
+
+    def _alert(self, node, rule, state, measured, threshold, timestamp):
+        alert = {
+            "alert_id": self.next_id,
+            "node": node,
+            "rule": rule.name,
+            "metric": rule.metric,
+            "stat": rule.stat,
+            "value": measured,
+            "threshold": threshold,
+            "state": state,
+            "timestamp": timestamp,
+        }
+        self.next_id += 1
+        return alert
+
+class AlertRouter:
+    """Delivers alerts to the nodes that subscribed to them.
+
+    Runs on the event loop thread next to the Broadcaster. subscribers maps
+    client_id to the rule names it wants, None meaning all of them.
+    """
+
+    def __init__(self, broadcaster, metrics=None, ack_timeout=ACK_TIMEOUT):
+        self.broadcaster = broadcaster
+        self.ack_timeout = ack_timeout
+        self.subscribers = {}  # client_id -> set of rule names or None
+        self.pending = {}  # alert_id -> (reading arrival time, client_ids yet to ack), oldest first
+        self.latency = metrics.alert_latency if metrics is not None else {}
+        for stage in (DISPATCH, ACK):
+            self.latency.setdefault(stage, LatencyHistogram())
+        self.delivered = 0
+        self.unacknowledged = 0
+
+    def subscribe(self, client_id, rules=None):
+        self.subscribers[client_id] = set(rules) if rules else None
+
+    def unsubscribe(self, client_id):
+        """Forget a subscriber, called when its connection goes away"""
+        self.subscribers.pop(client_id, None)
+
+    def dispatch(self, alert):
+        """Queue an alert for its subscribers, an AlertEngine listener"""
+        self._expire(time.time())
+        recipients = [client_id for client_id, rules in self.subscribers.items()
+                      if rules is None or alert["rule"] in rules]
+        if not recipients:
+            return 0
+        # Encoded once and queued on every subscriber's outbox
+        sent = self.broadcaster.broadcast(dict(alert, msg_id="alert"), recipients)
+        self.latency[DISPATCH].record(time.time() - alert["timestamp"])
+        if sent:
+            self.pending[alert["alert_id"]] = (alert["timestamp"], set(recipients))
+        self.delivered += sent
+        logger.info(f"Alert {alert['alert_id']} ({alert['rule']} {alert['state']}) sent to {sent} of {len(recipients)} subscribers")
+        return sent
+
+    async def handle_subscribe(self, message, client_id):
+        """alert_subscribe handler, optional "rules" limits the alerts sent"""
+
+        """ {'msg_id': 'alert_subscribe', 'node_name': 'Motor Node', 'rules': ['smoke_high']} """
+        rules = message.get("rules")
+        if rules is not None and not isinstance(rules, list):
+            return {"status": "error", "message": "Invalid type for field: rules"}
+        self.subscribe(client_id, rules)
+        logger.info(f"Client {client_id} subscribed to {'all alerts' if not rules else ', '.join(rules)}")
+        return {
+            "msg_id": "alert_subscribe_response",
+            "status": "success",
+            "rules": rules or "all",
+            "timestamp": time.time()
+        }
+
+    async def handle_ack(self, message, client_id):
+        """alert_ack handler, records the end-to-end alert latency"""
+
+        """ {'msg_id': 'alert_ack', 'alert_id': 12} """
+        entry = self.pending.get(message.get("alert_id"))
+        if entry is not None and client_id in entry[1]:
+            self.latency[ACK].record(time.time() - entry[0])
+            entry[1].discard(client_id)
+            if not entry[1]:
+                del self.pending[message["alert_id"]]
+        return {"msg_id": "alert_ack_response", "status": "success", "timestamp": time.time()}
+
+    def _expire(self, now):
+        """Write off alerts whose acks are overdue, oldest first"""
+        pending = self.pending
+        while pending:
+            alert_id = next(iter(pending))
+            arrived, waiting = pending[alert_id]
+            if now - arrived < self.ack_timeout:
+                break
+            del pending[alert_id]
+            self.unacknowledged += len(waiting)
@@ -0,0 +1,77 @@
+"""Compare the JSON and binary uplink encodings.
+
+Reports bytes per reading and encode/decode time for a single reading and
+for a batch of readings:
+
+    python bench_wire_protocol.py --batch 10 --iterations 20000
+"""
+import argparse
+import json
+import time
+
+import wire_protocol
+from wire_protocol import NodeCodes
+
+def sample_reading(i):
+    return {
+        "msg_id": "dhtt_data",
+        "timestamp": 1700000000.0 + i,
+        "temperature": 21.5 + i % 7,
+        "humidity": 40.25 + i % 11,
+        "node_name": "DHTT Node",
+    }
+
+def time_per_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+def bench(message, readings, node_codes, node_code, iterations):
+    json_frame = wire_protocol.encode_json(message)
+    binary_frame = wire_protocol.encode_binary(message, node_code, seq=1)
+    if binary_frame is None:
+        raise SystemExit(f"{message['msg_id']} has no binary layout")
+
+    results = {
+        "json": {
+            "bytes": len(json_frame),
+            "encode": time_per_call(lambda: wire_protocol.encode_json(message), iterations),
+            "decode": time_per_call(lambda: json.loads(json_frame.decode('utf-8')), iterations),
+        },
+        "binary": {
+            "bytes": len(binary_frame),
+            "encode": time_per_call(lambda: wire_protocol.encode_binary(message, node_code, seq=1), iterations),
+            "decode": time_per_call(lambda: wire_protocol.decode_binary(binary_frame, node_codes), iterations),
+        },
+    }
+    for name, result in results.items():
+        result["bytes_per_reading"] = result["bytes"] / readings
+    return results
+
+def print_results(title, results):
+    print(title)
+    for name, result in results.items():
+        print(f"  {name:<7} {result['bytes']:>6} B  {result['bytes_per_reading']:>7.1f} B/reading  "
+              f"encode {result['encode'] * 1e6:>7.2f} us  decode {result['decode'] * 1e6:>7.2f} us")
+    ratio = results["json"]["bytes"] / results["binary"]["bytes"]
+    print(f"  binary is {ratio:.1f}x smaller")
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs binary frame size and codec cost")
+    parser.add_argument("--batch", type=int, default=10, help="Readings per batch")
+    parser.add_argument("--iterations", type=int, default=20000, help="Calls timed per measurement")
+    args = parser.parse_args()
+
+    node_codes = NodeCodes()
+    node_code = node_codes.code_for("DHTT Node")
+
+    reading = sample_reading(0)
+    print_results("single reading", bench(reading, 1, node_codes, node_code, args.iterations))
+
+    readings = [sample_reading(i) for i in range(args.batch)]
+    batch = {"msg_id": "batch", "node_name": "DHTT Node", "readings": readings}
+    print_results(f"batch of {args.batch}", bench(batch, args.batch, node_codes, node_code, args.iterations // args.batch or 1))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Benchmarks of the central message pipeline, saved as JSON for comparison.
+
+Stages, each timed per call:
+
+    framing_json     read_frame + decode_frame of newline JSON from a StreamReader
+    framing_binary   the same for binary frames
+    dispatch         MessageParser.parse_message over a mix of message types
+    handler_*        handle_node_update, handle_sensor_data, handle_dhtt_sensor called directly
+    round_trip       request/response through handle_client over a loopback socket
+    round_trip_pipelined  the same with many requests in flight
+
+Every stage reports messages per second and per-call latency percentiles.
+Results go to bench_results/pipeline-<commit>.json. Compare with an older
+result to see regressions:
+
+    python benchmark_pipeline.py
+    python benchmark_pipeline.py --compare bench_results/pipeline-0699cf9.json
+
+--compare exits with status 1 if any stage lost more than --threshold of
+its messages per second or gained as much p99 latency.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import central_compute_nogui as server_module
+import wire_protocol
+from connection_manager import Connection
+from log_pipeline import stop_logging
+from message_parser import MessageParser
+from storage_engine import StorageEngine
+
+CLIENT_ID = "bench-client"
+NODE_NAME = "DHTT Node"
+RESULTS_DIR = "bench_results"
+
+def sample_messages(n):
+    """A repeatable mix of the readings real nodes send"""
+    messages = []
+    for i in range(n):
+        now = 1700000000.0 + i
+        kind = i % 3
+        if kind == 0:
+            messages.append({"msg_id": "dhtt_data", "timestamp": now, "temperature": 20 + i % 10,
+                             "humidity": 50 + i % 20, "node_name": NODE_NAME})
+        elif kind == 1:
+            messages.append({"msg_id": "smoke_data", "timestamp": now, "smoke_level": 0.1 + i % 5 / 10,
+                             "node_name": NODE_NAME})
+        else:
+            messages.append({"msg_id": "motor_data", "timestamp": now, "motor_position": [i % 100, i % 50],
+                             "node_name": NODE_NAME})
+    return messages
+
+def stage_result(durations, total_seconds, errors=0):
+    """Throughput and latency percentiles (microseconds) of one timed run"""
+    durations = sorted(durations)
+    n = len(durations)
+
+    def percentile(q):
+        return durations[min(n - 1, int(n * q / 100))] * 1e6
+
+    return {
+        "messages": n,
+        "errors": errors,
+        "messages_per_second": n / total_seconds if total_seconds else 0.0,
+        "mean_us": statistics.fmean(durations) * 1e6,
+        "p50_us": percentile(50),
+        "p90_us": percentile(90),
+        "p99_us": percentile(99),
+        "max_us": durations[-1] * 1e6,
+    }
+
+def new_parser(storage):
+    connections = {CLIENT_ID: Connection(CLIENT_ID, None, None, ("127.0.0.1", 0))}
+    parser = MessageParser(connected_clients=connections, storage=storage)
+    connections[CLIENT_ID].node_name = NODE_NAME
+    return parser
+
+async def bench_framing(frames, node_codes):
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    reader.feed_data(b"".join(frames))
+    reader.feed_eof()
+    durations = []
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(len(frames)):
+        t0 = clock()
+        frame = await wire_protocol.read_frame(reader)
+        wire_protocol.decode_frame(frame, node_codes)
+        durations.append(clock() - t0)
+    return stage_result(durations, clock() - start)
+
+async def bench_calls(func, messages):
+    """Time func(message, CLIENT_ID) per message, exceptions count as errors"""
+    durations = []
+    errors = 0
+    clock = time.perf_counter
+    start = clock()
+    for message in messages:
+        t0 = clock()
+        try:
+            response = await func(message, CLIENT_ID)
+            if isinstance(response, dict) and response.get("status") == "error":
+                errors += 1
+        except Exception:
+            errors += 1
+        durations.append(clock() - t0)
+    return stage_result(durations, clock() - start, errors)
+
+async def bench_round_trip(messages, in_flight, storage):
+    """Send messages through handle_client with up to in_flight requests outstanding"""
+    server_module.message_parser.storage = storage
+
+    server = await asyncio.start_server(server_module.handle_client, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readline()  # Welcome
+    writer.write(wire_protocol.encode_json({"msg_id": "node_update", "node_name": NODE_NAME}))
+    await writer.drain()
+    await reader.readline()
+
+    sent_at = {}
+    durations = []
+    errors = 0
+    clock = time.perf_counter
+    start = clock()
+    for seq, message in enumerate(messages, 1):
+        frame = wire_protocol.encode_json(dict(message, seq=seq))
+        sent_at[seq] = clock()
+        writer.write(frame)
+        if len(sent_at) >= in_flight:
+            await writer.drain()
+        while len(sent_at) >= in_flight or (seq == len(messages) and sent_at):
+            response = json.loads(await reader.readline())
+            now = clock()
+            t0 = sent_at.pop(response.get("seq"), None)
+            if t0 is None or response.get("status") == "error":
+                errors += 1
+            if t0 is not None:
+                durations.append(now - t0)
+    total = clock() - start
+
+    writer.close()
+    await writer.wait_closed()
+    # Let handle_client see the disconnect before the server goes away
+    while server_module.connection_manager.connections:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+    return stage_result(durations, total, errors)
+
+async def run_stages(args, storage_root):
+    messages = sample_messages(args.iterations)
+    storage = StorageEngine(storage_root)
+    storage.start()
+    parser = new_parser(storage)
+    node_codes = parser.node_codes
+    node_code = node_codes.code_for(NODE_NAME)
+
+    sensor_messages = [{"msg_id": "sensor_data", "sensor_type": "environment", "timestamp": m["timestamp"],
+                        "readings": {"temperature": 20 + i % 10, "humidity": 40 + i % 7}}
+                       for i, m in enumerate(messages)]
+    update_messages = [{"msg_id": "node_update", "node_name": NODE_NAME, "node_type": "DHTT",
+                        "encodings": [wire_protocol.ENCODING, "json"]}] * args.iterations
+    dhtt_messages = [m for m in messages if m["msg_id"] == "dhtt_data"]
+
+    stages = {
+        "framing_json": lambda: bench_framing([wire_protocol.encode_json(m) for m in messages], node_codes),
+        "framing_binary": lambda: bench_framing([wire_protocol.encode_binary(m, node_code) for m in messages], node_codes),
+        "dispatch": lambda: bench_calls(parser.parse_message, messages),
+        "handler_node_update": lambda: bench_calls(parser.handle_node_update, update_messages),
+        "handler_sensor_data": lambda: bench_calls(parser.handle_sensor_data, sensor_messages),
+        "handler_dhtt_sensor": lambda: bench_calls(parser.handle_dhtt_sensor, dhtt_messages),
+        "round_trip": lambda: bench_round_trip(messages[:args.round_trips], 1, storage),
+        "round_trip_pipelined": lambda: bench_round_trip(messages[:args.round_trips], args.in_flight, storage),
+    }
+    results = {}
+    for name, stage in stages.items():
+        if args.stages and name not in args.stages:
+            continue
+        # Warm up once, then keep the median of every figure over the timed runs
+        await stage()
+        runs = [await stage() for _ in range(args.repeat)]
+        results[name] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(f"{name:<22} {results[name]['messages_per_second']:>12.0f} msg/s  "
+              f"p50 {results[name]['p50_us']:>9.1f} us  p99 {results[name]['p99_us']:>9.1f} us"
+              + (f"  errors {results[name]['errors']}" if results[name]["errors"] else ""))
+    storage.stop()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results, baseline, threshold):
+    """Print per-stage changes against a baseline, return the regressed stages"""
+    regressed = []
+    for name, result in results.items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        throughput = result["messages_per_second"] / old["messages_per_second"] - 1 if old["messages_per_second"] else 0.0
+        p99 = result["p99_us"] / old["p99_us"] - 1 if old["p99_us"] else 0.0
+        flag = ""
+        if throughput < -threshold or p99 > threshold:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<22} msg/s {throughput:+7.1%}  p99 {p99:+7.1%}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the central message pipeline")
+    parser.add_argument("--iterations", type=int, default=20000, help="Messages per in-process stage run")
+    parser.add_argument("--round-trips", type=int, default=5000, help="Messages per socket round trip run")
+    parser.add_argument("--in-flight", type=int, default=32, help="Outstanding requests in the pipelined round trip")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage, the median is kept")
+    parser.add_argument("--stages", nargs="*", help="Only run these stages")
+    parser.add_argument("--output", help="Result file, default bench_results/pipeline-<commit>.json")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.20, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    # Per-message logging would be most of what gets measured
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as storage_root:
+        results = asyncio.run(run_stages(args, storage_root))
+    stop_logging()
+
+    commit = git_commit()
+    document = {
+        "benchmark": "pipeline",
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"iterations": args.iterations, "round_trips": args.round_trips,
+                   "in_flight": args.in_flight, "repeat": args.repeat},
+        "stages": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(document, f, indent=4)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            print(f"Regressed: {', '.join(regressed)}")
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# What to do with a connection whose outbound queue passes the high-water mark
+DROP = "drop"  # Drop messages for it until the queue is back under the low-water mark
+DISCONNECT = "disconnect"  # Close the connection
+
+DEFAULT_HIGH_WATER = 256 * 1024  # Bytes queued per connection
+DEFAULT_LOW_WATER = 64 * 1024
+
+def encode_frame(message):
+    """Encode a message once as a newline-terminated JSON frame"""
+    if isinstance(message, bytes):
+        return message if message.endswith(b'\n') else message + b'\n'
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+class Outbox:
+    """Bounded outbound queue of one connection, drained by its own task"""
+
+    __slots__ = ("client_id", "writer", "high_water", "low_water", "queue",
+                 "queued_bytes", "dropping", "dropped", "shed", "wakeup", "task")
+
+    def __init__(self, client_id, writer, high_water, low_water):
+        self.client_id = client_id
+        self.writer = writer
+        self.high_water = high_water
+        self.low_water = low_water
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.dropping = False  # Over the high-water mark, shedding messages
+        self.dropped = 0
+        self.shed = 0  # Messages dropped since the queue last went over the high-water mark
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def put(self, frame):
+        """Queue a frame, False when it was shed because the peer is too slow"""
+        if self.dropping:
+            if self.queued_bytes > self.low_water:
+                self.dropped += 1
+                self.shed += 1
+                return False
+            self.dropping = False
+            logger.info("Client %s caught up, %d messages were dropped", self.client_id, self.shed)
+        if self.queued_bytes + len(frame) > self.high_water:
+            self.dropping = True
+            self.dropped += 1
+            self.shed = 1
+            return False
+        self.queue.append(frame)
+        self.queued_bytes += len(frame)
+        self.wakeup.set()
+        return True
+
+    async def run(self):
+        """Write queued frames one at a time, waiting for the peer to drain"""
+        writer = self.writer
+        while not writer.is_closing():
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            frame = self.queue.popleft()
+            self.queued_bytes -= len(frame)
+            writer.write(frame)
+            await writer.drain()
+
+class Broadcaster:
+    """Fan-out of server-initiated messages to node connections.
+
+    Must be used from the event loop thread; other threads go through
+    send_threadsafe/broadcast_threadsafe. Every connection gets a bounded
+    outbox drained by its own task, so one stalled node only fills its own
+    queue. A broadcast is encoded once and the same bytes are queued for
+    every recipient. Connections without a writer (simulated clients) are
+    skipped.
+    """
+
+    def __init__(self, connections, high_water=DEFAULT_HIGH_WATER, low_water=DEFAULT_LOW_WATER, policy=DROP):
+        self.connections = connections
+        self.high_water = high_water
+        self.low_water = low_water
+        self.policy = policy
+        self.outboxes = {}  # client_id -> Outbox
+        self.dropped = 0
+        self.disconnected = 0
+
+    def send(self, client_id, message):
+        """Queue a message for one connection, returns True if it was queued"""
+        connection = self.connections.get(client_id)
+        if connection is None or connection.writer is None:
+            return False
+        return self._put(connection, encode_frame(message))
+
+    def broadcast(self, message, client_ids=None):
+        """Queue a message for every connection (or client_ids), returns how many got it"""
+        frame = encode_frame(message)
+        if client_ids is None:
+            targets = list(self.connections.values())
+        else:
+            targets = [self.connections[client_id] for client_id in client_ids if client_id in self.connections]
+        sent = 0
+        for connection in targets:
+            if connection.writer is not None and self._put(connection, frame):
+                sent += 1
+        logger.info("Broadcast %d bytes to %d of %d connections", len(frame), sent, len(targets))
+        return sent
+
+    def send_threadsafe(self, loop, client_id, message):
+        loop.call_soon_threadsafe(self.send, client_id, message)
+
+    def broadcast_threadsafe(self, loop, message, client_ids=None):
+        loop.call_soon_threadsafe(self.broadcast, message, client_ids)
+
+    def discard(self, client_id):
+        """Forget a connection's outbox, called when the connection goes away"""
+        outbox = self.outboxes.pop(client_id, None)
+        if outbox is not None and outbox.task is not None:
+            outbox.task.cancel()
+
+    def queue_depths(self):
+        """Queued bytes over all outboxes, for the metrics gauges"""
+        sizes = [outbox.queued_bytes for outbox in self.outboxes.values()]
+        return {("total",): sum(sizes), ("max",): max(sizes, default=0)}
+
+    def _put(self, connection, frame):
+        outbox = self.outboxes.get(connection.client_id)
+        if outbox is None or outbox.writer is not connection.writer:
+            outbox = Outbox(connection.client_id, connection.writer, self.high_water, self.low_water)
+            outbox.task = asyncio.create_task(self._run(outbox))
+            self.outboxes[connection.client_id] = outbox
+        if outbox.put(frame):
+            return True
+
+        self.dropped += 1
+        if self.policy == DISCONNECT:
+            logger.warning("Disconnecting slow client %s, %d bytes queued", connection.client_id, outbox.queued_bytes)
+            self.disconnected += 1
+            self.discard(connection.client_id)
+            connection.writer.close()
+        elif outbox.shed == 1:
+            logger.warning("Client %s is not keeping up, dropping messages until %d bytes are sent",
+                           connection.client_id, outbox.queued_bytes - self.low_water)
+        return False
+
+    async def _run(self, outbox):
+        try:
+            await outbox.run()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info("Outbox for %s closed: %s", outbox.client_id, e)
+        finally:
+            if self.outboxes.get(outbox.client_id) is outbox:
+                del self.outboxes[outbox.client_id]
@@ -6,18 +6,58 @@ import random
 import sys
 import threading
 import time
+import math
 import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import ttk, scrolledtext, messagebox
 import socket
 import uuid
+from collections import deque
 from message_parser import MessageParser
+from storage_engine import StorageEngine
+from fire_detection import FireDetector
+from metrics import ServerMetrics, add_broadcast_gauges, add_server_gauges, serve_metrics
+from broadcast import Broadcaster
+from alerting import AlertEngine, AlertRouter
+import wire_protocol
+from log_pipeline import LOG_FORMAT, SuppressionFormatter, setup_logging, stop_logging, rate_limiter
+from connection_manager import Connection, ConnectionManager, raise_fd_limit
+from client_history import ClientHistory
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+setup_logging(level=logging.INFO)
 logger = logging.getLogger("ServerUI")
 
+# Connection limits
+MAX_CONNECTIONS = 10000
+MAX_CONNECTIONS_PER_IP = 0  # 0 disables the per-IP cap
+IDLE_TIMEOUT = 120  # Seconds of silence before a node is evicted
+STALE_AFTER = 30  # Seconds of silence before a node is reported stale
+LISTEN_BACKLOG = 4096  # Pending accepts queued by the kernel
+REFRESH_INTERVAL_MS = 250  # Minimum time between UI repaints
+LOG_MAX_LINES = 2000  # Lines kept in the server log widget
+LOG_TRIM_BATCH = 500  # Old lines removed at once when the widget is over the limit
+SPARKLINE_WIDTH = 60  # Characters per metric sparkline in the client details
+CHART_FRAME_MS = 250  # Live chart redraw period while the Charts tab is shown
+CHART_WINDOWS = (60, 300, 900, 1800)  # Selectable chart time spans in seconds
+CHART_MAX_SERIES = 8  # Nodes plotted when none are selected
+CHART_COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#17becf")
+SPARK_CHARS = "\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+HISTORY_RETENTION = 2048  # Readings kept in memory per client
+STORAGE_DIR = "sensor_data"  # On-disk reading history
+FIRE_EVAL_INTERVAL = 1.0  # Seconds between fire-condition passes
+CLIENT_PUBLISH_INTERVAL = REFRESH_INTERVAL_MS / 1000  # Seconds between client registry snapshots for the UI
+METRICS_HOST = "127.0.0.1"  # Metrics endpoint, local scrapes only
+METRICS_PORT = 9100
+
 # Store connected clients
-connected_clients = {}
-MAX_CLIENTS = 5
+connection_manager = ConnectionManager(
+    max_connections=MAX_CONNECTIONS,
+    max_per_ip=MAX_CONNECTIONS_PER_IP,
+    idle_timeout=IDLE_TIMEOUT,
+    history_retention=HISTORY_RETENTION,
+    stale_after=STALE_AFTER
+)
+connected_clients = connection_manager.connections
 
 class ServerUI:
     def __init__(self, root):
@@ -30,18 +70,43 @@ class ServerUI:
         self.server_thread = None
         self.loop = None
         self.server = None
-        self.message_parser = MessageParser(connected_clients=connected_clients)
+        self.metrics_server = None
+        self.storage = StorageEngine(STORAGE_DIR)
+        self.storage.start()
+        self.metrics = ServerMetrics()
+        add_server_gauges(self.metrics, connected_clients, self.storage)
+        self.broadcaster = Broadcaster(connected_clients)
+        add_broadcast_gauges(self.metrics, self.broadcaster)
+        self.metrics.add_gauge("central_node_liveness", "Connected nodes by liveness state",
+                               connection_manager.liveness.state_counts, ("state",))
+        self.alert_engine = AlertEngine()
+        self.alert_router = AlertRouter(self.broadcaster, self.metrics)
+        self.metrics.add_gauge("central_active_alerts", "Alerts currently raised", lambda: len(self.alert_engine.active))
+        self.message_parser = MessageParser(connected_clients=connected_clients, storage=self.storage, metrics=self.metrics,
+                                            alert_engine=self.alert_engine)
+        self.message_parser.register_handler("motor_data", self.handle_motor_node)
+        self.fire_detector = FireDetector()
+        self.message_parser.add_reading_listener(self.fire_detector.update)
+        # Alerts are evaluated per reading and pushed to the nodes that subscribed
+        self.message_parser.add_reading_listener(self.alert_engine.observe)
+        self.alert_engine.add_listener(self.alert_router.dispatch)
+        self.message_parser.register_handler("alert_subscribe", self.alert_router.handle_subscribe)
+        self.message_parser.register_handler("alert_ack", self.alert_router.handle_ack)
         self.setup_ui()
         self.update_status_display()
 
-        self.FireNetParams = {
-           "temperature": 0,
-            "humidity": 0,
-            "smoke_level": 0,
-            "temp_threshold": 30, #temp threshold fore fire in farenheight
-            "humidity_threshold": 50,
-            "smoke_threshold": 100
-        }
+        # All UI refreshes go through the scheduler so bursts of messages coalesce
+        self.refresh = RefreshScheduler(self.root, REFRESH_INTERVAL_MS)
+        self.refresh.register("clients", self.update_clients_view)
+        self.refresh.register("dropdown", self.update_client_dropdown)
+        self.refresh.register("status", self.update_status_display)
+        self.refresh.register("detail", self.detail_view.refresh)
+        self.refresh.register("log", self.log_handler.pump)
+        # Dead nodes are evicted from the event loop thread, repaint the client list
+        connection_manager.liveness.add_listener(
+            lambda client_id, old, new: self.refresh.mark_dirty("clients", "dropdown", "status"))
+        self.log_handler.notify = lambda: self.refresh.mark_dirty("log")
+        self.refresh.start()
         
     def setup_ui(self):
         # Create notebook (tabs)
@@ -53,11 +118,13 @@ class ServerUI:
         self.clients_tab = ttk.Frame(self.notebook)
         self.message_tab = ttk.Frame(self.notebook)
         self.simulate_tab = ttk.Frame(self.notebook)  # New tab
+        self.charts_tab = ttk.Frame(self.notebook)
 
         self.notebook.add(self.server_tab, text="Server Control")
         self.notebook.add(self.clients_tab, text="Clients")
         self.notebook.add(self.message_tab, text="Message Builder")
         self.notebook.add(self.simulate_tab, text="Simulate")
+        self.notebook.add(self.charts_tab, text="Charts")
         
         # Server Control Tab
         self.setup_server_tab()
@@ -70,6 +137,10 @@ class ServerUI:
         
         # Simulate Tab
         self.setup_simulate_tab()
+        
+        # Charts Tab, redrawn at a fixed rate only while it is shown
+        self.charts = LiveCharts(self.charts_tab, self.notebook)
+        self.charts.start()
     
     def setup_server_tab(self):
         # Server Control Frame
@@ -98,7 +169,7 @@ class ServerUI:
         
         # Connected clients count
         ttk.Label(ip_frame, text="Connected Clients:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
-        self.client_count_var = tk.StringVar(value="0/5")
+        self.client_count_var = tk.StringVar(value=f"0/{MAX_CONNECTIONS}")
         ttk.Label(ip_frame, textvariable=self.client_count_var).grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
         
         # Log display
@@ -111,6 +182,8 @@ class ServerUI:
         
         # Add a custom handler to redirect logs to the text widget
         self.log_handler = TextHandler(self.log_display)
+        self.log_handler.setFormatter(SuppressionFormatter(LOG_FORMAT))
+        self.log_handler.addFilter(rate_limiter)
         logger.addHandler(self.log_handler)
     
     def setup_clients_tab(self):
@@ -148,9 +221,12 @@ class ServerUI:
         details_frame = ttk.LabelFrame(self.clients_tab, text="Client Details")
         details_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # Data from client
-        self.client_data = scrolledtext.ScrolledText(details_frame, height=10)
-        self.client_data.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        # Readings of the selected client, only the visible rows are rendered
+        self.detail_view = HistoryView(details_frame)
+        
+        # Rendered rows, used to diff the treeview on refresh
+        self.client_rows = {}
+        self.dropdown_version = None  # Registry version the dropdown was built from
         
         # Bind selection event
         self.clients_tree.bind('<<TreeviewSelect>>', self.on_client_select)
@@ -198,6 +274,7 @@ class ServerUI:
         
         ttk.Button(send_frame, text="Send to Selected Client", command=self.send_json_message).pack(side=tk.LEFT, padx=5)
         ttk.Button(send_frame, text="Send to All Clients", command=lambda: self.send_json_message(all_clients=True)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(send_frame, text="Request Node Logs", command=self.request_node_logs).pack(side=tk.LEFT, padx=5)
         ttk.Button()
         # Message templates
         templates_frame = ttk.LabelFrame(self.message_tab, text="Message Templates")
@@ -413,21 +490,15 @@ class ServerUI:
                 self.sim_client_id.delete(0, tk.END)
                 self.sim_client_id.insert(0, client_id)
             
-            # Create the simulated client
-            self.sim_client_info = {
-                "client_id": client_id,
-                "addr": (client_ip, 12345),  # Fake port
-                "connected_at": time.time(),
-                "last_message": None,
-                "data": []
-            }
+            # Create the simulated client (no reader/writer, fake port)
+            self.sim_client_info = Connection(client_id, None, None, (client_ip, 12345), HISTORY_RETENTION)
             
-            # Add to connected clients (exclude reader/writer which we don't need)
-            connected_clients[client_id] = self.sim_client_info
+            # Add to connected clients, simulated clients skip admission limits.
+            # The connection manager belongs to the event loop thread.
+            self.loop.call_soon_threadsafe(connection_manager.add, self.sim_client_info)
             
             # Update UI
-            self.update_clients_view()
-            self.update_client_dropdown()
+            self.refresh.mark_dirty("clients", "dropdown", "status")
             self.sim_client_connected = True
             self.sim_connect_button.config(text="Disconnect Simulated Client")
             
@@ -437,13 +508,12 @@ class ServerUI:
             
         else:
             # Disconnect simulated client
-            if self.sim_client_info and self.sim_client_info["client_id"] in connected_clients:
-                client_id = self.sim_client_info["client_id"]
-                del connected_clients[client_id]
+            if self.sim_client_info and self.loop:
+                client_id = self.sim_client_info.client_id
+                self.loop.call_soon_threadsafe(connection_manager.remove, client_id)
                 
                 # Update UI
-                self.update_clients_view()
-                self.update_client_dropdown()
+                self.refresh.mark_dirty("clients", "dropdown", "status")
                 
                 # Log
                 self.log_to_sim(f"Simulated client disconnected: {client_id}")
@@ -472,17 +542,10 @@ class ServerUI:
             message_text = self.sim_message_editor.get("1.0", tk.END).strip()
             json_data = json.loads(message_text)
             
-            # Get client info
-            client_id = self.sim_client_info["client_id"]
-            client_info = connected_clients[client_id]
-            
-            # Update client info as if we received a message
-            client_info["last_message"] = time.time()
-            client_info["data"].append(json_data)
+            # The connection belongs to the event loop, handle the message there like a received one
+            client_id = self.sim_client_info.client_id
+            asyncio.run_coroutine_threadsafe(self.receive_simulated(client_id, json_data), self.loop)
             
-            # Update UI
-            self.update_clients_view()
-            #await self.message_parser.parse_message(json_data,client_id=client_id)
             # Log the simulated message
             self.log_to_sim(f"Sent message: {message_text}")
             logger.info(f"Simulated message from {client_id}: {json_data}")
@@ -492,6 +555,18 @@ class ServerUI:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to simulate message: {str(e)}")
 
+    async def receive_simulated(self, client_id, message):
+        """Process a message from the simulated client as handle_client would"""
+        client_info = connected_clients.get(client_id)
+        if client_info is None:
+            return
+        client_info.last_message = time.time()
+        connection_manager.touch(client_id, client_info.last_message)
+        # Records the reading for history, storage, fire detection, alerts and the charts
+        response = await self.message_parser.parse_message(message, client_id)
+        logger.info(f"Response to simulated client {client_id}: {response}")
+        self.refresh.mark_dirty("clients", "detail")
+
     def toggle_continuous_simulation(self):
         """Start or stop continuous message simulation"""
         if self.continuous_sim_running:
@@ -542,8 +617,8 @@ class ServerUI:
         
         # Clean up simulated client if connected
         if hasattr(self, 'sim_client_connected') and self.sim_client_connected:
-            if self.sim_client_info and self.sim_client_info["client_id"] in connected_clients:
-                del connected_clients[self.sim_client_info["client_id"]]
+            if self.sim_client_info and self.loop:
+                self.loop.call_soon_threadsafe(connection_manager.remove, self.sim_client_info.client_id)
         
         # Original closing logic
         if self.server_running:
@@ -557,6 +632,24 @@ class ServerUI:
         self.message_editor.delete("1.0", tk.END)
         self.message_editor.insert("1.0", template)
     
+    def request_node_logs(self):
+        """Ask the selected node to send the log entries buffered in its RAM ring"""
+        if not self.server_running or self.loop is None:
+            messagebox.showwarning("Server not running", "The server is not running. Start it first.")
+            return
+        selected_client = self.target_client.get()
+        if not selected_client:
+            messagebox.showwarning("No client selected", "Please select a client from the dropdown.")
+            return
+        client_id = selected_client.split(' ')[0]
+        if client_id not in connected_clients.snapshot().clients:
+            messagebox.showwarning("Client not found", f"Client {client_id} is no longer connected.")
+            self.refresh.mark_dirty("dropdown")
+            return
+        # The node answers with node_logs, re-logged under Node.<name> in the log panel
+        self.broadcaster.send_threadsafe(self.loop, client_id, {"msg_id": "log_dump"})
+        logger.info(f"Requested buffered logs from client {client_id}")
+    
     def send_json_message(self, all_clients=False):
         """Send JSON message to selected client or all clients"""
         try:
@@ -564,23 +657,15 @@ class ServerUI:
             message_text = self.message_editor.get("1.0", tk.END)
             json_data = json.loads(message_text)
             
-            # Format message
-            message = json.dumps(json_data) + '\n'
-            encoded_message = message.encode('utf-8')
-            
-            if not self.server_running:
+            if not self.server_running or self.loop is None:
                 messagebox.showwarning("Server not running", "The server is not running. Start it first.")
                 return
             
+            # Writers belong to the event loop, hand the message over instead of writing from the Tk thread
             if all_clients:
-                # Send to all clients
-                for client_id, client_info in connected_clients.items():
-                    try:
-                        client_info["writer"].write(encoded_message)
-                        asyncio.run_coroutine_threadsafe(client_info["writer"].drain(), self.loop)
-                        logger.info(f"Message sent to all clients")
-                    except Exception as e:
-                        logger.error(f"Failed to send to client {client_id}: {e}")
+                # Send to all clients, encoded once and queued per connection
+                self.broadcaster.broadcast_threadsafe(self.loop, json_data)
+                logger.info(f"Message queued for all clients")
             else:
                 # Send to selected client
                 selected_client = self.target_client.get()
@@ -590,16 +675,12 @@ class ServerUI:
                 
                 client_id = selected_client.split(' ')[0]  # Extract ID from combobox text
                 
-                if client_id in connected_clients:
-                    try:
-                        connected_clients[client_id]["writer"].write(encoded_message)
-                        asyncio.run_coroutine_threadsafe(connected_clients[client_id]["writer"].drain(), self.loop)
-                        logger.info(f"Message sent to client {client_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to send to client {client_id}: {e}")
+                if client_id in connected_clients.snapshot().clients:
+                    self.broadcaster.send_threadsafe(self.loop, client_id, json_data)
+                    logger.info(f"Message queued for client {client_id}")
                 else:
                     messagebox.showwarning("Client not found", f"Client {client_id} is no longer connected.")
-                    self.update_client_dropdown()
+                    self.refresh.mark_dirty("dropdown")
         
         except json.JSONDecodeError:
             messagebox.showerror("Invalid JSON", "The message is not valid JSON.")
@@ -639,28 +720,34 @@ class ServerUI:
             self.server_button.config(text="Start Server")
             self.ip_var.set("Not running")
             self.port_var.set("Not running")
-            self.client_count_var.set("0/5")
+            self.client_count_var.set(f"0/{MAX_CONNECTIONS}")
             
             # Clear the clients treeview
             for item in self.clients_tree.get_children():
                 self.clients_tree.delete(item)
+            self.client_rows.clear()
             
             logger.info("Server stopped")
     
     async def cleanup_server(self):
         """Clean up the server resources"""
         # Close all client connections
-        for client_id, client_info in connected_clients.items():
-            client_info["writer"].close()
-            await client_info["writer"].wait_closed()
-        
-        connected_clients.clear()
+        for client_id, client_info in list(connected_clients.items()):
+            connection_manager.remove(client_id)
+            if client_info.writer is not None:
+                client_info.writer.close()
+                await client_info.writer.wait_closed()
+        connected_clients.publish()
         
         # Close the server
         if self.server:
             self.server.close()
             await self.server.wait_closed()
             self.server = None
+        if self.metrics_server:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+            self.metrics_server = None
     
     def run_server(self):
         """Run the asyncio server"""
@@ -668,7 +755,9 @@ class ServerUI:
             host = "0.0.0.0"  # Listen on all network interfaces
             port = 8765
             
-            self.server = await asyncio.start_server(self.handle_client, host, port)
+            raise_fd_limit()
+            self.server = await asyncio.start_server(self.handle_client, host, port, backlog=LISTEN_BACKLOG)
+            self.metrics_server = await serve_metrics(self.metrics, METRICS_HOST, METRICS_PORT)
             
             addr = self.server.sockets[0].getsockname()
             logger.info(f'TCP server started on {addr}')
@@ -688,6 +777,9 @@ class ServerUI:
             
             # Start status monitor 
             monitor_task = asyncio.create_task(self.status_monitor())
+            liveness_task = asyncio.create_task(connection_manager.supervise())
+            fire_task = asyncio.create_task(self.fire_monitor())
+            publish_task = asyncio.create_task(self.client_publisher())
             
             async with self.server:
                 try:
@@ -707,7 +799,7 @@ class ServerUI:
         finally:
             self.loop.close()
             self.loop = None
-    def handle_motor_node(self,message,client_id):
+    async def handle_motor_node(self,message,client_id):
         """ {
         "msg_id": "fire_conditions",
         "node_position": "[x_pos y_pos]",
@@ -722,35 +814,21 @@ class ServerUI:
         msg_id = "fire_conditions"
         node_position = [random.randint(0,100),random.randint(0,100)]
 
-        temp_trigger = False
-        humidity_trigger = False    
-        smoke_trigger = False
-
-        if self.FireNetParams["temperature"] > self.FireNetParams["temp_threshold"]:
-            temp_trigger = True
-        else:
-            temp_trigger = False
-        if self.FireNetParams["humidity"] > self.FireNetParams["humidity_threshold"]:
-            humidity_trigger = True
-        else:
-            humidity_trigger = False
-        if self.FireNetParams["smoke_level"] > self.FireNetParams["smoke_threshold"]:
-            smoke_trigger = True
-        else:
-            smoke_trigger = False
-
-
-        fire_conditions = temp_trigger and humidity_trigger and smoke_trigger
+        # Fire state of every node, as of the last fire_monitor pass
+        fire_nodes = self.fire_detector.fire_nodes()
+        fire_conditions = bool(fire_nodes)
         timestamp = time.time()
 
         payload = {
             "msg_id": msg_id,
             "node_position": node_position,
             "fire_conditions": fire_conditions,
+            "fire_nodes": fire_nodes,
             "timestamp": timestamp
         }
         
         #TODO: Add motor node handling here
+        return payload
 
 
 
@@ -760,31 +838,20 @@ class ServerUI:
         client_id = str(uuid.uuid4())
         addr = writer.get_extra_info('peername')
         
-        client_info = {
-            "reader": reader,
-            "writer": writer,
-            "addr": addr,
-            "connected_at": time.time(),
-            "last_message": None,
-            "data": []
-        }
-        
         # Check if we can accept more clients
-        if len(connected_clients) >= MAX_CLIENTS:
-            logger.warning(f"Maximum clients reached. Rejecting new connection from {addr}")
-            writer.write(json.dumps({"status": "error", "message": "Server full"}).encode() + b'\n')
+        client_info, reason = connection_manager.admit(client_id, reader, writer, addr)
+        if client_info is None:
+            logger.warning(f"Rejecting new connection from {addr}: {reason}")
+            writer.write(json.dumps({"status": "error", "message": reason}).encode() + b'\n')
             await writer.drain()
             writer.close()
             await writer.wait_closed()
             return
         
-        # Add the client to our dictionary
-        connected_clients[client_id] = client_info
         logger.info(f"New client connected from {addr}. ID: {client_id}. Total clients: {len(connected_clients)}")
         
         # Update the UI in the main thread
-        self.root.after(0, self.update_clients_view)
-        self.root.after(0, self.update_client_dropdown)
+        self.refresh.mark_dirty("clients", "dropdown", "status")
         
         try:
             # Send welcome message
@@ -793,50 +860,60 @@ class ServerUI:
             
             # Handle messages from the client
             while True:
-                data = await reader.readline()
-                if not data:  # Client disconnected
-                    break
-                    
                 try:
-                    decoded_data = data.decode('utf-8')
-                    message = json.loads(decoded_data)
-                    logger.info(f"Received data from {client_id}: {message}")
+                    # JSON line or binary frame, depending on what the node negotiated
+                    frame = await wire_protocol.read_frame(reader)
+                    if not frame:  # Client disconnected
+                        break
+                    decode_start = time.perf_counter()
+                    message = wire_protocol.decode_frame(frame, self.message_parser.node_codes)
+                    decode_time = time.perf_counter() - decode_start
+                    logger.info("Received data from %s: %s", client_id, message)
 
                     # Update client info
-                    client_info["last_message"] = time.time()
-                    client_info["data"].append(message)
+                    client_info.last_message = time.time()
+                    connection_manager.touch(client_id, client_info.last_message)
                     
                     # Update UI
-                    self.root.after(0, self.update_clients_view)
-
-                    response = None
-                    if message.get("msg_id") == "node_update":
-                        response = await self.handle_node_update(message,client_id)
-                    elif message.get("msg_id") == "dhtt_data":
-                        response = await self.handle_dhtt_sensor(message,client_id)
-                    elif message.get("msg_id") == "motor_data":
-                        response = await self.handle_motor_node(message,client_id)
-                    else:
-                        response = self.default_handler(message,client_id)
+                    self.refresh.mark_dirty("clients", "detail")
+
+                    response = await self.message_parser.parse_message(message, client_id)
+                    node = client_info.node_name or client_id
+                    msg_id = message.get("msg_id") if isinstance(message, dict) else None
+                    if msg_id == "node_update":
+                        # The node has a name now, relabel it in the chart node list
+                        self.refresh.mark_dirty("dropdown")
+                    self.metrics.record_message(msg_id, node, len(frame), decode_time)
+                    
                     writer.write(json.dumps(response).encode() + b'\n')
+                    drain_start = time.perf_counter()
                     await writer.drain()
+                    self.metrics.record_drain(node, time.perf_counter() - drain_start)
                     
-                except json.JSONDecodeError:
-                    logger.error(f"Invalid JSON from client {client_id}")
-                    writer.write(json.dumps({"status": "error", "message": "Invalid JSON"}).encode() + b'\n')
+                except ValueError as e:
+                    logger.error(f"Invalid message from client {client_id}: {e}")
+                    self.metrics.record_error(client_info.node_name or client_id)
+                    writer.write(json.dumps({"status": "error", "message": "Invalid message"}).encode() + b'\n')
                     await writer.drain()
         
+        except asyncio.IncompleteReadError:
+            logger.info(f"Client {client_id} disconnected mid-frame")
+        
         except Exception as e:
             logger.error(f"Error handling client {client_id}: {e}")
         
         finally:
             # Remove client when they disconnect
-            if client_id in connected_clients:
-                del connected_clients[client_id]
+            self.broadcaster.discard(client_id)
+            self.alert_router.unsubscribe(client_id)
+            self.alert_engine.forget(client_id)
+            self.metrics.forget_node(client_id)
+            if self.fire_detector.forget(client_id):
+                logger.info(f"Fire conditions at {client_info.node_name or client_id} no longer tracked, the node disconnected")
+            if connection_manager.remove(client_id) is not None:
                 logger.info(f"Client {client_id} disconnected. Total clients: {len(connected_clients)}")
                 # Update UI
-                self.root.after(0, self.update_clients_view)
-                self.root.after(0, self.update_client_dropdown)
+                self.refresh.mark_dirty("clients", "dropdown", "status")
             try:
                 writer.close()
                 await writer.wait_closed()
@@ -844,84 +921,73 @@ class ServerUI:
                 logger.warning(f"Connection was reset by client {client_id}")
             except Exception as e:
                 logger.error(f"Error while closing connection with client {client_id}: {e}")
-    async def default_handler(self, message, client_id):
-        """Handle unknown message types"""
-        logger.warning(f"No handler for message type: {message.get('msg_id', 'unknown')}")
-        resp = {"msg_id": "unknown_message_type", "status": "error", "message": f"Unknown message type: {message.get('msg_id', 'unknown')}"}
-        return resp
-    async def handle_dhtt_sensor(self,message, client_id):
-        """Handle DHT11 sensor data messages"""
-
-        """ {'timestamp': 799274659, 'temperature': 25.7, 'humidity': 42.6, 'node_name': 'DHTT Node', 'msg_id': 'dhtt_data'} """
-        timestamp = message.get("timestamp", time.time())
-        temperature = message.get("temperature", 0.0)
-        humidity = message.get("humidity", 0.0)
-        node_name = message.get("node_name", "Unknown Node")
-
-        logger.info(f"DHTT sensor data from {node_name} (ID: {client_id}): {temperature}C, {humidity}%")
-    async def handle_node_update(self, message, client_id):
-        """Handle node_update messages"""
-        node_name = message.get("node_name", "Unknown Node")
-        node_type = message.get("node_type", "Generic")
-        version = message.get("version", "Unknown")
-        
-        # Update client information with node details
-        if client_id in connected_clients:
-            connected_clients[client_id]["node_name"] = node_name
-            connected_clients[client_id]["node_type"] = node_type
-            connected_clients[client_id]["version"] = version
-            
-            # Additional fields if present
-            if "capabilities" in message:
-                connected_clients[client_id]["capabilities"] = message["capabilities"]
-                
-            logger.info(f"Node update from {node_name} (ID: {client_id}, Type: {node_type}, Version: {version})")
-            
-            # Return success response
-            return {
-                "msg_id": "node_update_response",
-                "status": "success", 
-                "message": "Node update received",
-                "timestamp": time.time()
-            }
-        else:
-            logger.warning(f"Received node_update from unknown client ID: {client_id}")
-            return {"status": "error", "message": "Client not recognized"}
-    async def handle_voc_sensor(self,message, client_id):
-        """Received data from 9a6db783-107c-4567-b7f4-c337cc09e82a: {'timestamp': 799286919, 'Avg VOC': '100.1867', 'Threshold': False, 'node_name': "John's Test Node", 'msg_id': 'Average VOC Gas Reading'}"""
+    async def fire_monitor(self):
+        """Evaluate fire conditions for all nodes once per interval and log state changes"""
+        while True:
+            for node, fire_present in self.fire_detector.evaluate():
+                if fire_present:
+                    logger.warning(f"Fire conditions detected at {node}")
+                else:
+                    logger.info(f"Fire conditions cleared at {node}")
+            await asyncio.sleep(FIRE_EVAL_INTERVAL)
+    async def client_publisher(self):
+        """Publish client registry snapshots for the Tk thread, once per UI refresh"""
+        while True:
+            if connected_clients.publish():
+                self.refresh.mark_dirty("clients", "dropdown", "status")
+            await asyncio.sleep(CLIENT_PUBLISH_INTERVAL)
     async def status_monitor(self):
         """Periodically update server status"""
         while True:
             # Update client count in UI (must be done in main thread)
-            self.root.after(0, self.update_status_display)
+            self.refresh.mark_dirty("status")
             await asyncio.sleep(5)  # Update every 5 seconds
     
     def update_status_display(self):
         """Update the status display"""
-        self.client_count_var.set(f"{len(connected_clients)}/{MAX_CLIENTS}")
+        self.client_count_var.set(f"{len(connected_clients.snapshot())}/{MAX_CONNECTIONS}")
     
     def update_clients_view(self):
-        """Update the clients treeview with current clients"""
-        # Clear existing items
-        for item in self.clients_tree.get_children():
+        """Update the clients treeview, touching only rows that changed"""
+        # client_rows maps client_id -> (treeview item, last_message timestamp rendered)
+        rows = self.client_rows
+        # One immutable view for the whole pass, the server thread keeps changing the connections
+        clients = connected_clients.snapshot().clients
+        
+        # Drop rows for clients that went away
+        for client_id in [cid for cid in rows if cid not in clients]:
+            item, _ = rows.pop(client_id)
             self.clients_tree.delete(item)
         
-        # Add current clients
-        for client_id, client_info in connected_clients.items():
-            ip, port = client_info["addr"]
-            connected_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(client_info["connected_at"]))
+        for client_id, client_info in clients.items():
+            row = rows.get(client_id)
+            last_seen = client_info.last_message
+            if row is not None and row[1] == last_seen:
+                continue
             
             last_message = "Never"
-            if client_info["last_message"]:
-                last_message = time.strftime("%H:%M:%S", time.localtime(client_info["last_message"]))
+            if last_seen:
+                last_message = time.strftime("%H:%M:%S", time.localtime(last_seen))
             
-            self.clients_tree.insert('', tk.END, values=(client_id, ip, port, connected_at, last_message))
+            if row is None:
+                ip, port = client_info.addr
+                connected_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(client_info.connected_at))
+                item = self.clients_tree.insert('', tk.END, values=(client_id, ip, port, connected_at, last_message))
+            else:
+                item = row[0]
+                self.clients_tree.set(item, 'last_message', last_message)
+            rows[client_id] = (item, last_seen)
     
     def update_client_dropdown(self):
         """Update the client dropdown in the message tab"""
+        snapshot = connected_clients.snapshot()
+        self.charts.update_nodes(snapshot)
+        if snapshot.version == self.dropdown_version:
+            return
+        self.dropdown_version = snapshot.version
         clients = []
-        for client_id, client_info in connected_clients.items():
-            ip, port = client_info["addr"]
+        for client_id, client_info in snapshot.clients.items():
+            ip, port = client_info.addr
             clients.append(f"{client_id} ({ip}:{port})")
         
         self.target_client['values'] = clients
@@ -937,46 +1003,426 @@ class ServerUI:
         item = selected_items[0]
         client_id = self.clients_tree.item(item, 'values')[0]
         
-        if client_id in connected_clients:
-            self.client_data.config(state=tk.NORMAL)
-            self.client_data.delete("1.0", tk.END)
-            
-            client_info = connected_clients[client_id]
-            data = client_info["data"]
-            
-            if data:
-                for i, msg in enumerate(data):
-                    self.client_data.insert(tk.END, f"Message {i+1}:\n")
-                    self.client_data.insert(tk.END, json.dumps(msg, indent=4) + "\n\n")
-            else:
-                self.client_data.insert(tk.END, "No data received from this client yet.")
-            
-            self.client_data.config(state=tk.DISABLED)
+        client_info = connected_clients.snapshot().clients.get(client_id)
+        if client_info is not None:
+            self.detail_view.show(client_info.history)
     
     def on_closing(self):
         """Handle window close event"""
         if self.server_running:
             if messagebox.askokcancel("Quit", "The server is still running. Do you want to stop it and quit?"):
                 self.stop_server()
+                self.refresh.stop()
+                self.charts.stop()
+                self.storage.stop()
+                logger.removeHandler(self.log_handler)
                 self.root.destroy()
         else:
+            self.refresh.stop()
+            self.charts.stop()
+            self.storage.stop()
+            logger.removeHandler(self.log_handler)
             self.root.destroy()
 
+class HistoryView:
+    """Virtualized view of one client's reading history.
+
+    Only the rows that fit in the text widget are formatted. The scrollbar,
+    mouse wheel and page buttons move a window over the ClientHistory ring,
+    so a client with a full history is as cheap to show as one with a
+    single reading. The window is anchored to reading numbers: it stays on
+    the same readings while new ones arrive, and follows the newest when
+    scrolled to the end. Above the rows, each metric is summarized as a
+    sparkline computed from the history columns.
+    """
+    def __init__(self, parent, sparkline_width=SPARKLINE_WIDTH):
+        self.history = None
+        self.first = 0  # Reading number (0-based, over the whole stream) of the top row
+        self.follow = True  # Keep the newest reading in view
+        self.rendered = None  # State of the last render, to skip refreshes that change nothing
+        self.sparkline_width = sparkline_width
+
+        font = tkfont.nametofont("TkFixedFont")
+        self.line_height = max(1, font.metrics("linespace"))
+
+        self.sparklines = tk.Text(parent, height=1, wrap=tk.NONE, font=font, state=tk.DISABLED)
+        self.sparklines.pack(fill=tk.X, padx=5, pady=(5, 0))
+
+        nav = ttk.Frame(parent)
+        nav.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Button(nav, text="<<", width=3, command=lambda: self.yview("moveto", 0)).pack(side=tk.LEFT)
+        ttk.Button(nav, text="<", width=3, command=lambda: self.yview("scroll", -1, "pages")).pack(side=tk.LEFT)
+        ttk.Button(nav, text=">", width=3, command=lambda: self.yview("scroll", 1, "pages")).pack(side=tk.LEFT)
+        ttk.Button(nav, text=">>", width=3, command=lambda: self.yview("moveto", 1)).pack(side=tk.LEFT)
+        self.position_var = tk.StringVar(value="No client selected")
+        ttk.Label(nav, textvariable=self.position_var).pack(side=tk.LEFT, padx=10)
+
+        body = ttk.Frame(parent)
+        body.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        self.text = tk.Text(body, height=10, wrap=tk.NONE, font=font, state=tk.DISABLED)
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # The text widget never holds more than a screenful, so it cannot scroll itself
+        self.text.bind("<Configure>", lambda event: self.render())
+        self.text.bind("<MouseWheel>", lambda event: self.yview("scroll", -1 if event.delta > 0 else 1, "units") or "break")
+        self.text.bind("<Button-4>", lambda event: self.yview("scroll", -1, "units") or "break")
+        self.text.bind("<Button-5>", lambda event: self.yview("scroll", 1, "units") or "break")
+
+    def show(self, history):
+        """Display a client's history, starting at its newest readings"""
+        self.history = history
+        self.follow = True
+        self.rendered = None
+        self.render()
+
+    def refresh(self):
+        """Called when readings arrived, repaints only if the view changes"""
+        if self.history is not None:
+            self.render()
+
+    def visible_rows(self):
+        return max(1, self.text.winfo_height() // self.line_height)
+
+    def yview(self, *args):
+        """Scrollbar protocol: ("moveto", fraction) or ("scroll", n, "units"/"pages")"""
+        history = self.history
+        if history is None:
+            return
+        oldest = history.total - len(history)
+        rows = self.visible_rows()
+        top = max(self.first, oldest)
+        if args[0] == "moveto":
+            top = oldest + int(float(args[1]) * len(history))
+        elif args[0] == "scroll":
+            top += int(args[1]) * (rows if args[2] == "pages" else 1)
+        self.first = min(max(top, oldest), max(history.total - rows, oldest))
+        self.follow = self.first >= history.total - rows
+        self.render()
+
+    def render(self):
+        history = self.history
+        rows = self.visible_rows()
+        if history is None:
+            return
+        size = len(history)
+        oldest = history.total - size
+        if self.follow:
+            self.first = max(history.total - rows, oldest)
+        # Readings that rolled out of the ring push the window forward
+        self.first = max(self.first, oldest)
+        state = (id(history), history.total, self.first, rows)
+        if state == self.rendered:
+            return
+        self.rendered = state
+
+        start = self.first - oldest
+        stop = min(start + rows, size)
+        lines = [self.format_row(oldest + i + 1, history.row(i)) for i in range(start, stop)]
+        if not lines:
+            lines = ["No data received from this client yet."]
+        self._replace(self.text, "\n".join(lines))
+
+        if size:
+            self.scrollbar.set(start / size, stop / size)
+            self.position_var.set(f"Readings {self.first + 1}-{self.first + stop - start} of {history.total}"
+                                  f" ({size} kept)")
+        else:
+            self.scrollbar.set(0, 1)
+            self.position_var.set("No readings")
+        self.render_sparklines()
+
+    def render_sparklines(self):
+        lines = []
+        for name in ClientHistory.COLUMNS:
+            summary = self.history.summary(name, self.sparkline_width)
+            if summary is None:
+                continue
+            low, high = summary["min"], summary["max"]
+            span = (high - low) or 1.0
+            chars = []
+            for value in summary["buckets"]:
+                if math.isnan(value):
+                    chars.append(" ")
+                else:
+                    chars.append(SPARK_CHARS[min(len(SPARK_CHARS) - 1, int((value - low) / span * len(SPARK_CHARS)))])
+            lines.append(f"{name:<12} {''.join(chars):<{self.sparkline_width}}  "
+                         f"min {low:.2f}  max {high:.2f}  last {summary['last']:.2f}")
+        self.sparklines.config(height=max(1, len(lines)))
+        self._replace(self.sparklines, "\n".join(lines) or "No sensor readings")
+
+    @staticmethod
+    def format_row(number, reading):
+        """One line per reading instead of pretty-printed JSON"""
+        fields = [f"{number:>8}", time.strftime("%H:%M:%S", time.localtime(reading["timestamp"]))]
+        for name, value in reading.items():
+            if name == "timestamp":
+                continue
+            if name == "motor_position":
+                fields.append(f"motor_position=({value[0]:.2f}, {value[1]:.2f})")
+            else:
+                fields.append(f"{name}={value:.2f}")
+        return "  ".join(fields)
+
+    @staticmethod
+    def _replace(widget, text):
+        widget.config(state=tk.NORMAL)
+        widget.delete("1.0", tk.END)
+        widget.insert("1.0", text)
+        widget.config(state=tk.DISABLED)
+
+class LiveCharts:
+    """Streaming line charts of temperature, humidity and smoke per node.
+
+    Each frame plots the last window seconds of every shown node straight
+    from its ClientHistory ring, which handle_client fills as messages
+    arrive. The history is min-max decimated to one bucket per pixel
+    column, so a frame draws at most two points per pixel and series
+    whatever the number of readings. Canvas items are reused between
+    frames; only their coordinates change.
+    """
+    METRICS = (("temperature", "Temperature"), ("humidity", "Humidity"), ("smoke_level", "Smoke"))
+    MARGIN_LEFT = 55
+    MARGIN_RIGHT = 10
+    MARGIN_TOP = 18
+    MARGIN_BOTTOM = 18
+
+    def __init__(self, parent, notebook, frame_ms=CHART_FRAME_MS, max_series=CHART_MAX_SERIES):
+        self.parent = parent
+        self.notebook = notebook
+        self.frame_ms = frame_ms
+        self.max_series = max_series
+        self.node_ids = []  # client_id per listbox row
+        self.node_labels = []  # Text of each listbox row
+        self.lines = {}  # (metric, client_id) -> canvas line item
+        self.job = None
+
+        controls = ttk.Frame(parent)
+        controls.pack(side=tk.LEFT, fill=tk.Y, padx=10, pady=10)
+        ttk.Label(controls, text="Nodes").pack(anchor=tk.W)
+        self.node_list = tk.Listbox(controls, selectmode=tk.MULTIPLE, exportselection=False, width=28)
+        self.node_list.pack(fill=tk.Y, expand=True)
+        ttk.Label(controls, text=f"None selected shows the first {max_series}").pack(anchor=tk.W)
+        ttk.Label(controls, text="Window (s)").pack(anchor=tk.W, pady=(10, 0))
+        self.window_var = tk.StringVar(value=str(CHART_WINDOWS[1]))
+        ttk.Combobox(controls, textvariable=self.window_var, values=CHART_WINDOWS, width=8,
+                     state="readonly").pack(anchor=tk.W)
+
+        plots = ttk.Frame(parent)
+        plots.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10), pady=10)
+        self.canvases = {}
+        self.labels = {}  # metric -> {name: canvas item}
+        for metric, title in self.METRICS:
+            canvas = tk.Canvas(plots, background="white", highlightthickness=0, height=120)
+            canvas.pack(fill=tk.BOTH, expand=True, pady=2)
+            self.canvases[metric] = canvas
+            self.labels[metric] = {
+                "title": canvas.create_text(self.MARGIN_LEFT, 2, anchor=tk.NW, text=title),
+                "high": canvas.create_text(self.MARGIN_LEFT - 4, self.MARGIN_TOP, anchor=tk.E),
+                "low": canvas.create_text(self.MARGIN_LEFT - 4, 0, anchor=tk.E),
+                "start": canvas.create_text(self.MARGIN_LEFT, 0, anchor=tk.SW),
+                "end": canvas.create_text(0, 0, anchor=tk.SE),
+                "frame": canvas.create_rectangle(0, 0, 0, 0, outline="#cccccc"),
+            }
+
+    def start(self):
+        if self.job is None:
+            self.job = self.parent.after(self.frame_ms, self._frame)
+
+    def stop(self):
+        if self.job is not None:
+            self.parent.after_cancel(self.job)
+            self.job = None
+
+    def update_nodes(self, snapshot):
+        """Sync the node list with a registry snapshot, keeping the selection"""
+        clients = list(snapshot.clients.items())
+        node_ids = [client_id for client_id, _ in clients]
+        # Nodes are listed by id until their node_update names them
+        labels = [client_info.node_name or client_id for client_id, client_info in clients]
+        if node_ids == self.node_ids and labels == self.node_labels:
+            return
+        selected = {self.node_ids[i] for i in self.node_list.curselection() if i < len(self.node_ids)}
+        self.node_list.delete(0, tk.END)
+        for label in labels:
+            self.node_list.insert(tk.END, label)
+        for i, client_id in enumerate(node_ids):
+            if client_id in selected:
+                self.node_list.selection_set(i)
+        self.node_ids = node_ids
+        self.node_labels = labels
+
+    def _frame(self):
+        try:
+            if self.notebook.select() == str(self.parent):
+                self.draw()
+        except Exception as e:
+            logger.error(f"Chart redraw failed: {e}")
+        self.job = self.parent.after(self.frame_ms, self._frame)
+
+    def shown_series(self):
+        """(client_id, label, history) of the nodes to plot"""
+        clients = connected_clients.snapshot().clients
+        selected = [self.node_ids[i] for i in self.node_list.curselection() if i < len(self.node_ids)]
+        if not selected:
+            selected = [client_id for client_id, info in clients.items() if len(info.history)]
+            selected = selected[:self.max_series]
+        series = []
+        for client_id in selected:
+            client_info = clients.get(client_id)
+            if client_info is not None:
+                series.append((client_id, client_info.node_name or client_id[:8], client_info.history))
+        return series
+
+    def draw(self):
+        end = time.time()
+        start = end - float(self.window_var.get())
+        series = self.shown_series()
+        shown = set()
+        for metric, _ in self.METRICS:
+            canvas = self.canvases[metric]
+            width = canvas.winfo_width()
+            height = canvas.winfo_height()
+            left, top = self.MARGIN_LEFT, self.MARGIN_TOP
+            right, bottom = width - self.MARGIN_RIGHT, height - self.MARGIN_BOTTOM
+            plot_width = max(1, right - left)
+
+            points = [(client_id, history.minmax(metric, start, end, plot_width))
+                      for client_id, _, history in series]
+            values = [value for _, series_points in points for _, value in series_points]
+            low, high = (min(values), max(values)) if values else (0.0, 1.0)
+            if high - low < 1e-9:
+                low, high = low - 0.5, high + 0.5
+            y_scale = (bottom - top) / (high - low)
+
+            for index, (client_id, series_points) in enumerate(points):
+                coords = []
+                for bucket, value in series_points:
+                    coords.append(left + bucket)
+                    coords.append(bottom - (value - low) * y_scale)
+                if len(coords) == 2:  # A single point still shows as a dot
+                    coords += [coords[0] + 1, coords[1]]
+                if not coords:
+                    continue
+                key = (metric, client_id)
+                color = CHART_COLORS[index % len(CHART_COLORS)]
+                item = self.lines.get(key)
+                if item is None:
+                    self.lines[key] = canvas.create_line(*coords, fill=color)
+                else:
+                    canvas.coords(item, *coords)
+                    canvas.itemconfig(item, fill=color)
+                shown.add(key)
+
+            labels = self.labels[metric]
+            canvas.coords(labels["frame"], left, top, right, bottom)
+            canvas.itemconfig(labels["high"], text=f"{high:.1f}")
+            canvas.coords(labels["low"], left - 4, bottom)
+            canvas.itemconfig(labels["low"], text=f"{low:.1f}")
+            canvas.coords(labels["start"], left, height)
+            canvas.itemconfig(labels["start"], text=time.strftime("%H:%M:%S", time.localtime(start)))
+            canvas.coords(labels["end"], right, height)
+            canvas.itemconfig(labels["end"], text=time.strftime("%H:%M:%S", time.localtime(end)))
+        # Legend along the top chart, colors follow the series order
+        top_canvas = self.canvases[self.METRICS[0][0]]
+        top_canvas.delete("legend")
+        x = top_canvas.winfo_width() - self.MARGIN_RIGHT
+        for index in reversed(range(len(series))):
+            item = top_canvas.create_text(x, 2, anchor=tk.NE, text=series[index][1], tags="legend",
+                                          fill=CHART_COLORS[index % len(CHART_COLORS)])
+            x = top_canvas.bbox(item)[0] - 10
+
+        # Drop lines of nodes that are no longer plotted
+        for key in [key for key in self.lines if key not in shown]:
+            self.canvases[key[0]].delete(self.lines.pop(key))
+
+class RefreshScheduler:
+    """Coalesces UI refresh requests into at most one repaint per interval.
+
+    mark_dirty only sets flags under a lock, so it is safe to call from the
+    server thread. The Tk thread polls the flags every interval and runs each
+    registered refresh callback at most once per tick.
+    """
+    def __init__(self, root, interval_ms=REFRESH_INTERVAL_MS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.callbacks = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._job = None
+    
+    def register(self, name, callback):
+        """Register a refresh callback under a dirty-flag name"""
+        self.callbacks[name] = callback
+    
+    def mark_dirty(self, *names):
+        """Flag one or more parts of the UI for repaint on the next tick"""
+        with self._lock:
+            self._dirty.update(names)
+    
+    def start(self):
+        if self._job is None:
+            self._job = self.root.after(self.interval_ms, self._tick)
+    
+    def stop(self):
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+            self._job = None
+    
+    def _tick(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        
+        # Run in registration order so the table is drawn before dependent widgets
+        for name, callback in self.callbacks.items():
+            if name in dirty:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"UI refresh '{name}' failed: {e}")
+        
+        self._job = self.root.after(self.interval_ms, self._tick)
+
 class TextHandler(logging.Handler):
-    """Handler that redirects logging output to a tkinter Text widget"""
-    def __init__(self, text_widget):
+    """Handler that shows logging output in a bounded tkinter Text widget.
+
+    emit() can run on any thread; it formats the record there, while its
+    arguments still hold the logged values, and appends the line to a
+    ring, so a burst of logs drops the oldest lines instead of queueing Tk
+    work. pump() runs on the Tk thread: it inserts what arrived since the
+    last call in one go and trims the oldest lines in batches once the
+    widget holds more than max_lines.
+    """
+    def __init__(self, text_widget, max_lines=LOG_MAX_LINES, trim_batch=LOG_TRIM_BATCH):
         logging.Handler.__init__(self)
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.trim_batch = trim_batch
+        self.records = deque(maxlen=max_lines)  # Formatted lines
+        self.lines = 0  # Lines currently in the widget
+        self.notify = None  # Called after each record, e.g. to schedule a pump
     
     def emit(self, record):
-        msg = self.format(record)
-        
-        # Schedule the update in the main thread
-        self.text_widget.after(0, self.update_widget, msg)
+        self.records.append(self.format(record))
+        if self.notify is not None:
+            self.notify()
     
-    def update_widget(self, msg):
+    def pump(self):
+        records = []
+        while self.records:
+            records.append(self.records.popleft())
+        if not records:
+            return
+        text = "\n".join(records) + "\n"
+        
         self.text_widget.config(state=tk.NORMAL)
-        self.text_widget.insert(tk.END, msg + '\n')
+        self.text_widget.insert(tk.END, text)
+        self.lines += text.count("\n")
+        if self.lines > self.max_lines + self.trim_batch:
+            excess = self.lines - self.max_lines
+            self.text_widget.delete("1.0", f"{excess + 1}.0")
+            self.lines -= excess
         self.text_widget.see(tk.END)  # Scroll to the end
         self.text_widget.config(state=tk.DISABLED)
 def get_ip_address():
@@ -993,4 +1439,7 @@ def get_ip_address():
 if __name__ == "__main__":
     root = tk.Tk()
     app = ServerUI(root)
-    root.mainloop()
\ No newline at end of file
+    try:
+        root.mainloop()
+    finally:
+        stop_logging()
\ No newline at end of file
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import json
 import logging
@@ -5,14 +6,85 @@ import os
 import sys
 import time
 import uuid
+from connection_manager import ConnectionManager, raise_fd_limit
+from message_parser import MessageParser
+from storage_engine import StorageEngine
+from fire_detection import FireDetector
+from alerting import AlertEngine, AlertRouter
+from broadcast import Broadcaster
+from metrics import ServerMetrics, add_broadcast_gauges, add_server_gauges, add_storage_gauges, serve_metrics
+import wire_protocol
+from log_pipeline import setup_logging, stop_logging
+import shard_cluster
+from shard_cluster import ClusterLink
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+setup_logging(level=logging.INFO)
 logger = logging.getLogger("SocketServer")
 
+# Connection limits
+MAX_CONNECTIONS = 10000
+MAX_CONNECTIONS_PER_IP = 0  # 0 disables the per-IP cap
+IDLE_TIMEOUT = 120  # Seconds of silence before a node is evicted
+STALE_AFTER = 30  # Seconds of silence before a node is reported stale
+LISTEN_BACKLOG = 4096  # Pending accepts queued by the kernel
+HISTORY_RETENTION = 2048  # Readings kept in memory per client
+STORAGE_DIR = "sensor_data"  # On-disk reading history
+FIRE_EVAL_INTERVAL = 1.0  # Seconds between fire-condition passes
+METRICS_HOST = "127.0.0.1"  # Metrics endpoint, local scrapes only
+METRICS_PORT = 9100  # Worker N of a sharded server uses METRICS_PORT + 1 + N
+
 # Store connected clients
-connected_clients = {}
-MAX_CLIENTS = 5
+connection_manager = ConnectionManager(
+    max_connections=MAX_CONNECTIONS,
+    max_per_ip=MAX_CONNECTIONS_PER_IP,
+    idle_timeout=IDLE_TIMEOUT,
+    history_retention=HISTORY_RETENTION,
+    stale_after=STALE_AFTER
+)
+connected_clients = connection_manager.connections
+# Opened by main() or run_worker(), so spawned shard workers re-importing
+# this module do not index the unsharded store only to throw it away
+storage = None
+metrics = ServerMetrics()
+add_server_gauges(metrics, connected_clients)
+metrics.add_gauge("central_node_liveness", "Connected nodes by liveness state",
+                  connection_manager.liveness.state_counts, ("state",))
+broadcaster = Broadcaster(connected_clients)
+add_broadcast_gauges(metrics, broadcaster)
+alert_engine = AlertEngine()
+alert_router = AlertRouter(broadcaster, metrics)
+message_parser = MessageParser(connected_clients=connected_clients, metrics=metrics, alert_engine=alert_engine)
+fire_detector = FireDetector()
+message_parser.add_reading_listener(fire_detector.update)
+# Alerts are evaluated per reading and pushed to the nodes that subscribed
+message_parser.add_reading_listener(alert_engine.observe)
+alert_engine.add_listener(alert_router.dispatch)
+message_parser.register_handler("alert_subscribe", alert_router.handle_subscribe)
+message_parser.register_handler("alert_ack", alert_router.handle_ack)
+metrics.add_gauge("central_active_alerts", "Alerts currently raised", lambda: len(alert_engine.active))
+
+async def handle_log_request(message, client_id):
+    """Ask the nodes named node_name, or all of them, to send their buffered log entries"""
+
+    """ {'msg_id': 'log_request', 'node_name': 'DHTT Node'} """
+    node_name = message.get("node_name")
+    targets = [cid for cid, conn in connected_clients.items()
+               if cid != client_id and (node_name is None or conn.node_name == node_name)]
+    # Each node answers with node_logs, re-logged under Node.<name>
+    requested = broadcaster.broadcast({"msg_id": "log_dump"}, targets)
+    return {"msg_id": "log_request_response", "status": "success", "requested": requested, "timestamp": time.time()}
+
+message_parser.register_handler("log_request", handle_log_request)
+cluster_link = None  # ClusterLink to the parent process when running as a shard worker
+
+def open_storage(directory=STORAGE_DIR):
+    """Open the reading store, shard workers pass their own directory so shards never share series files"""
+    global storage
+    storage = StorageEngine(directory)
+    message_parser.storage = storage
+    add_storage_gauges(metrics, storage)
+    return storage
 
 async def handle_client(reader, writer):
     """Handle a client connection."""
@@ -20,27 +92,17 @@ async def handle_client(reader, writer):
     client_id = str(uuid.uuid4())
     addr = writer.get_extra_info('peername')
     
-    client_info = {
-        "reader": reader,
-        "writer": writer,
-        "addr": addr,
-        "connected_at": time.time(),
-        "last_message": None,
-        "data": []
-    }
-    
     # Check if we can accept more clients
-    if len(connected_clients) >= MAX_CLIENTS:
-        logger.warning(f"Maximum clients reached. Rejecting new connection from {addr}")
-        writer.write(json.dumps({"status": "error", "message": "Server full"}).encode() + b'\n')
+    client_info, reason = connection_manager.admit(client_id, reader, writer, addr)
+    if client_info is None:
+        logger.warning("Rejecting new connection from %s: %s", addr, reason)
+        writer.write(json.dumps({"status": "error", "message": reason}).encode() + b'\n')
         await writer.drain()
         writer.close()
         await writer.wait_closed()
         return
     
-    # Add the client to our dictionary
-    connected_clients[client_id] = client_info
-    logger.info(f"New client connected from {addr}. ID: {client_id}. Total clients: {len(connected_clients)}")
+    logger.info("New client connected from %s. ID: %s. Total clients: %d", addr, client_id, len(connected_clients))
     
     try:
         # Send welcome message
@@ -49,53 +111,113 @@ async def handle_client(reader, writer):
         
         # Handle messages from the client
         while True:
-            data = await reader.readline()
-            if not data:  # Client disconnected
-                break
-                
             try:
-                decoded_data = data.decode('utf-8')
-                message = json.loads(decoded_data)
-                logger.info(f"Received data from {client_id}: {message}")
+                # JSON line or binary frame, depending on what the node negotiated
+                frame = await wire_protocol.read_frame(reader)
+                if not frame:  # Client disconnected
+                    break
+                decode_start = time.perf_counter()
+                message = wire_protocol.decode_frame(frame, message_parser.node_codes)
+                decode_time = time.perf_counter() - decode_start
+                logger.info("Received data from %s: %s", client_id, message)
                 
                 # Update client info
-                client_info["last_message"] = time.time()
-                client_info["data"].append(message)
+                client_info.last_message = time.time()
+                connection_manager.touch(client_id, client_info.last_message)
+                
+                response = await message_parser.parse_message(message, client_id)
+                node = client_info.node_name or client_id
+                msg_id = message.get("msg_id") if isinstance(message, dict) else None
+                metrics.record_message(msg_id, node, len(frame), decode_time)
                 
-                # Do stuff with data here
-                response = {"status": "msg_received", "timestamp": time.time()}
                 writer.write(json.dumps(response).encode() + b'\n')
+                drain_start = time.perf_counter()
                 await writer.drain()
+                metrics.record_drain(node, time.perf_counter() - drain_start)
                 
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON from client {client_id}")
-                writer.write(json.dumps({"status": "error", "message": "Invalid JSON"}).encode() + b'\n')
+            except ValueError as e:
+                logger.error("Invalid message from client %s: %s", client_id, e)
+                metrics.record_error(client_info.node_name or client_id)
+                writer.write(json.dumps({"status": "error", "message": "Invalid message"}).encode() + b'\n')
                 await writer.drain()
     
+    except asyncio.IncompleteReadError:
+        logger.info("Client %s disconnected mid-frame", client_id)
+    
     except Exception as e:
-        logger.error(f"Error handling client {client_id}: {e}")
+        logger.error("Error handling client %s: %s", client_id, e)
     
     finally:
         # Remove client when they disconnect
-        if client_id in connected_clients:
-            del connected_clients[client_id]
-            logger.info(f"Client {client_id} removed. Total clients: {len(connected_clients)}")
+        broadcaster.discard(client_id)
+        alert_router.unsubscribe(client_id)
+        alert_engine.forget(client_id)
+        metrics.forget_node(client_id)
+        if fire_detector.forget(client_id):
+            logger.info("Fire conditions at %s no longer tracked, the node disconnected", client_info.node_name or client_id)
+        if connection_manager.remove(client_id) is not None:
+            logger.info("Client %s removed. Total clients: %d", client_id, len(connected_clients))
         writer.close()
         await writer.wait_closed()
 
+async def fire_monitor():
+    """Evaluate fire conditions for all nodes once per interval and log state changes"""
+    while True:
+        for node, fire_present in fire_detector.evaluate():
+            if fire_present:
+                logger.warning(f"Fire conditions detected at {node}")
+            else:
+                logger.info(f"Fire conditions cleared at {node}")
+            if cluster_link is not None:
+                cluster_link.publish({"type": "fire", "node": node, "fire": fire_present})
+        await asyncio.sleep(FIRE_EVAL_INTERVAL)
+
+async def cluster_reporter(interval=shard_cluster.STATUS_INTERVAL):
+    """Report this worker's share of the cluster state to the parent"""
+    while True:
+        cluster_link.publish({
+            "type": "status",
+            "clients": len(connected_clients),
+            "messages": metrics.total_messages(),
+            "fire_nodes": fire_detector.fire_nodes()
+        })
+        await asyncio.sleep(interval)
+
 async def status_monitor():
     """Periodically print server status"""
     while True:
-        logger.info(f"Server status: {len(connected_clients)}/{MAX_CLIENTS} clients connected")
+        logger.info("Server status: %d/%d clients connected", len(connected_clients), MAX_CONNECTIONS)
+        if cluster_link is not None and cluster_link.state:
+            state = cluster_link.state
+            logger.info("Cluster status: %s clients on %s workers, fire at %s", state['clients'], state['workers'], state['fire_nodes'])
+        for msg_type, summary in message_parser.latency_summary().items():
+            logger.info("Handler %s: %d msgs, p50 %.3f ms, p99 %.3f ms", msg_type, summary['count'], summary['p50'] * 1000, summary['p99'] * 1000)
+        for stage, histogram in alert_router.latency.items():
+            if histogram.count:
+                logger.info("Alert %s: %d alerts, p50 %.3f ms, p99 %.3f ms", stage, histogram.count,
+                            histogram.percentile(50) * 1000, histogram.percentile(99) * 1000)
         await asyncio.sleep(60)  # Update every minute
 
-async def main():
+async def main(shard=None, aggregation_port=shard_cluster.AGGREGATION_PORT):
+    """Run the server, as one of several SO_REUSEPORT workers when shard is set"""
+    global cluster_link
     # Get local IP address or use localhost
     host = "0.0.0.0"  # Listen on all network interfaces
     port = 8765
+    metrics_port = METRICS_PORT if shard is None else METRICS_PORT + 1 + shard
+    
+    # Make room for thousands of node sockets
+    fd_limit = raise_fd_limit()
+    if fd_limit:
+        logger.info(f"Open file limit: {fd_limit}")
+    
+    if storage is None:
+        open_storage()
+    storage.start()
     
     # Start the TCP server
-    server = await asyncio.start_server(handle_client, host, port)
+    server = await asyncio.start_server(handle_client, host, port, backlog=LISTEN_BACKLOG, reuse_port=shard is not None)
+    metrics_server = await serve_metrics(metrics, METRICS_HOST, metrics_port)
     
     addr = server.sockets[0].getsockname()
     logger.info(f'TCP server started on {addr}')
@@ -108,13 +230,43 @@ async def main():
     logger.info(f"WebSocket server address: {ip_address} <----- Put this in esp self.server_ip variable")
     # Start status monitor
     monitor_task = asyncio.create_task(status_monitor())
+    liveness_task = asyncio.create_task(connection_manager.supervise())
+    fire_task = asyncio.create_task(fire_monitor())
+    if shard is not None:
+        cluster_link = ClusterLink(shard, port=aggregation_port)
+        link_task = asyncio.create_task(cluster_link.run())
+        report_task = asyncio.create_task(cluster_reporter())
+        logger.info(f"Running as shard worker {shard}")
     
     async with server:
         await server.serve_forever()
 
+def run_worker(index, aggregation_port):
+    """Entry point of a shard worker process"""
+    open_storage(f"{STORAGE_DIR}_shard{index}")
+    try:
+        asyncio.run(main(index, aggregation_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        storage.stop()
+        stop_logging()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Central compute server")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port through SO_REUSEPORT (Linux/BSD)")
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        if args.workers > 1:
+            shard_cluster.run_sharded(args.workers, run_worker)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Server shutting down")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
+    finally:
+        # The parent of a sharded server never opens a store
+        if storage is not None:
+            storage.stop()
+        stop_logging()
\ No newline at end of file
@@ -0,0 +1,196 @@
+import math
+import time
+from array import array
+
+# Default number of readings kept per client
+DEFAULT_RETENTION = 2048
+
+class ClientHistory:
+    """Fixed-size ring buffer of sensor readings for a single client.
+
+    Readings are stored column-wise in typed arrays so appending is O(1)
+    and memory stays flat no matter how long the client is connected.
+    Fields a message does not carry are stored as NaN.
+    """
+
+    COLUMNS = ("temperature", "humidity", "smoke_level", "motor_x", "motor_y")
+
+    def __init__(self, retention=DEFAULT_RETENTION):
+        if retention <= 0:
+            raise ValueError("retention must be a positive number of readings")
+        self.retention = retention
+        self.timestamps = array('d', [0.0]) * retention
+        self.columns = {name: array('d', [math.nan]) * retention for name in self.COLUMNS}
+        self.head = 0  # Next slot to write
+        self.size = 0  # Number of valid readings
+        self.total = 0  # Readings appended since the client connected
+
+    def __len__(self):
+        return self.size
+
+    def append(self, message, timestamp=None):
+        """Store the sensor fields of a decoded message"""
+        slot = self.head
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+
+        columns = self.columns
+        columns["temperature"][slot] = _as_float(message.get("temperature"))
+        columns["humidity"][slot] = _as_float(message.get("humidity"))
+        columns["smoke_level"][slot] = _as_float(message.get("smoke_level", message.get("smoke")))
+
+        motor_position = message.get("motor_position")
+        if isinstance(motor_position, (list, tuple)) and len(motor_position) == 2:
+            columns["motor_x"][slot] = _as_float(motor_position[0])
+            columns["motor_y"][slot] = _as_float(motor_position[1])
+        else:
+            columns["motor_x"][slot] = math.nan
+            columns["motor_y"][slot] = math.nan
+
+        self.head = (slot + 1) % self.retention
+        if self.size < self.retention:
+            self.size += 1
+        self.total += 1
+
+    def _slot(self, index):
+        """Map a logical index (0 = oldest) to a physical slot"""
+        return (self.head - self.size + index) % self.retention
+
+    def column(self, name, start=0, stop=None):
+        """Return the values of one column, oldest first"""
+        values = self.timestamps if name == "timestamp" else self.columns[name]
+        stop = self.size if stop is None else min(stop, self.size)
+        return [values[self._slot(i)] for i in range(max(start, 0), stop)]
+
+    def row(self, index):
+        """Return a single reading as a dict with only the fields that were present"""
+        slot = self._slot(index)
+        reading = {"timestamp": self.timestamps[slot]}
+        for name in ("temperature", "humidity", "smoke_level"):
+            value = self.columns[name][slot]
+            if not math.isnan(value):
+                reading[name] = value
+        motor_x = self.columns["motor_x"][slot]
+        if not math.isnan(motor_x):
+            reading["motor_position"] = [motor_x, self.columns["motor_y"][slot]]
+        return reading
+
+    def rows(self, start=0, stop=None):
+        """Yield readings as dicts, oldest first"""
+        stop = self.size if stop is None else min(stop, self.size)
+        for i in range(max(start, 0), stop):
+            yield self.row(i)
+
+    def summary(self, name, buckets):
+        """Summarize one column in a single pass for sparklines.
+
+        The readings are split into up to buckets equal runs, oldest first,
+        and each run is reduced to the mean of its values (NaN when it has
+        none). Returns a dict with the bucket means and the count, min, max
+        and last value of the column, or None if it holds no values.
+        """
+        values = self.timestamps if name == "timestamp" else self.columns[name]
+        size = self.size
+        buckets = max(1, min(buckets, size))
+        means = []
+        count = 0
+        minimum = math.inf
+        maximum = -math.inf
+        last = math.nan
+        for b in range(buckets):
+            total = 0.0
+            n = 0
+            for i in range(b * size // buckets, (b + 1) * size // buckets):
+                value = values[(self.head - size + i) % self.retention]
+                if value == value:  # Skip NaN
+                    total += value
+                    n += 1
+                    if value < minimum:
+                        minimum = value
+                    if value > maximum:
+                        maximum = value
+                    last = value
+            means.append(total / n if n else math.nan)
+            count += n
+        if not count:
+            return None
+        return {"buckets": means, "count": count, "min": minimum, "max": maximum, "last": last}
+
+    def minmax(self, name, start, end, buckets):
+        """Min-max decimation of one column over the time range [start, end).
+
+        The range is cut into buckets equal time slices, typically one per
+        pixel, and only the smallest and largest value of each slice are
+        kept, in the order they arrived. Spikes survive and the result
+        holds at most 2 * buckets points however many readings there are.
+        Returns a list of (bucket, value), empty slices are left out.
+        """
+        values = self.columns[name]
+        times = self.timestamps
+        size = self.size
+        base = self.head - size
+        retention = self.retention
+
+        # Readings are in arrival order, binary search the first one in range
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[(base + mid) % retention] < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        scale = buckets / (end - start)
+
+        points = []
+        bucket = -1
+        low = high = math.nan
+        low_first = True
+        for i in range(lo, size):
+            slot = (base + i) % retention
+            timestamp = times[slot]
+            if timestamp >= end:
+                break
+            value = values[slot]
+            if value != value:  # NaN, the reading did not carry this field
+                continue
+            b = int((timestamp - start) * scale)
+            if b != bucket:
+                if bucket >= 0:
+                    _emit_minmax(points, bucket, low, high, low_first)
+                bucket = b
+                low = high = value
+                low_first = True
+            elif value < low:
+                low = value
+                low_first = False
+            elif value > high:
+                high = value
+                low_first = True
+        if bucket >= 0:
+            _emit_minmax(points, bucket, low, high, low_first)
+        return points
+
+    def latest(self):
+        """Return the most recent reading or None if nothing was stored"""
+        if not self.size:
+            return None
+        return self.row(self.size - 1)
+
+def _as_float(value):
+    """Convert a message field to float, NaN when missing or not numeric"""
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _emit_minmax(points, bucket, low, high, low_first):
+    """Append the extremes of one bucket in arrival order, once if they are equal"""
+    if low == high:
+        points.append((bucket, low))
+    elif low_first:
+        points.append((bucket, low))
+        points.append((bucket, high))
+    else:
+        points.append((bucket, high))
+        points.append((bucket, low))
@@ -0,0 +1,96 @@
+from collections import namedtuple
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# What other threads may read about a client, copied out of its Connection.
+# history is shared rather than copied: the ClientHistory ring is only
+# appended to by the event loop thread, fills a slot before it counts it,
+# and copying every ring on every publish would cost more than the readings.
+ClientRecord = namedtuple("ClientRecord", ("client_id", "addr", "connected_at", "last_message", "node_name", "history"))
+
+class ClientSnapshot:
+    """One published version of the registry, never modified afterwards"""
+
+    __slots__ = ("version", "clients")
+
+    def __init__(self, version, clients):
+        self.version = version
+        self.clients = MappingProxyType(clients)  # client_id -> ClientRecord
+
+    def __len__(self):
+        return len(self.clients)
+
+def _record(connection):
+    return ClientRecord(connection.client_id, connection.addr, connection.connected_at,
+                        connection.last_message, connection.node_name, connection.history)
+
+class ClientRegistry(Mapping):
+    """Map of client_id -> Connection owned by the event loop thread.
+
+    The event loop reads and writes the live dict directly, so a connect
+    or disconnect is a single dict operation. Other threads never touch
+    it: they read snapshot(), the version last built by publish(), an
+    immutable map of client_id -> ClientRecord with copies of the fields
+    the UI shows. The owner publishes on a tick, so a storm of connects
+    costs one O(clients) copy per tick instead of one per connection.
+    version counts membership changes, which lets the UI skip redraws.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._version = 0
+        self._snapshot = ClientSnapshot(0, {})
+
+    def snapshot(self):
+        """The last published snapshot, safe to use from any thread"""
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self):
+        """Copy the current clients into a new snapshot, returns whether it differs from the last one"""
+        current = self._snapshot
+        clients = {client_id: _record(connection) for client_id, connection in self._clients.items()}
+        if current.version == self._version and clients == current.clients:
+            return False
+        # A single attribute assignment, readers see the old or the new snapshot whole
+        self._snapshot = ClientSnapshot(self._version, clients)
+        return True
+
+    def set(self, client_id, connection):
+        self._clients[client_id] = connection
+        self._version += 1
+
+    def pop(self, client_id, default=None):
+        """Remove a client, returns its connection or default"""
+        if client_id not in self._clients:
+            return default
+        self._version += 1
+        return self._clients.pop(client_id)
+
+    # Read side, event loop thread only
+    def __getitem__(self, client_id):
+        return self._clients[client_id]
+
+    def get(self, client_id, default=None):
+        return self._clients.get(client_id, default)
+
+    def __contains__(self, client_id):
+        return client_id in self._clients
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def keys(self):
+        return self._clients.keys()
+
+    def values(self):
+        return self._clients.values()
+
+    def items(self):
+        return self._clients.items()
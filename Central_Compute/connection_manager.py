@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from client_history import ClientHistory, DEFAULT_RETENTION
+from client_registry import ClientRegistry
+from liveness import DEAD, HEALTHY, LivenessTracker
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 10000
+DEFAULT_MAX_PER_IP = 0  # 0 disables the per-IP cap
+DEFAULT_IDLE_TIMEOUT = 120  # Seconds without a message before a node is evicted
+DEFAULT_STALE_AFTER = 30  # Seconds without a message before a node is reported stale, two missed heartbeats
+DEFAULT_LIVENESS_TICK = 1.0  # Seconds between liveness timer wheel ticks
+
+class Connection:
+    """State kept for one connected node"""
+
+    __slots__ = (
+        "client_id", "reader", "writer", "addr", "connected_at", "last_message",
+        "history", "node_name", "node_type", "version", "capabilities", "sensors", "encoding"
+    )
+
+    def __init__(self, client_id, reader, writer, addr, history_retention=DEFAULT_RETENTION):
+        self.client_id = client_id
+        self.reader = reader
+        self.writer = writer
+        self.addr = addr
+        self.connected_at = time.time()
+        self.last_message = None
+        self.history = ClientHistory(history_retention)
+        self.node_name = None
+        self.node_type = None
+        self.version = None
+        self.capabilities = None
+        self.sensors = None
+        self.encoding = "json"  # Uplink encoding negotiated in node_update
+
+    @property
+    def ip(self):
+        return self.addr[0] if self.addr else None
+
+    def last_activity(self):
+        """Time of the last message, or of the connection if nothing was received yet"""
+        return self.last_message if self.last_message is not None else self.connected_at
+
+class ConnectionManager:
+    """Admission control and bookkeeping for node connections.
+
+    connections is a ClientRegistry of client_id -> Connection. It reads
+    like a dict on the event loop thread and is shared with MessageParser
+    the same way the old connected_clients dict was; other threads read
+    its published snapshots. The other methods belong to the event loop
+    thread too, other threads hand calls over with
+    loop.call_soon_threadsafe.
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, max_per_ip=DEFAULT_MAX_PER_IP,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, history_retention=DEFAULT_RETENTION,
+                 stale_after=DEFAULT_STALE_AFTER, liveness_tick=DEFAULT_LIVENESS_TICK):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.idle_timeout = idle_timeout
+        self.history_retention = history_retention
+        self.connections = ClientRegistry()
+        self.per_ip = {}
+        self.evicted = 0
+        self.liveness_tick = liveness_tick
+        self.liveness = LivenessTracker(stale_after, idle_timeout, liveness_tick)
+        self.liveness.add_listener(self._on_liveness_change)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def admit(self, client_id, reader, writer, addr):
+        """Try to register a new connection.
+
+        Returns (connection, None) on success or (None, reason) when the
+        connection must be rejected.
+        """
+        if len(self.connections) >= self.max_connections:
+            return None, "Server full"
+        ip = addr[0] if addr else None
+        if self.max_per_ip and self.per_ip.get(ip, 0) >= self.max_per_ip:
+            return None, "Too many connections from this address"
+
+        connection = Connection(client_id, reader, writer, addr, self.history_retention)
+        self.add(connection)
+        return connection, None
+
+    def add(self, connection):
+        """Register an already built connection, bypassing admission limits"""
+        self.connections.set(connection.client_id, connection)
+        ip = connection.ip
+        self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+        self.liveness.track(connection.client_id, connection.connected_at)
+
+    def remove(self, client_id):
+        """Forget a connection, returns it or None if it was not registered"""
+        connection = self.connections.pop(client_id, None)
+        if connection is not None:
+            self.liveness.forget(client_id)
+            ip = connection.ip
+            remaining = self.per_ip.get(ip, 1) - 1
+            if remaining > 0:
+                self.per_ip[ip] = remaining
+            else:
+                self.per_ip.pop(ip, None)
+        return connection
+
+    def touch(self, client_id, now):
+        """Record that a message arrived from client_id at now"""
+        self.liveness.touch(client_id, now)
+
+    async def supervise(self):
+        """Drive the liveness timers; connections that go dead are evicted"""
+        while True:
+            await asyncio.sleep(self.liveness_tick)
+            self.liveness.advance(time.time())
+
+    def _on_liveness_change(self, client_id, old, new):
+        connection = self.connections.get(client_id)
+        if connection is None:
+            return
+        if new == HEALTHY:
+            logger.info(f"Client {client_id} recovered from {old}")
+            return
+        silent = time.time() - connection.last_activity()
+        if new == DEAD:
+            logger.warning(f"Evicting dead client {client_id} from {connection.addr}, silent for {silent:.0f}s")
+            self.remove(client_id)
+            self.evicted += 1
+            if connection.writer is not None:
+                # A half-open peer never acknowledges, abort rather than wait for a graceful close
+                connection.writer.transport.abort()
+        else:
+            logger.warning(f"Client {client_id} is {new}, silent for {silent:.0f}s")
+
+def raise_fd_limit():
+    """Raise the open file limit to the hard limit so thousands of sockets fit"""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not raise open file limit: {e}")
+    return soft
@@ -0,0 +1,148 @@
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("temperature", "humidity", "smoke_level")
+
+DEFAULT_THRESHOLDS = {
+    "temperature": 30,  # temp threshold for fire in farenheight
+    "humidity": 50,
+    "smoke_level": 100
+}
+
+# A node is on fire when every condition of any rule holds.
+# Each condition is (metric, comparison, threshold name).
+DEFAULT_RULES = (
+    (("temperature", ">", "temperature"), ("humidity", ">", "humidity"), ("smoke_level", ">", "smoke_level")),
+)
+
+STALE_AFTER = 120  # Seconds after which a reading no longer counts
+INITIAL_CAPACITY = 256
+
+_COMPARISONS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+}
+
+class FireDetector:
+    """Fire-condition evaluation over the latest readings of every node.
+
+    The latest value of each metric is kept in NumPy arrays, one row per
+    connection (client_id) since several nodes may share a name. update()
+    is O(1), and so is forget(), which moves the last row into the freed one
+    so the arrays stay dense. evaluate() checks every threshold and
+    rule for all nodes in a single vectorized pass and returns only the
+    nodes whose fire state changed since the previous pass.
+    """
+
+    def __init__(self, thresholds=None, rules=DEFAULT_RULES, stale_after=STALE_AFTER, capacity=INITIAL_CAPACITY):
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        if thresholds:
+            self.thresholds.update(thresholds)
+        self.rules = rules
+        self.stale_after = stale_after
+
+        self.min_capacity = capacity
+        self.index = {}  # client_id, or node name when there is none -> row
+        self.keys = []  # row -> key in index
+        self.nodes = []  # row -> node name
+        self.values = {metric: np.full(capacity, np.nan) for metric in METRICS}
+        self.updated = {metric: np.zeros(capacity) for metric in METRICS}
+        self.fire = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _row(self, key, node):
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.nodes)
+            if row == len(self.fire):
+                self._resize(len(self.fire) * 2)
+            self.index[key] = row
+            self.keys.append(key)
+            self.nodes.append(node)
+        else:
+            # The node may have been renamed by a node_update
+            self.nodes[row] = node
+        return row
+
+    def _resize(self, capacity):
+        n = len(self.nodes)
+        for metric in METRICS:
+            self.values[metric] = np.concatenate((self.values[metric][:n], np.full(capacity - n, np.nan)))
+            self.updated[metric] = np.concatenate((self.updated[metric][:n], np.zeros(capacity - n)))
+        self.fire = np.concatenate((self.fire[:n], np.zeros(capacity - n, dtype=bool)))
+
+    def forget(self, key):
+        """Drop the row of a connection that went away, returns whether it was on fire"""
+        row = self.index.pop(key, None)
+        if row is None:
+            return False
+        was_on_fire = bool(self.fire[row])
+        last = len(self.nodes) - 1
+        if row != last:
+            for metric in METRICS:
+                self.values[metric][row] = self.values[metric][last]
+                self.updated[metric][row] = self.updated[metric][last]
+            self.fire[row] = self.fire[last]
+            moved = self.keys[last]
+            self.keys[row] = moved
+            self.nodes[row] = self.nodes[last]
+            self.index[moved] = row
+        for metric in METRICS:
+            self.values[metric][last] = np.nan
+            self.updated[metric][last] = 0.0
+        self.fire[last] = False
+        self.keys.pop()
+        self.nodes.pop()
+        # Give memory back after a churn of short-lived connections
+        capacity = len(self.fire)
+        if capacity > self.min_capacity and len(self.nodes) <= capacity // 4:
+            self._resize(max(capacity // 2, self.min_capacity))
+        return was_on_fire
+
+    def update(self, node, message, timestamp=None, client_id=None):
+        """Store the metrics carried by a message as the node's latest readings"""
+        timestamp = time.time() if timestamp is None else timestamp
+        row = None
+        for metric in METRICS:
+            value = message.get(metric)
+            if metric == "smoke_level" and value is None:
+                value = message.get("smoke")
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if row is None:
+                    row = self._row(node if client_id is None else client_id, node)
+                self.values[metric][row] = value
+                self.updated[metric][row] = timestamp
+
+    def evaluate(self, now=None):
+        """Evaluate every rule for every node and return the state changes.
+
+        Returns a list of (node, fire_present) for nodes whose state flipped.
+        """
+        n = len(self.nodes)
+        if not n:
+            return []
+        now = time.time() if now is None else now
+
+        fire = np.zeros(n, dtype=bool)
+        for rule in self.rules:
+            matched = np.ones(n, dtype=bool)
+            for metric, comparison, threshold in rule:
+                fresh = self.updated[metric][:n] >= now - self.stale_after
+                matched &= fresh & _COMPARISONS[comparison](self.values[metric][:n], self.thresholds[threshold])
+            fire |= matched
+
+        changed = np.flatnonzero(fire != self.fire[:n])
+        self.fire[:n] = fire
+        return [(self.nodes[row], bool(fire[row])) for row in changed]
+
+    def fire_nodes(self):
+        """Nodes currently in the fire state as of the last evaluate()"""
+        return [self.nodes[row] for row in np.flatnonzero(self.fire[:len(self.nodes)])]
@@ -0,0 +1,186 @@
+"""Node liveness tracking driven by a hierarchical timer wheel.
+
+Every connection has one timer. Messages only record the time they
+arrived; the timer is not touched, so the per-message cost is a dict
+write. When a timer fires, the tracker checks the last arrival time and
+either re-arms the timer for the real deadline or moves the node on:
+
+    healthy --(stale_after s silent)--> stale --(dead_after s silent)--> dead
+       ^                                  |
+       +--------- any message ------------+
+
+Listeners registered with add_listener(func) are called as
+func(key, old_state, new_state) for every transition.
+"""
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = "healthy"
+STALE = "stale"
+DEAD = "dead"
+STATES = (HEALTHY, STALE, DEAD)
+
+DEFAULT_TICK = 1.0  # Seconds per wheel tick, timers fire up to one tick late
+DEFAULT_SLOTS = 64
+DEFAULT_LEVELS = 3  # 64 ** 3 ticks, about three days at one second per tick
+
+class TimerWheel:
+    """Hierarchical timing wheel keyed by arbitrary hashable keys.
+
+    Level 0 has one slot per tick, each higher level covers slots times the
+    span of the level below. A timer goes into the coarsest level that can
+    hold it and is moved down a level when its slot comes round, so
+    schedule, cancel and each tick are O(1) however many timers exist,
+    plus the timers that actually expire. Timers further out than the top
+    level can reach are parked at its far end and re-placed when reached.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, levels=DEFAULT_LEVELS, start=None):
+        self.tick = tick
+        self.slots = slots
+        self.spans = [slots ** level for level in range(levels)]  # Ticks per slot at each level
+        self.start = time.time() if start is None else start
+        self.ticks = 0  # Ticks processed so far
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]  # slot: key -> due tick
+        self.timers = {}  # key -> (level, slot)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def schedule(self, key, deadline):
+        """Arm the timer of key for deadline, replacing any earlier one"""
+        self.cancel(key)
+        due = max(math.ceil((deadline - self.start) / self.tick), self.ticks + 1)
+        self._insert(key, due)
+
+    def cancel(self, key):
+        where = self.timers.pop(key, None)
+        if where is not None:
+            level, slot = where
+            del self.wheels[level][slot][key]
+
+    def advance(self, now):
+        """Process every tick up to now, returns the keys whose timers expired"""
+        target = int((now - self.start) // self.tick)
+        expired = []
+        while self.ticks < target:
+            self.ticks += 1
+            # Cascade from the top so timers can drop more than one level in a tick
+            for level in range(len(self.spans) - 1, 0, -1):
+                span = self.spans[level]
+                if self.ticks % span == 0:
+                    slot = (self.ticks // span) % self.slots
+                    bucket = self.wheels[level][slot]
+                    if bucket:
+                        self.wheels[level][slot] = {}
+                        for key, due in bucket.items():
+                            self._insert(key, due)
+            slot = self.ticks % self.slots
+            bucket = self.wheels[0][slot]
+            if bucket:
+                self.wheels[0][slot] = {}
+                for key in bucket:
+                    del self.timers[key]
+                    expired.append(key)
+        return expired
+
+    def _insert(self, key, due):
+        """Place a timer due at tick due, which must not be in the past"""
+        delta = due - self.ticks
+        level = 0
+        while level < len(self.spans) - 1 and delta >= self.spans[level + 1]:
+            level += 1
+        span = self.spans[level]
+        # Beyond the top level's reach, park at its last slot until it comes round
+        placed = min(due, self.ticks + span * self.slots - 1)
+        slot = (placed // span) % self.slots
+        self.wheels[level][slot][key] = due
+        self.timers[key] = (level, slot)
+
+class LivenessTracker:
+    """Healthy/stale/dead state of tracked keys, one wheel timer each"""
+
+    def __init__(self, stale_after, dead_after=None, tick=DEFAULT_TICK, now=None):
+        if dead_after and dead_after <= stale_after:
+            raise ValueError("dead_after must be longer than stale_after")
+        self.stale_after = stale_after
+        self.dead_after = dead_after  # None or 0 keeps silent keys stale forever
+        self.wheel = TimerWheel(tick, start=now)
+        self.last_seen = {}  # key -> time of the last message
+        self.states = {}  # key -> state
+        self.counts = dict.fromkeys(STATES, 0)
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.states)
+
+    def add_listener(self, listener):
+        """Call listener(key, old_state, new_state) on every transition"""
+        self.listeners.append(listener)
+
+    def track(self, key, now=None):
+        """Start tracking key as healthy"""
+        now = time.time() if now is None else now
+        self.forget(key)
+        self.last_seen[key] = now
+        self.states[key] = HEALTHY
+        self.counts[HEALTHY] += 1
+        self.wheel.schedule(key, now + self.stale_after)
+
+    def forget(self, key):
+        state = self.states.pop(key, None)
+        if state is not None:
+            self.counts[state] -= 1
+            del self.last_seen[key]
+            self.wheel.cancel(key)
+
+    def touch(self, key, now):
+        """Record a message from key, O(1) and usually a single dict write"""
+        state = self.states.get(key)
+        if state is None:
+            return
+        self.last_seen[key] = now
+        if state is not HEALTHY:
+            self._transition(key, state, HEALTHY)
+            self.wheel.schedule(key, now + self.stale_after)
+
+    def state(self, key):
+        return self.states.get(key)
+
+    def state_counts(self):
+        """Tracked keys per state, for the metrics gauges"""
+        return {(state,): count for state, count in self.counts.items()}
+
+    def advance(self, now=None):
+        """Run the timers due by now and apply the resulting transitions"""
+        now = time.time() if now is None else now
+        for key in self.wheel.advance(now):
+            state = self.states.get(key)
+            if state is None:
+                continue
+            seen = self.last_seen[key]
+            silent = now - seen
+            if silent < self.stale_after:
+                # Heard from since the timer was armed
+                self.wheel.schedule(key, seen + self.stale_after)
+            elif state is HEALTHY:
+                self._transition(key, state, STALE)
+                if self.dead_after:
+                    self.wheel.schedule(key, seen + self.dead_after)
+            elif self.dead_after and silent >= self.dead_after:
+                self._transition(key, state, DEAD)
+            elif self.dead_after:
+                self.wheel.schedule(key, seen + self.dead_after)
+
+    def _transition(self, key, old, new):
+        self.states[key] = new
+        self.counts[old] -= 1
+        self.counts[new] += 1
+        for listener in self.listeners:
+            try:
+                listener(key, old, new)
+            except Exception as e:
+                logger.error(f"Liveness listener failed for {key}: {e}")
@@ -0,0 +1,367 @@
+"""Load test and traffic generator for the central compute server.
+
+Every simulated node opens a real TCP connection and speaks the AsyncNode
+protocol: it waits for the welcome, sends node_update, then streams
+dhtt_data, motor_data or smoke_data readings at a fixed rate, singly or in
+batch frames, as JSON or in the binary encoding. Requests carry a seq that
+the server echoes, so responses are matched without waiting for them.
+
+Sending is open loop: a reading is due every 1 / rate seconds whatever
+the server does, and latency is measured from the time it was due, so a
+slow server shows up as latency instead of as a lower offered load.
+
+Without --host the server from central_compute_nogui runs in this process
+on an ephemeral port, with limits sized for the test, and the server-side
+connection count is sampled as well. Holding many mostly idle connections:
+
+    python load_test.py --nodes 5000 --duration 30 --rate 0.1
+
+Throughput against a server that is already running:
+
+    python load_test.py --host 127.0.0.1 --nodes 2000 --rate 1 --duration 60
+    python load_test.py --host 127.0.0.1 --nodes 10000 --processes 4 --batch 10 --encoding bin1
+
+The report gives connection counts, throughput and response latency
+percentiles as JSON.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import time
+
+import wire_protocol
+from connection_manager import raise_fd_limit
+from metrics import LatencyHistogram
+
+logger = logging.getLogger("LoadTest")
+
+NODE_KINDS = ("dhtt", "motor", "smoke")
+DRAIN_TIMEOUT = 10  # Seconds to wait for outstanding responses after sending stops
+
+def make_reading(kind, node_name, now):
+    """A reading shaped like the templates in Node/scheduler.py"""
+    if kind == "dhtt":
+        return {"msg_id": "dhtt_data", "timestamp": now, "temperature": 20 + now % 10,
+                "humidity": 50 + now % 20, "node_name": node_name}
+    if kind == "motor":
+        return {"msg_id": "motor_data", "timestamp": now, "motor_position": [now % 100, now % 100],
+                "node_name": node_name}
+    return {"msg_id": "smoke_data", "timestamp": now, "smoke_level": 0.1 + now % 0.5, "node_name": node_name}
+
+class Stats:
+    """Counters and histograms of one generator process, merged across processes"""
+
+    def __init__(self):
+        self.connected = 0
+        self.connect_errors = {}  # exception name -> count
+        self.sent = 0  # Frames
+        self.readings = 0  # Readings in those frames
+        self.bytes_sent = 0
+        self.received = 0
+        self.error_responses = 0
+        self.lost = 0  # Requests without a response when the run ended
+        self.dropped = 0  # Connections the server closed while the node was still sending
+        self.first_sent = None  # Wall clock of the first reading taken, the last frame sent and the last response
+        self.last_sent = None
+        self.last_received = None
+        self.peak_server_connections = None  # Sampled only when the server runs in this process
+        self.latency = LatencyHistogram()
+        self.connect_latency = LatencyHistogram()
+
+    def merge(self, other):
+        self.connected += other.connected
+        for name, count in other.connect_errors.items():
+            self.connect_errors[name] = self.connect_errors.get(name, 0) + count
+        self.sent += other.sent
+        self.readings += other.readings
+        self.bytes_sent += other.bytes_sent
+        self.received += other.received
+        self.error_responses += other.error_responses
+        self.lost += other.lost
+        self.dropped += other.dropped
+        self.first_sent = _earliest(self.first_sent, other.first_sent)
+        self.last_sent = _latest(self.last_sent, other.last_sent)
+        self.last_received = _latest(self.last_received, other.last_received)
+        self.peak_server_connections = _latest(self.peak_server_connections, other.peak_server_connections)
+        self.latency.merge(other.latency)
+        self.connect_latency.merge(other.connect_latency)
+
+    def sent_frame(self, readings, size, taken, now):
+        """Count a frame of readings, taken is when its first reading was"""
+        self.sent += 1
+        self.readings += readings
+        self.bytes_sent += size
+        self.first_sent = _earliest(self.first_sent, taken)
+        self.last_sent = now
+
+def _earliest(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+def _latest(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+class SimulatedNode:
+    """One simulated node connection"""
+
+    def __init__(self, index, kind, args, stats):
+        self.index = index
+        self.kind = kind
+        self.node_name = f"{kind.upper()} Load Node {index}"
+        self.args = args
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.encoding = "json"
+        self.node_code = 0
+        self.seq = 0
+        self.pending = {}  # seq -> time the frame was due
+        self.sending = False
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        welcome = json.loads(await self.reader.readline())
+        if welcome.get("status") != "connected":
+            raise ConnectionError(welcome.get("message", "connection rejected"))
+
+        update = {"msg_id": "node_update", "node_name": self.node_name}
+        if self.args.encoding != "json":
+            update["encodings"] = [self.args.encoding, "json"]
+        self.writer.write(wire_protocol.encode_json(update))
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        if response.get("msg_id") != "node_update_response":
+            raise ConnectionError(response.get("message", "node_update rejected"))
+        self.encoding = response.get("encoding", "json")
+        self.node_code = response.get("node_code", 0)
+        self.stats.connect_latency.record(time.perf_counter() - start)
+
+    def encode(self, message):
+        if self.encoding != "json":
+            frame = wire_protocol.encode_binary(message, self.node_code, self.seq)
+            if frame is not None:
+                return frame
+        message["seq"] = self.seq
+        return wire_protocol.encode_json(message)
+
+    async def send_loop(self, stop_at):
+        """Send a reading every 1 / rate seconds, batch readings per frame"""
+        interval = 1.0 / self.args.rate
+        # Random phase so the nodes do not all send on the same tick
+        due = time.perf_counter() + random.uniform(0, interval)
+        readings = []
+        while due < stop_at:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.writer.is_closing():
+                return
+            readings.append(make_reading(self.kind, self.node_name, time.time()))
+            if len(readings) >= self.args.batch:
+                if len(readings) == 1:
+                    message = readings[0]
+                else:
+                    # sent_at lets the server date each reading by its own timestamp
+                    message = {"msg_id": "batch", "node_name": self.node_name, "readings": readings,
+                               "sent_at": time.time()}
+                self.seq = self.seq % 0xFFFFFFFF + 1
+                frame = self.encode(message)
+                self.pending[self.seq] = due
+                self.writer.write(frame)
+                self.stats.sent_frame(len(readings), len(frame), readings[0]["timestamp"], time.time())
+                readings = []
+                await self.writer.drain()
+            due += interval
+
+    async def receive_loop(self):
+        """Match responses to requests by seq until the connection closes"""
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                if self.sending:
+                    self.stats.dropped += 1
+                return
+            now = time.perf_counter()
+            try:
+                response = json.loads(line)
+            except ValueError:
+                self.stats.error_responses += 1
+                continue
+            due = self.pending.pop(response.get("seq"), None)
+            if due is None or response.get("status") == "error":
+                self.stats.error_responses += 1
+            if due is not None:
+                self.stats.received += 1
+                self.stats.last_received = time.time()
+                self.stats.latency.record(now - due)
+
+    async def run(self, connect_semaphore, stop_at):
+        try:
+            async with connect_semaphore:
+                await self.connect()
+        except (OSError, ValueError) as e:
+            name = type(e).__name__
+            self.stats.connect_errors[name] = self.stats.connect_errors.get(name, 0) + 1
+            self.close()
+            return
+        self.stats.connected += 1
+
+        receiver = asyncio.create_task(self.receive_loop())
+        try:
+            self.sending = True
+            await self.send_loop(stop_at)
+            self.sending = False
+            deadline = time.perf_counter() + DRAIN_TIMEOUT
+            while self.pending and not receiver.done() and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+        except OSError:
+            pass
+        finally:
+            self.sending = False
+            self.stats.lost += len(self.pending)
+            receiver.cancel()
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+async def run_nodes(args, first, count, server_count=None):
+    """Run count simulated nodes starting at index first, return their Stats.
+
+    server_count, when the server runs in this process, returns its
+    connection count and is sampled for the peak.
+    """
+    stats = Stats()
+    if server_count is not None:
+        stats.peak_server_connections = 0
+    connect_semaphore = asyncio.Semaphore(args.concurrency)
+    kinds = args.kinds.split(",")
+    stop_at = time.perf_counter() + args.duration
+    nodes = [SimulatedNode(i, kinds[i % len(kinds)], args, stats) for i in range(first, first + count)]
+    tasks = [asyncio.create_task(node.run(connect_semaphore, stop_at)) for node in nodes]
+
+    next_report = time.perf_counter() + args.report_interval
+    while not all(task.done() for task in tasks):
+        await asyncio.sleep(1)
+        if server_count is not None:
+            stats.peak_server_connections = max(stats.peak_server_connections, server_count())
+        if first == 0 and time.perf_counter() >= next_report:
+            next_report += args.report_interval
+            logger.warning(f"process 0: {stats.connected}/{count} connected, {stats.sent} sent, "
+                           f"{stats.received} received, p99 {stats.latency.percentile(99) * 1000:.1f} ms")
+    await asyncio.gather(*tasks)
+    return stats
+
+async def run_in_process(args):
+    """Start the nogui server on an ephemeral port in this process and run every node against it"""
+    # Imported here so generator processes do not start the server's logging
+    import central_compute_nogui as server_module
+
+    # Per-connection logging from the server would dominate the run
+    logging.getLogger().setLevel(logging.WARNING)
+    connection_manager = server_module.connection_manager
+    connection_manager.max_connections = max(args.nodes, server_module.MAX_CONNECTIONS)
+    connection_manager.max_per_ip = 0
+    server = await asyncio.start_server(server_module.handle_client, "127.0.0.1", 0,
+                                        backlog=server_module.LISTEN_BACKLOG)
+    args.host, args.port = server.sockets[0].getsockname()[:2]
+    logger.warning(f"In-process server listening on {args.host}:{args.port}")
+    try:
+        return await run_nodes(args, 0, args.nodes, server_count=lambda: len(connection_manager))
+    finally:
+        # Let the server-side handlers see the disconnects before the loop stops
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while len(connection_manager) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        server.close()
+        await server.wait_closed()
+        server_module.stop_logging()
+
+def run_process(args, first, count):
+    """Entry point of one generator process"""
+    logging.basicConfig(level=logging.WARNING)
+    raise_fd_limit()
+    return asyncio.run(run_nodes(args, first, count))
+
+def summarize(histogram):
+    """Latency summary in ms, bucket bounds capped at the largest observation"""
+    summary = histogram.summary()
+    summary["p90"] = histogram.percentile(90)
+    summary["p999"] = histogram.percentile(99.9)
+    for name in ("p50", "p90", "p99", "p999"):
+        summary[name] = min(summary[name], histogram.max)
+    return {name: value * 1000 if name != "count" else value for name, value in summary.items()}
+
+def _per_second(count, start, end):
+    return count / (end - start) if start is not None and end is not None and end > start else 0.0
+
+def report(args, stats, elapsed):
+    """The JSON report, rates are over the span actually spent sending or answering"""
+    return {
+        "nodes": args.nodes,
+        "processes": args.processes,
+        "encoding": args.encoding,
+        "batch": args.batch,
+        "offered_readings_per_second": args.nodes * args.rate,
+        "connected": stats.connected,
+        "held_until_end": stats.connected - stats.dropped,
+        "peak_server_connections": stats.peak_server_connections,
+        "connect_errors": stats.connect_errors,
+        "frames_sent": stats.sent,
+        "readings_sent": stats.readings,
+        "bytes_sent": stats.bytes_sent,
+        "responses": stats.received,
+        "error_responses": stats.error_responses,
+        "lost": stats.lost,
+        "elapsed": elapsed,
+        "frames_sent_per_second": _per_second(stats.sent, stats.first_sent, stats.last_sent),
+        "readings_sent_per_second": _per_second(stats.readings, stats.first_sent, stats.last_sent),
+        "responses_per_second": _per_second(stats.received, stats.first_sent, stats.last_received),
+        "latency_ms": summarize(stats.latency),
+        "connect_latency_ms": summarize(stats.connect_latency),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many nodes sending readings to the central server")
+    parser.add_argument("--host", default=None, help="Server host, omit to run the server in-process")
+    parser.add_argument("--port", type=int, default=8765, help="Server port when --host is given")
+    parser.add_argument("--nodes", type=int, default=1000, help="Virtual nodes over all processes")
+    parser.add_argument("--processes", type=int, default=1, help="Generator processes")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of sending")
+    parser.add_argument("--rate", type=float, default=0.2, help="Readings per second per node")
+    parser.add_argument("--batch", type=int, default=1, help="Readings per frame, above 1 sends batch frames")
+    parser.add_argument("--encoding", choices=("json", wire_protocol.ENCODING), default="json", help="Uplink encoding to offer")
+    parser.add_argument("--kinds", default=",".join(NODE_KINDS), help="Node kinds assigned round-robin")
+    parser.add_argument("--concurrency", type=int, default=200, help="Connects in flight per process")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+    if set(args.kinds.split(",")) - set(NODE_KINDS):
+        parser.error(f"--kinds must be taken from {','.join(NODE_KINDS)}")
+    if args.host is None and args.processes != 1:
+        parser.error("--processes needs --host, the in-process server shares one event loop with the nodes")
+
+    start = time.monotonic()
+    shares = [args.nodes // args.processes + (1 if i < args.nodes % args.processes else 0) for i in range(args.processes)]
+    firsts = [sum(shares[:i]) for i in range(args.processes)]
+    if args.host is None:
+        fd_limit = raise_fd_limit()
+        logger.warning(f"Open file limit: {fd_limit}")
+        results = [asyncio.run(run_in_process(args))]
+    elif args.processes == 1:
+        results = [run_process(args, 0, args.nodes)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+            results = pool.starmap(run_process, [(args, first, count) for first, count in zip(firsts, shares)])
+
+    stats = Stats()
+    for result in results:
+        stats.merge(result)
+    print(json.dumps(report(args, stats, time.monotonic() - start), indent=4))
+    raise SystemExit(0 if stats.connected == args.nodes and not stats.lost and not stats.dropped else 1)
+
+if __name__ == "__main__":
+    main()
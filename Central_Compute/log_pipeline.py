@@ -0,0 +1,125 @@
+"""Non-blocking logging for the central server.
+
+setup_logging() replaces logging.basicConfig. Loggers only put records on
+a queue; a QueueListener thread writes them to stderr, so the event loop
+never waits on the terminal. message % args still runs on the calling
+thread, as in the stock QueueHandler, because the arguments are often
+live objects the event loop keeps changing. It only runs for records
+that passed the level check and the rate limiter.
+
+Hot-path log calls should use %-style arguments instead of f-strings.
+That skips formatting for dropped records, and it lets RateLimitFilter
+recognise repeats of the same call site by their unformatted message.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+RATE_LIMIT = 5.0  # Records per second per call site once the burst is used up
+RATE_BURST = 20
+PRUNE_INTERVAL = 10.0  # Seconds between sweeps of idle rate limit buckets
+MAX_BUCKETS = 4096  # Sweep early once this many call sites are tracked
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site for records below WARNING.
+
+    A call site is identified by logger name and unformatted message, so
+    "Received data from %s: %s" is limited as a whole. The next record
+    that gets through carries the number suppressed in record.suppressed,
+    which SuppressionFormatter prints. Warnings and errors always pass.
+    Buckets that have refilled with nothing suppressed are dropped, so
+    one-off messages do not pile up.
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, level=logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = level
+        self.buckets = {}  # (logger, msg) -> [tokens, last refill, suppressed]
+        self.last_prune = time.monotonic()
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        # The same record can reach several handlers sharing this filter
+        decided = getattr(record, "rate_limited", None)
+        if decided is not None:
+            return not decided
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        if now - self.last_prune >= PRUNE_INTERVAL or len(self.buckets) >= MAX_BUCKETS:
+            self.prune(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            bucket[2] += 1
+            record.rate_limited = True
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        record.rate_limited = False
+        return True
+
+    def prune(self, now):
+        """Drop the buckets that are full again and owe no suppressed count"""
+        self.last_prune = now
+        burst, rate = self.burst, self.rate
+        idle = [key for key, (tokens, last, suppressed) in self.buckets.items()
+                if not suppressed and tokens + (now - last) * rate >= burst]
+        for key in idle:
+            del self.buckets[key]
+
+class SuppressionFormatter(logging.Formatter):
+    """Formatter that appends the count RateLimitFilter left on a record"""
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} [{suppressed} similar suppressed]" if suppressed else text
+
+rate_limiter = RateLimitFilter()
+_listener = None
+
+def setup_logging(level=logging.INFO, fmt=LOG_FORMAT, stream=None):
+    """Route the root logger through a queue to a background writer thread"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.SimpleQueue()
+    # The stock prepare() renders the message with this formatter before queueing
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(SuppressionFormatter())
+    queue_handler.addFilter(rate_limiter)
+
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(fmt))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
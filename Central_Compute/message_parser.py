@@ -1,20 +1,80 @@
 import logging
 import time
+from metrics import LatencyHistogram, ServerMetrics
+from wire_protocol import NodeCodes, negotiate
 
 logger = logging.getLogger(__name__)
+
+NUMBER = (int, float)
+
+# Fields each built-in message type must carry, checked before the handler runs
+MESSAGE_SCHEMAS = {
+    "node_update": {"node_name": str},
+    "dhtt_data": {"temperature": NUMBER, "humidity": NUMBER},
+    "smoke_data": {"smoke_level": NUMBER},
+    "motor_data": {"motor_position": (list, tuple)},
+    "Average VOC Gas Reading": {"Avg VOC": (str, int, float)},
+    "batch": {"readings": list},
+    "node_logs": {"entries": list},
+}
+
+# Message types that are not kept in history or storage. Batches are
+# recorded reading by reading as they are unpacked.
+UNRECORDED_TYPES = ("batch", "node_logs", "heartbeat", "alert_subscribe", "alert_ack", "log_request")
+
+def compile_validator(schema):
+    """Build a validator for a {field: type(s)} schema.
+
+    The schema is flattened once at registration time so the per-message
+    check is a single pass over a tuple. The validator returns None when the
+    message is valid or an error string otherwise.
+    """
+    checks = tuple(schema.items())
+
+    def validate(message):
+        for field, types in checks:
+            value = message.get(field)
+            if value is None:
+                return f"Missing required field: {field}"
+            if not isinstance(value, types) or isinstance(value, bool):
+                return f"Invalid type for field: {field}"
+        return None
+    return validate
+
 class MessageParser:
     """Parser for handling different types of messages from client nodes"""
     
-    def __init__(self, connected_clients):
+    def __init__(self, connected_clients, storage=None, metrics=None, alert_engine=None):
         self.handlers = {}
-        self.register_default_handlers()
+        self.validators = {}
+        self.metrics = metrics if metrics is not None else ServerMetrics()
+        self.latency = self.metrics.handler_latency  # msg_type -> LatencyHistogram
         self.connected_clients = connected_clients
+        self.storage = storage  # Optional StorageEngine that persists readings
+        self.alert_engine = alert_engine  # Optional AlertEngine fed by sensor_data readings
+        self.reading_listeners = []
+        self.node_codes = NodeCodes()  # Interned node names for binary frames
+        self.register_default_handlers()
         
-    def register_handler(self, msg_type, handler_func):
-        """Register a new message handler function"""
+    def register_handler(self, msg_type, handler_func, schema=None):
+        """Register a new message handler function.
+
+        schema is an optional {field: type(s)} dict, falling back to the
+        built-in MESSAGE_SCHEMAS entry for msg_type.
+        """
         self.handlers[msg_type] = handler_func
+        schema = schema if schema is not None else MESSAGE_SCHEMAS.get(msg_type)
+        if schema:
+            self.validators[msg_type] = compile_validator(schema)
+        else:
+            self.validators.pop(msg_type, None)
+        self.latency.setdefault(msg_type, LatencyHistogram())
         logger.info(f"Registered handler for message type: {msg_type}")
         
+    def add_reading_listener(self, listener):
+        """Call listener(node, message, timestamp, client_id) for every recorded reading"""
+        self.reading_listeners.append(listener)
+        
     def register_default_handlers(self):
         """Register the built-in message handlers"""
         # Register built-in handlers
@@ -23,23 +83,61 @@ class MessageParser:
         self.register_handler("status_request", self.handle_status_request)
         self.register_handler("default", self.default_handler)
         self.register_handler("dhtt_data", self.handle_dhtt_sensor)
-    async def parse_message(self, message, client_id):
-        """Parse incoming message and route to appropriate handler"""
+        self.register_handler("smoke_data", self.handle_smoke_sensor)
+        self.register_handler("motor_data", self.handle_motor_data)
+        self.register_handler("Average VOC Gas Reading", self.handle_voc_sensor)
+        self.register_handler("batch", self.handle_batch)
+        self.register_handler("node_logs", self.handle_node_logs)
+        self.register_handler("heartbeat", self.handle_heartbeat)
+    async def parse_message(self, message, client_id, received_at=None):
+        """Parse incoming message and route to appropriate handler.
+
+        A "seq" field on the request is echoed on the response so nodes can
+        match responses to requests that are still in flight. received_at
+        overrides the connection's last message time as the time the
+        reading is recorded at, batches pass one per reading.
+        """
+        response = await self.dispatch(message, client_id, received_at)
+        seq = message.get("seq") if isinstance(message, dict) else None
+        if seq is not None:
+            response["seq"] = seq
+        return response
+    async def dispatch(self, message, client_id, received_at=None):
+        """Route a message to its handler and return the handler's response"""
         try:
             # Determine message type
             msg_type = message.get("msg_id", "unknown")
             
             # Log the message type and source
-            logger.info(f"Processing {msg_type} message from {client_id}")
+            logger.debug("Processing %s message from %s", msg_type, client_id)
             
-            # Check if we have a handler for this message type
-            if msg_type in self.handlers:
-                # Call the appropriate handler
-                return await self.handlers[msg_type](message, client_id)
-            else:
-                # Handle unknown message type
-                logger.warning(f"No handler for message type: {msg_type}")
-                return await self.default_handler(message, client_id)
+            # Single dict lookup, unknown types go to the default handler
+            handler = self.handlers.get(msg_type)
+            if handler is None:
+                msg_type = "default"
+                handler = self.handlers["default"]
+
+            validate = self.validators.get(msg_type)
+            if validate is not None:
+                error = validate(message)
+                if error:
+                    logger.warning("Rejected %s message from %s: %s", msg_type, client_id, error)
+                    return {"status": "error", "message": error}
+
+            if msg_type not in UNRECORDED_TYPES:
+                self.record_reading(message, client_id, received_at)
+
+            start = time.perf_counter()
+            response = await handler(message, client_id)
+            elapsed = time.perf_counter() - start
+            self.latency[msg_type].record(elapsed)
+            client_info = self.connected_clients.get(client_id)
+            self.metrics.record_handler(client_info.node_name or client_id if client_info is not None else client_id, elapsed)
+
+            # Handlers that have nothing to report still acknowledge the message
+            if response is None:
+                response = {"status": "msg_received", "timestamp": time.time()}
+            return response
                 
         except KeyError as e:
             logger.error(f"Missing required field in message: {e}")
@@ -47,6 +145,20 @@ class MessageParser:
         except Exception as e:
             logger.error(f"Error parsing message: {e}")
             return {"status": "error", "message": str(e)}
+    def record_reading(self, message, client_id, received_at=None):
+        """Append a message to the client's history and persist its readings"""
+        client_info = self.connected_clients.get(client_id)
+        if client_info is not None:
+            timestamp = received_at or client_info.last_message or time.time()
+            client_info.history.append(message, timestamp)
+            node = client_info.node_name or client_id
+            if self.storage is not None:
+                self.storage.record_message(node, message, timestamp)
+            for listener in self.reading_listeners:
+                listener(node, message, timestamp, client_id)
+    def latency_summary(self):
+        """Return per-handler latency summaries for message types that were seen"""
+        return {msg_type: hist.summary() for msg_type, hist in self.latency.items() if hist.count}
     async def default_handler(self, message, client_id):
         """Handle unknown message types"""
         logger.warning(f"No handler for message type: {message.get('msg_id', 'unknown')}")
@@ -61,9 +173,108 @@ class MessageParser:
         humidity = message.get("humidity", 0.0)
         node_name = message.get("node_name", "Unknown Node")
 
-        logger.info(f"DHTT sensor data from {node_name} (ID: {client_id}): {temperature}C, {humidity}%")
+        logger.info("DHTT sensor data from %s (ID: %s): %sC, %s%%", node_name, client_id, temperature, humidity)
         
         
+    async def handle_smoke_sensor(self, message, client_id):
+        """Handle smoke sensor data messages"""
+        smoke_level = message.get("smoke_level", 0.0)
+        node_name = message.get("node_name", "Unknown Node")
+
+        logger.info("Smoke sensor data from %s (ID: %s): %s", node_name, client_id, smoke_level)
+
+    async def handle_motor_data(self, message, client_id):
+        """Handle motor position messages"""
+        motor_position = message.get("motor_position", [0, 0])
+        node_name = message.get("node_name", "Unknown Node")
+
+        logger.info("Motor data from %s (ID: %s): position %s", node_name, client_id, motor_position)
+
+    async def handle_voc_sensor(self, message, client_id):
+        """Handle VOC gas sensor messages"""
+
+        """ {'timestamp': 799286919, 'Avg VOC': '100.1867', 'Threshold': False, 'node_name': "John's Test Node", 'msg_id': 'Average VOC Gas Reading'} """
+        avg_voc = message.get("Avg VOC")
+        threshold = message.get("Threshold", False)
+        node_name = message.get("node_name", "Unknown Node")
+
+        logger.info("VOC sensor data from %s (ID: %s): %s (threshold exceeded: %s)", node_name, client_id, avg_voc, threshold)
+
+    async def handle_batch(self, message, client_id):
+        """Unpack a batch frame and route each reading to its own handler.
+
+        Readings wait on the node before the batch goes out. When the frame
+        carries the node's send time, each reading is recorded at the
+        arrival time minus the age it had when the batch was sent, both
+        measured on the node's clock.
+        """
+
+        """ {'msg_id': 'batch', 'node_name': 'DHTT Node', 'sent_at': 799274689, 'readings': [{'msg_id': 'dhtt_data', 'timestamp': 799274659, ...}, ...]} """
+        readings = message["readings"]
+        sent_at = message.get("sent_at")
+        if not isinstance(sent_at, NUMBER) or isinstance(sent_at, bool):
+            sent_at = None
+        client_info = self.connected_clients.get(client_id)
+        arrival = (client_info.last_message if client_info is not None else None) or time.time()
+        accepted = 0
+        responses = []
+        for reading in readings:
+            if not isinstance(reading, dict) or reading.get("msg_id") == "batch":
+                continue
+            received_at = None
+            taken_at = reading.get("timestamp")
+            if sent_at is not None and isinstance(taken_at, NUMBER) and not isinstance(taken_at, bool):
+                received_at = arrival - max(0.0, sent_at - taken_at)
+            response = await self.parse_message(reading, client_id, received_at)
+            if response.get("status") != "error":
+                accepted += 1
+            # Keep anything more than a plain acknowledgement for the node
+            if "msg_id" in response:
+                responses.append(response)
+
+        logger.info("Batch of %d readings from %s, %d accepted", len(readings), client_id, accepted)
+        resp = {
+            "msg_id": "batch_response",
+            "status": "success",
+            "received": len(readings),
+            "accepted": accepted,
+            "timestamp": time.time()
+        }
+        if responses:
+            resp["responses"] = responses
+        return resp
+
+    async def handle_heartbeat(self, message, client_id):
+        """Answer a node's liveness probe"""
+        return {
+            "msg_id": "heartbeat_response",
+            "status": "ok",
+            "timestamp": time.time()
+        }
+
+    async def handle_node_logs(self, message, client_id):
+        """Re-log the entries a node flushed from its in-RAM log ring"""
+
+        """ {'msg_id': 'node_logs', 'node_name': 'DHTT Node', 'entries': [[799274659, 'INFO', 'Socket_Driver', 'send_data', 'Sent 26 bytes'], ...]} """
+        node_name = message.get("node_name", "Unknown Node")
+        node_logger = logging.getLogger(f"Node.{node_name}")
+        for entry in message["entries"]:
+            if not isinstance(entry, list) or len(entry) != 5:
+                continue
+            timestamp, level_name, driver_str, func_str, text = entry
+            level = logging.getLevelName(level_name) if isinstance(level_name, str) else logging.INFO
+            if not isinstance(level, int):
+                level = logging.INFO
+            node_logger.log(level, "[%s] [%s] [%s] %s", timestamp, driver_str, func_str, text)
+        logger.info("Received %d log entries from %s", len(message["entries"]), node_name)
+        # Acknowledged with the request's seq, the node only then drops the entries
+        return {
+            "msg_id": "node_logs_response",
+            "status": "success",
+            "received": len(message["entries"]),
+            "timestamp": time.time()
+        }
+
     async def handle_node_update(self, message, client_id):
         """Handle node_update messages"""
         node_name = message.get("node_name", "Unknown Node")
@@ -72,23 +283,31 @@ class MessageParser:
         
         # Update client information with node details
         if client_id in self.connected_clients:
-            self.connected_clients[client_id]["node_name"] = node_name
-            self.connected_clients[client_id]["node_type"] = node_type
-            self.connected_clients[client_id]["version"] = version
+            client_info = self.connected_clients[client_id]
+            client_info.node_name = node_name
+            client_info.node_type = node_type
+            client_info.version = version
             
             # Additional fields if present
             if "capabilities" in message:
-                self.connected_clients[client_id]["capabilities"] = message["capabilities"]
+                client_info.capabilities = message["capabilities"]
+            
+            # Pick the uplink encoding for this connection
+            client_info.encoding = negotiate(message.get("encodings"))
                 
-            logger.info(f"Node update from {node_name} (ID: {client_id}, Type: {node_type}, Version: {version})")
+            logger.info(f"Node update from {node_name} (ID: {client_id}, Type: {node_type}, Version: {version}, Encoding: {client_info.encoding})")
             
             # Return success response
-            return {
+            response = {
                 "msg_id": "node_update_response",
                 "status": "success", 
                 "message": "Node update received",
+                "encoding": client_info.encoding,
                 "timestamp": time.time()
             }
+            if client_info.encoding != "json":
+                response["node_code"] = self.node_codes.code_for(node_name)
+            return response
         else:
             logger.warning(f"Received node_update from unknown client ID: {client_id}")
             return {"status": "error", "message": "Client not recognized"}
@@ -107,20 +326,21 @@ class MessageParser:
         # Process different sensor types
         if client_id in self.connected_clients:
             # Store the sensor reading
-            if "sensors" not in self.connected_clients[client_id]:
-                self.connected_clients[client_id]["sensors"] = {}
+            client_info = self.connected_clients[client_id]
+            if client_info.sensors is None:
+                client_info.sensors = {}
                 
             # Update the sensor data for this sensor type
-            self.connected_clients[client_id]["sensors"][sensor_type] = {
+            client_info.sensors[sensor_type] = {
                 "last_reading": timestamp,
                 "data": readings
             }
             
             # Log the sensor data
-            logger.info(f"Sensor data from {client_id} ({sensor_type}): {readings}")
+            logger.info("Sensor data from %s (%s): %s", client_id, sensor_type, readings)
             
             # Check for any threshold alerts
-            alerts = self.check_sensor_thresholds(sensor_type, readings)
+            alerts = self.check_sensor_thresholds(client_id, readings)
             
             # Return success response
             response = {
@@ -138,7 +358,15 @@ class MessageParser:
             logger.warning(f"Sensor data from unknown client ID: {client_id}")
             return {"status": "error", "message": "Client not recognized"}
     
-    
+    def check_sensor_thresholds(self, client_id, readings):
+        """Feed sensor_data readings to the alert engine, returns the alerts they raised or cleared"""
+        if self.alert_engine is None or not isinstance(readings, dict):
+            return []
+        client_info = self.connected_clients.get(client_id)
+        if client_info is None:
+            return []
+        node = client_info.node_name or client_id
+        return self.alert_engine.observe(node, readings, client_info.last_message or time.time(), client_id)
     
     async def handle_status_request(self, message, client_id):
         """Handle status request messages"""
@@ -147,8 +375,8 @@ class MessageParser:
             return {
                 "status": "success",
                 "server_time": time.time(),
-                "connection_duration": time.time() - self.connected_clients[client_id]["connected_at"],
-                "messages_received": len(self.connected_clients[client_id]["data"]),
+                "connection_duration": time.time() - self.connected_clients[client_id].connected_at,
+                "messages_received": self.connected_clients[client_id].history.total,
                 "client_id": client_id
             }
         else:
@@ -0,0 +1,262 @@
+import asyncio
+import bisect
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency buckets, doubling from 10us to ~20s
+LATENCY_BUCKETS = tuple(0.00001 * (2 ** i) for i in range(22))
+MAX_NODE_LABELS = 1000  # Distinct node label values before new nodes are folded into OTHER_NODE
+OTHER_NODE = "_other"
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with O(log buckets) recording"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot catches overflow
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Record one observation"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the observations of a histogram with the same buckets"""
+        for i, bucket_count in enumerate(other.counts):
+            self.counts[i] += bucket_count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Return the upper bound of the bucket holding the q-th percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * q / 100.0)
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def summary(self):
+        """Return a dict summary suitable for logging or JSON output"""
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max
+        }
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class ServerMetrics:
+    """Per msg_id and per node counters and histograms for the server.
+
+    Everything is recorded from the event loop thread with plain dict and
+    int updates, no locks. render() produces the Prometheus text format
+    served by serve_metrics().
+
+    node labels are node names, or the client_id until a node names
+    itself. At most max_nodes of them are kept, later ones are counted
+    under OTHER_NODE. The servers call forget_node(client_id) on
+    disconnect, a client_id never comes back; named series live on
+    across reconnects.
+    """
+
+    def __init__(self, max_nodes=MAX_NODE_LABELS):
+        self.max_nodes = max_nodes
+        self.messages = {}  # node -> {msg_id: count}
+        self.bytes = {}  # node -> {msg_id: bytes received}
+        self.errors = {}  # node -> undecodable messages
+        self.decode_latency = {}  # msg_id -> LatencyHistogram
+        self.handler_latency = {}  # msg_id -> LatencyHistogram, filled by MessageParser
+        self.node_handler_latency = {}  # node -> LatencyHistogram, filled by MessageParser
+        self.drain_latency = {}  # node -> LatencyHistogram
+        self.alert_latency = {}  # stage -> LatencyHistogram, filled by AlertRouter
+        self.gauges = {}  # name -> (help, callable, label names)
+        self.started_at = time.time()
+
+    def node_label(self, node):
+        """The label node is recorded under, OTHER_NODE once max_nodes labels are in use"""
+        if node in self.messages or len(self.messages) < self.max_nodes:
+            return node
+        return OTHER_NODE
+
+    def record_message(self, msg_id, node, nbytes, decode_seconds):
+        """Count one received message and the time spent decoding it"""
+        node = self.node_label(node)
+        messages = self.messages.get(node)
+        if messages is None:
+            messages = self.messages[node] = {}
+            self.bytes[node] = {}
+        received = self.bytes[node]
+        messages[msg_id] = messages.get(msg_id, 0) + 1
+        received[msg_id] = received.get(msg_id, 0) + nbytes
+        _histogram(self.decode_latency, msg_id).record(decode_seconds)
+
+    def record_error(self, node):
+        node = self.node_label(node)
+        self.errors[node] = self.errors.get(node, 0) + 1
+
+    def record_handler(self, node, seconds):
+        """Record the time the handlers spent on one message of a node"""
+        _histogram(self.node_handler_latency, self.node_label(node)).record(seconds)
+
+    def record_drain(self, node, seconds):
+        """Record the time a writer spent waiting for the peer to drain"""
+        _histogram(self.drain_latency, self.node_label(node)).record(seconds)
+
+    def forget_node(self, node):
+        """Drop every series labelled with node"""
+        for series in (self.messages, self.bytes, self.errors, self.node_handler_latency, self.drain_latency):
+            series.pop(node, None)
+
+    def total_messages(self):
+        return sum(sum(messages.values()) for messages in self.messages.values())
+
+    def add_gauge(self, name, help_text, func, label_names=()):
+        """Register a gauge sampled at scrape time.
+
+        func returns a number, or a dict of label value tuples to numbers
+        when label_names is given.
+        """
+        self.gauges[name] = (help_text, func, label_names)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        self._render_counter(lines, "central_messages_total", "Messages received", ("msg_id", "node"),
+                             _by_msg_id(self.messages))
+        self._render_counter(lines, "central_received_bytes_total", "Bytes received", ("msg_id", "node"),
+                             _by_msg_id(self.bytes))
+        self._render_counter(lines, "central_decode_errors_total", "Undecodable messages", ("node",),
+                             {(node,): count for node, count in self.errors.items()})
+        self._render_histograms(lines, "central_decode_seconds", "Time to decode a message", "msg_id", self.decode_latency)
+        self._render_histograms(lines, "central_handler_seconds", "Time spent in message handlers", "msg_id", self.handler_latency)
+        self._render_histograms(lines, "central_node_handler_seconds", "Time spent in message handlers per node", "node",
+                                self.node_handler_latency)
+        self._render_histograms(lines, "central_drain_seconds", "Time waiting for writer drain", "node", self.drain_latency)
+        self._render_histograms(lines, "central_alert_seconds", "Time from a reading arriving to its alert reaching each stage",
+                                "stage", self.alert_latency)
+        for name, (help_text, func, label_names) in self.gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            value = func()
+            if label_names:
+                for label_values, sample in value.items():
+                    lines.append(f"{name}{_labels(label_names, label_values)} {sample}")
+            else:
+                lines.append(f"{name} {value}")
+        lines.append("# HELP central_uptime_seconds Seconds since the metrics were created")
+        lines.append("# TYPE central_uptime_seconds gauge")
+        lines.append(f"central_uptime_seconds {time.time() - self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def _render_counter(self, lines, name, help_text, label_names, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for label_values, value in samples.items():
+            lines.append(f"{name}{_labels(label_names, label_values)} {value}")
+
+    def _render_histograms(self, lines, name, help_text, label_name, histograms):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_value, histogram in histograms.items():
+            if not histogram.count:
+                continue
+            labels = _labels((label_name,), (label_value,))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = _labels((label_name, "le"), (label_value, f"{bound:g}"))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_bucket{_labels((label_name, 'le'), (label_value, '+Inf'))} {histogram.count}")
+            lines.append(f"{name}_sum{labels} {histogram.sum}")
+            lines.append(f"{name}_count{labels} {histogram.count}")
+
+def _histogram(histograms, key):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = LatencyHistogram()
+    return histogram
+
+def _by_msg_id(samples):
+    """node -> {msg_id: value} as (msg_id, node) -> value"""
+    return {(msg_id, node): value for node, per_msg in samples.items() for msg_id, value in per_msg.items()}
+
+async def serve_metrics(metrics, host="127.0.0.1", port=9100):
+    """Serve metrics.render() over HTTP from the running event loop.
+
+    Just enough HTTP/1.0 for a scraper or curl: GET /metrics answers with
+    the text format, anything else with 404.
+    """
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
+
+def add_server_gauges(metrics, connections, storage=None):
+    """Register the queue depth gauges shared by the server front ends"""
+    def write_buffers():
+        sizes = [conn.writer.transport.get_write_buffer_size()
+                 for conn in list(connections.values()) if conn.writer is not None]
+        return {("total",): sum(sizes), ("max",): max(sizes, default=0)}
+
+    metrics.add_gauge("central_connected_clients", "Connected nodes", lambda: len(connections))
+    metrics.add_gauge("central_write_buffer_bytes", "Bytes queued for sending to nodes", write_buffers, ("stat",))
+    metrics.add_gauge("central_event_loop_tasks", "Tasks alive on the event loop", lambda: len(asyncio.all_tasks()))
+    if storage is not None:
+        add_storage_gauges(metrics, storage)
+
+def add_broadcast_gauges(metrics, broadcaster):
+    """Register the outbox gauges of a Broadcaster"""
+    metrics.add_gauge("central_outbox_bytes", "Bytes waiting in per-connection outboxes",
+                      broadcaster.queue_depths, ("stat",))
+    metrics.add_gauge("central_outbox_dropped", "Messages shed for slow connections", lambda: broadcaster.dropped)
+
+def add_storage_gauges(metrics, storage):
+    """Register the gauges of a StorageEngine, for stores opened after startup"""
+    metrics.add_gauge("central_storage_pending_readings", "Readings waiting for the storage writer",
+                      storage.pending_count)
@@ -0,0 +1,188 @@
+"""Sharded server mode: N worker processes behind one port.
+
+Every worker runs the full nogui server and binds the node port with
+SO_REUSEPORT, so the kernel spreads incoming connections over the workers
+and each worker owns the connections it accepted. Cluster-wide state goes
+through the parent process over a local newline-JSON channel:
+
+    worker -> parent  {"type": "status", "worker": 0, "clients": 12, "messages": 340, "fire_nodes": [...]}
+                      {"type": "fire", "worker": 0, "node": "DHTT Node", "fire": true}
+    parent -> workers {"type": "cluster", "workers": 4, "clients": 48, "messages": 1360, "fire_nodes": [...]}
+
+The parent merges the reports, logs cluster-wide fire changes, and pushes
+the merged view back to every worker as ClusterLink.state.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+
+logger = logging.getLogger("Cluster")
+
+AGGREGATION_HOST = "127.0.0.1"
+AGGREGATION_PORT = 8766
+STATUS_INTERVAL = 5  # Seconds between worker status reports
+RECONNECT_DELAY = 1
+
+class ClusterCoordinator:
+    """Parent side of the aggregation channel"""
+
+    def __init__(self, expected_workers):
+        self.expected_workers = expected_workers
+        self.workers = {}  # worker -> latest status report
+        self.writers = {}  # worker -> StreamWriter
+        self.fire = {}  # node -> set of workers reporting fire there
+        self.server = None
+
+    async def start(self, host=AGGREGATION_HOST, port=AGGREGATION_PORT):
+        self.server = await asyncio.start_server(self.handle_worker, host, port)
+        logger.info(f"Aggregation channel listening on {host}:{port}")
+
+    def snapshot(self):
+        """The merged cluster view sent to every worker"""
+        return {
+            "type": "cluster",
+            "workers": len(self.workers),
+            "clients": sum(report.get("clients", 0) for report in self.workers.values()),
+            "messages": sum(report.get("messages", 0) for report in self.workers.values()),
+            "fire_nodes": sorted(node for node, workers in self.fire.items() if workers),
+            "timestamp": time.time()
+        }
+
+    async def handle_worker(self, reader, writer):
+        worker = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    logger.warning("Ignoring malformed aggregation message")
+                    continue
+                worker = report.get("worker")
+                self.writers[worker] = writer
+                if report.get("type") == "status":
+                    self.workers[worker] = report
+                    self._set_fire_nodes(worker, report.get("fire_nodes", ()))
+                elif report.get("type") == "fire":
+                    self._set_fire(worker, report.get("node"), report.get("fire"))
+                self.publish()
+        except ConnectionError:
+            pass
+        finally:
+            if worker is not None:
+                logger.warning(f"Worker {worker} left the aggregation channel")
+                self.workers.pop(worker, None)
+                self.writers.pop(worker, None)
+                self._set_fire_nodes(worker, ())
+            writer.close()
+
+    def _set_fire(self, worker, node, fire_present):
+        workers = self.fire.setdefault(node, set())
+        was_burning = bool(workers)
+        if fire_present:
+            workers.add(worker)
+        else:
+            workers.discard(worker)
+        if bool(workers) != was_burning:
+            if workers:
+                logger.warning(f"Cluster: fire conditions detected at {node} (worker {worker})")
+            else:
+                logger.info(f"Cluster: fire conditions cleared at {node}")
+
+    def _set_fire_nodes(self, worker, nodes):
+        """Reconcile one worker's full fire list, in case a change message was missed"""
+        nodes = set(nodes)
+        for node, workers in list(self.fire.items()):
+            if worker in workers and node not in nodes:
+                self._set_fire(worker, node, False)
+        for node in nodes:
+            if worker not in self.fire.get(node, ()):
+                self._set_fire(worker, node, True)
+
+    def publish(self):
+        """Push the merged view to every worker, encoded once"""
+        frame = (json.dumps(self.snapshot()) + '\n').encode()
+        for writer in list(self.writers.values()):
+            if not writer.is_closing():
+                writer.write(frame)
+
+    async def status_monitor(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            state = self.snapshot()
+            logger.info(f"Cluster status: {state['workers']}/{self.expected_workers} workers, "
+                        f"{state['clients']} clients, {state['messages']} messages, fire at {state['fire_nodes']}")
+
+class ClusterLink:
+    """Worker side of the aggregation channel.
+
+    publish() never blocks the worker: while the parent is unreachable,
+    reports are dropped and the next status report resynchronises it.
+    """
+
+    def __init__(self, worker, host=AGGREGATION_HOST, port=AGGREGATION_PORT):
+        self.worker = worker
+        self.host = host
+        self.port = port
+        self.writer = None
+        self.state = {}  # Latest cluster view from the parent
+
+    def publish(self, message):
+        if self.writer is None or self.writer.is_closing():
+            return False
+        message["worker"] = self.worker
+        self.writer.write((json.dumps(message) + '\n').encode())
+        return True
+
+    async def run(self):
+        """Keep connected to the parent and track the cluster view it sends"""
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                self.publish({"type": "hello"})
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    if message.get("type") == "cluster":
+                        self.state = message
+            except (OSError, ValueError) as e:
+                logger.warning(f"Worker {self.worker}: aggregation channel error: {e}")
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            await asyncio.sleep(RECONNECT_DELAY)
+
+def run_sharded(workers, worker_target, port=AGGREGATION_PORT):
+    """Start the coordinator, spawn worker_target(index, port) in each worker and wait"""
+    context = multiprocessing.get_context("spawn")
+
+    async def coordinate():
+        coordinator = ClusterCoordinator(workers)
+        await coordinator.start(AGGREGATION_HOST, port)
+        processes = []
+        for index in range(workers):
+            process = context.Process(target=worker_target, args=(index, port), name=f"shard-{index}", daemon=True)
+            process.start()
+            processes.append(process)
+        logger.info(f"Started {workers} worker processes")
+        monitor = asyncio.create_task(coordinator.status_monitor())
+        try:
+            # Stop when any worker exits, a partial cluster silently drops its share of nodes
+            while all(process.is_alive() for process in processes):
+                await asyncio.sleep(1)
+            logger.error("A worker process exited, shutting down the cluster")
+        finally:
+            monitor.cancel()
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
+
+    asyncio.run(coordinate())
@@ -0,0 +1,487 @@
+"""Append-only on-disk storage for sensor readings.
+
+Readings are kept per (node, metric) series in segment files under
+
+    <root>/<node>/<metric>/<first timestamp in microseconds>.seg
+
+node is the node name, the only identity that survives a reconnect, so
+nodes sharing a name (the firmware defaults do) write into one series.
+
+Each segment is a flat array of little-endian (timestamp, value) doubles,
+sorted by timestamp. The list of segments with their first/last
+timestamps, ordered by first timestamp, is the time index used to pick
+the files a range query has to touch; inside a segment the start of the
+range is found by binary search over a memory map, so historical queries
+never load whole series. Segments only overlap when the clock went
+backwards, a query merges overlapping ones so results stay in time order.
+
+append() only queues the reading. A writer thread group-commits the queue
+every flush_interval seconds (one write and one fsync per touched file)
+and periodically applies retention and merges small segments. Segment
+counts grow only after the fsync, so a query never maps past the end of a
+file and the index is never ahead of the disk.
+"""
+import bisect
+import heapq
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<dd")  # timestamp, value
+DEFAULT_ROOT = "sensor_data"
+SEGMENT_RECORDS = 65536  # 1 MiB segments
+FLUSH_INTERVAL = 1.0  # Seconds between group commits
+MAX_PENDING = 100000  # Force a commit once this many readings are queued
+RETENTION = 30 * 24 * 3600  # Seconds of history kept on disk
+MAINTENANCE_INTERVAL = 600  # Seconds between retention/compaction passes
+
+# Numeric message fields stored as metrics
+METRIC_FIELDS = ("temperature", "humidity", "smoke_level")
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+def series_key(name):
+    """Turn a node or metric name into a safe directory name"""
+    key = _UNSAFE_CHARS.sub("_", str(name)).strip(".")
+    return key or "_"
+
+class Segment:
+    """One segment file and the time range it covers"""
+
+    __slots__ = ("path", "first_ts", "last_ts", "count")
+
+    def __init__(self, path, first_ts, last_ts, count):
+        self.path = path
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.count = count
+
+    def read_records(self):
+        """Load every record of the segment, only used by compaction"""
+        with open(self.path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % RECORD.size
+        return [RECORD.unpack_from(data, offset) for offset in range(0, usable, RECORD.size)]
+
+class Series:
+    """Segments of one (node, metric) series, ordered by first timestamp"""
+
+    __slots__ = ("directory", "segments", "active", "handle")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        self.active = None  # Segment being appended to, not necessarily the last one
+        self.handle = None  # Append handle on the active segment
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+class StorageEngine:
+    def __init__(self, root=DEFAULT_ROOT, segment_records=SEGMENT_RECORDS, flush_interval=FLUSH_INTERVAL,
+                 retention=RETENTION, maintenance_interval=MAINTENANCE_INTERVAL):
+        self.root = root
+        self.segment_records = segment_records
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.maintenance_interval = maintenance_interval
+
+        self.series = {}  # (node, metric) -> Series
+        self._index_lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._unremoved = []  # Compacted-away segment files the OS would not delete yet
+        self._stopping = False
+        self._thread = None
+
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    # ------------------------------------------------------------------ write path
+
+    def append(self, node, metric, timestamp, value):
+        """Queue one reading, never blocks on disk I/O"""
+        with self._pending_lock:
+            self._pending.append((node, metric, timestamp, value))
+            pending = len(self._pending)
+        if pending >= MAX_PENDING:
+            self._wakeup.set()
+
+    def pending_count(self):
+        """Readings queued but not yet written"""
+        return len(self._pending)
+
+    def record_message(self, node, message, timestamp):
+        """Queue every numeric metric carried by a decoded message, node is the series' node name"""
+        node = series_key(node)
+        for field in METRIC_FIELDS:
+            value = message.get(field)
+            if field == "smoke_level" and value is None:
+                value = message.get("smoke")
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.append(node, field, timestamp, float(value))
+        motor_position = message.get("motor_position")
+        if isinstance(motor_position, (list, tuple)) and len(motor_position) == 2:
+            try:
+                self.append(node, "motor_x", timestamp, float(motor_position[0]))
+                self.append(node, "motor_y", timestamp, float(motor_position[1]))
+            except (TypeError, ValueError):
+                pass
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._writer_loop, name="StorageWriter", daemon=True)
+            self._thread.start()
+            logger.info(f"Storage engine writing to {os.path.abspath(self.root)}")
+
+    def stop(self):
+        """Commit everything still queued and stop the writer thread"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._index_lock:
+            for series in self.series.values():
+                series.close()
+
+    def flush(self):
+        """Write and fsync every queued reading (group commit)"""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+
+        # Group by series so each file gets one write and one fsync
+        grouped = {}
+        for node, metric, timestamp, value in batch:
+            grouped.setdefault((node, metric), []).append((timestamp, value))
+
+        touched = []
+        staged = {}  # segment -> (count, last_ts) once the writes are on disk
+        with self._index_lock:
+            for key, records in grouped.items():
+                series = self._get_series(key)
+                self._append_records(series, records, touched, staged)
+        for handle in touched:
+            handle.flush()
+            os.fsync(handle.fileno())
+        # Only now may readers see the new records
+        with self._index_lock:
+            for segment, (count, last_ts) in staged.items():
+                segment.count = count
+                segment.last_ts = last_ts
+        return len(batch)
+
+    def _writer_loop(self):
+        last_maintenance = time.time()
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.time() - last_maintenance >= self.maintenance_interval:
+                    self.apply_retention()
+                    self.compact()
+                    last_maintenance = time.time()
+            except Exception as e:
+                logger.error(f"Storage writer error: {e}")
+
+    def _get_series(self, key):
+        series = self.series.get(key)
+        if series is None:
+            series = Series(os.path.join(self.root, key[0], key[1]))
+            os.makedirs(series.directory, exist_ok=True)
+            self.series[key] = series
+        return series
+
+    def _append_records(self, series, records, touched, staged):
+        """Append records to a series, rolling segments as needed.
+
+        The handles written go to touched. The segment sizes they lead to go
+        to staged instead of the segments, the caller publishes them after
+        the fsync.
+        """
+        records.sort()
+        start = 0
+        while start < len(records):
+            segment = series.active
+            if segment is not None:
+                count, last_ts = staged.get(segment, (segment.count, segment.last_ts))
+            # Roll over when the segment is full or time went backwards, so every segment stays sorted
+            if segment is None or count >= self.segment_records or records[start][0] < last_ts:
+                if series.handle is not None and series.handle in touched:
+                    # Commit the segment we are leaving before its handle goes away
+                    touched.remove(series.handle)
+                    series.handle.flush()
+                    os.fsync(series.handle.fileno())
+                series.close()
+                segment = self._new_segment(series, records[start][0])
+                count = 0
+            if series.handle is None:
+                series.handle = open(segment.path, "ab")
+
+            room = self.segment_records - count
+            chunk = records[start:start + room]
+            series.handle.write(b"".join(RECORD.pack(ts, value) for ts, value in chunk))
+            staged[segment] = (count + len(chunk), chunk[-1][0])
+            start += len(chunk)
+            if series.handle not in touched:
+                touched.append(series.handle)
+
+    def _new_segment(self, series, first_ts):
+        micros = int(first_ts * 1e6)
+        path = os.path.join(series.directory, f"{micros:020d}.seg")
+        while os.path.exists(path):
+            micros += 1
+            path = os.path.join(series.directory, f"{micros:020d}.seg")
+        segment = Segment(path, first_ts, first_ts, 0)
+        bisect.insort(series.segments, segment, key=_first_ts)
+        series.active = segment
+        return segment
+
+    # ------------------------------------------------------------------ index
+
+    def _load_index(self):
+        """Rebuild the segment index from the files on disk"""
+        for node in sorted(os.listdir(self.root)):
+            node_dir = os.path.join(self.root, node)
+            if not os.path.isdir(node_dir):
+                continue
+            for metric in sorted(os.listdir(node_dir)):
+                metric_dir = os.path.join(node_dir, metric)
+                if not os.path.isdir(metric_dir):
+                    continue
+                series = Series(metric_dir)
+                for name in sorted(os.listdir(metric_dir)):
+                    if not name.endswith(".seg"):
+                        continue
+                    segment = self._scan_segment(os.path.join(metric_dir, name))
+                    if segment is not None:
+                        series.segments.append(segment)
+                if series.segments:
+                    series.segments.sort(key=_first_ts)
+                    series.active = series.segments[-1]
+                    self.series[(node, metric)] = series
+
+    def _scan_segment(self, path):
+        """Read the first and last record of a segment file"""
+        size = os.path.getsize(path)
+        torn = size % RECORD.size
+        if torn:
+            # A crash mid-write leaves a partial record, cut it off
+            with open(path, "r+b") as f:
+                f.truncate(size - torn)
+            size -= torn
+        if not size:
+            os.remove(path)
+            return None
+        with open(path, "rb") as f:
+            first_ts, _ = RECORD.unpack(f.read(RECORD.size))
+            f.seek(size - RECORD.size)
+            last_ts, _ = RECORD.unpack(f.read(RECORD.size))
+        return Segment(path, first_ts, last_ts, size // RECORD.size)
+
+    def nodes(self):
+        with self._index_lock:
+            return sorted({node for node, _ in self.series})
+
+    def metrics(self, node):
+        node = series_key(node)
+        with self._index_lock:
+            return sorted(metric for n, metric in self.series if n == node)
+
+    # ------------------------------------------------------------------ read path
+
+    def query(self, node, metric, start=-math.inf, end=math.inf):
+        """Yield (timestamp, value) for a series within [start, end].
+
+        Only committed readings are visible. Segments are memory mapped one
+        at a time so the memory use does not depend on the range size,
+        except that segments overlapping in time are read together.
+        """
+        key = (series_key(node), series_key(metric))
+        with self._index_lock:
+            series = self.series.get(key)
+            if series is None:
+                return
+            # Snapshot the segments overlapping the range with their committed size. They are
+            # opened under the lock so compaction or retention cannot swap the files underneath.
+            segments = []
+            for seg in series.segments:
+                if seg.last_ts >= start and seg.first_ts <= end:
+                    try:
+                        segments.append((open(seg.path, "rb"), seg.count, seg.first_ts, seg.last_ts))
+                    except FileNotFoundError:
+                        continue
+
+        try:
+            for group in _overlapping(segments):
+                if len(group) == 1:
+                    yield from _read_segment(group[0][0], group[0][1], start, end)
+                else:
+                    yield from heapq.merge(*[_read_segment(f, count, start, end) for f, count, _, _ in group])
+        finally:
+            for f, _, _, _ in segments:
+                f.close()
+
+    def replay(self, start=-math.inf, end=math.inf, nodes=None, metrics=None):
+        """Yield (timestamp, node, metric, value) for many series merged in time order.
+
+        Each series is streamed from its segments, heapq.merge keeps only
+        one pending record per series in memory.
+        """
+        with self._index_lock:
+            keys = [key for key in self.series
+                    if (nodes is None or key[0] in nodes) and (metrics is None or key[1] in metrics)]
+        streams = [_tag(self.query(node, metric, start, end), node, metric) for node, metric in sorted(keys)]
+        yield from heapq.merge(*streams)
+
+    # ------------------------------------------------------------------ maintenance
+
+    def apply_retention(self, now=None):
+        """Delete segments that only hold readings older than the retention window"""
+        cutoff = (time.time() if now is None else now) - self.retention
+        removed = 0
+        with self._index_lock:
+            for series in self.series.values():
+                keep = []
+                for segment in series.segments:
+                    if segment.last_ts < cutoff:
+                        if segment is series.active:
+                            series.close()
+                            series.active = None
+                        if _remove(segment.path):
+                            removed += 1
+                            continue
+                    keep.append(segment)
+                series.segments = keep
+        if removed:
+            logger.info(f"Retention removed {removed} segments")
+        return removed
+
+    def compact(self):
+        """Merge runs of small sealed segments into full-size ones"""
+        small = self.segment_records // 4
+        merged = 0
+        retired = []  # Files of merged segments, unlinked once the index no longer lists them
+        with self._index_lock:
+            self._unremoved = [path for path in self._unremoved if not _remove(path)]
+            for series in self.series.values():
+                sealed = [seg for seg in series.segments if seg is not series.active]  # Never touch the segment being appended to
+                result = []
+                run = []
+                for segment in sealed:
+                    if segment.count < small and sum(seg.count for seg in run) + segment.count <= self.segment_records:
+                        run.append(segment)
+                        continue
+                    result.extend(self._merge_run(run, retired))
+                    run = [segment] if segment.count < small else []
+                    if segment.count >= small:
+                        result.append(segment)
+                result.extend(self._merge_run(run, retired))
+                if len(result) != len(sealed):
+                    merged += len(sealed) - len(result)
+                    if series.active is not None:
+                        result.append(series.active)
+                    series.segments = sorted(result, key=_first_ts)
+            for path in retired:
+                if not _remove(path):
+                    self._unremoved.append(path)
+        if merged:
+            logger.info(f"Compaction removed {merged} segments")
+        return merged
+
+    def _merge_run(self, run, retired):
+        """Rewrite a run of segments as one sorted segment under a new name.
+
+        The old files are never overwritten, a query that opened them keeps
+        reading what it snapshotted. Their paths go to retired for the
+        caller to unlink after swapping the index entries.
+        """
+        if len(run) < 2:
+            return run
+        records = []
+        for segment in run:
+            records.extend(segment.read_records())
+        records.sort()
+
+        directory = os.path.dirname(run[0].path)
+        micros = int(records[0][0] * 1e6)
+        target = os.path.join(directory, f"{micros:020d}.seg")
+        while os.path.exists(target):
+            micros += 1
+            target = os.path.join(directory, f"{micros:020d}.seg")
+        tmp_path = target + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(RECORD.pack(ts, value) for ts, value in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, target)
+        retired.extend(segment.path for segment in run)
+        return [Segment(target, records[0][0], records[-1][0], len(records))]
+
+def _first_ts(segment):
+    return segment.first_ts
+
+def _overlapping(segments):
+    """Group (file, count, first_ts, last_ts) sorted by first_ts into runs that overlap in time"""
+    group = []
+    group_end = -math.inf
+    for segment in segments:
+        if group and segment[2] > group_end:
+            yield group
+            group = []
+            group_end = -math.inf
+        group.append(segment)
+        group_end = max(group_end, segment[3])
+    if group:
+        yield group
+
+def _read_segment(f, count, start, end):
+    """Yield records of one open segment file within [start, end] through a memory map"""
+    size = count * RECORD.size
+    if not size:
+        return
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+        # Binary search for the first record at or after start
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(mm, mid * RECORD.size)[0] < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        for offset in range(lo * RECORD.size, size, RECORD.size):
+            timestamp, value = RECORD.unpack_from(mm, offset)
+            if timestamp > end:
+                break
+            yield timestamp, value
+
+def _tag(stream, node, metric):
+    for timestamp, value in stream:
+        yield timestamp, node, metric, value
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        # Windows refuses to delete a file that is still mapped, try again next pass
+        logger.warning(f"Could not remove segment {path}: {e}")
+        return False
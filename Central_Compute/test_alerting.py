@@ -0,0 +1,42 @@
+from alerting import AlertEngine, EXPIRED
+from connection_manager import Connection
+from message_parser import MessageParser
+
+def make_parser(engine, client_ids, node_name="DHTT Node"):
+    """A parser whose connections all announced the same firmware node name"""
+    clients = {}
+    for client_id in client_ids:
+        connection = Connection(client_id, None, None, ("127.0.0.1", 0))
+        connection.node_name = node_name
+        clients[client_id] = connection
+    parser = MessageParser(connected_clients=clients, alert_engine=engine)
+    parser.add_reading_listener(engine.observe)
+    return parser
+
+def reading(temperature):
+    return {"msg_id": "dhtt_data", "temperature": temperature, "humidity": 40.0}
+
+def test_same_named_connections_keep_their_own_windows():
+    engine = AlertEngine()
+    parser = make_parser(engine, ("a", "b"))
+    parser.record_reading(reading(50.0), "a", 1000.0)
+    parser.record_reading(reading(20.0), "b", 1000.0)
+
+    assert list(engine.active) == [("a", "temperature_high")]
+    assert engine.windows[("b", "temperature")].mean() == 20.0
+
+def test_disconnect_expires_only_that_connections_alerts():
+    engine = AlertEngine()
+    parser = make_parser(engine, ("a", "b"))
+    transitions = []
+    engine.add_listener(transitions.append)
+    parser.record_reading(reading(50.0), "a", 1000.0)
+    parser.record_reading(reading(50.0), "b", 1000.0)
+
+    expired = engine.forget("a", now=1001.0)
+
+    assert [(alert["node"], alert["state"]) for alert in expired] == [("DHTT Node", EXPIRED)]
+    assert [alert["state"] for alert in transitions].count(EXPIRED) == 1
+    assert list(engine.active) == [("b", "temperature_high")]
+    assert ("a", "temperature") not in engine.windows
+    assert len(engine.windows[("b", "temperature")]) == 1
@@ -0,0 +1,196 @@
+"""Compact binary framing for node readings, alongside newline JSON.
+
+A binary frame starts with MAGIC, which can never start a JSON line, so
+both formats can share one connection:
+
+    header  <BBHIH  magic, type code, node code, seq, payload length
+    payload         packed fields of the message type
+
+msg_id and node_name are interned: msg_id as a one-byte type code from
+MESSAGE_TYPES, node_name as a two-byte code the server hands out in the
+node_update response. A batch payload is the concatenation of the binary
+frames of its readings, preceded by the node's send time (sent_at) in
+the timed batch layout. Batches do not nest. Messages without a binary
+layout stay JSON.
+
+Keep MESSAGE_TYPES in sync with Node/wire_protocol.py.
+"""
+import json
+import struct
+
+ENCODING = "bin1"
+MAGIC = 0xFB
+HEADER = struct.Struct("<BBHIH")
+MAX_PAYLOAD = 0xFFFF
+
+# type code -> (msg_id, payload struct, field names)
+MESSAGE_TYPES = {
+    1: ("dhtt_data", struct.Struct("<dff"), ("timestamp", "temperature", "humidity")),
+    2: ("smoke_data", struct.Struct("<df"), ("timestamp", "smoke_level")),
+    3: ("motor_data", struct.Struct("<dff"), ("timestamp", "motor_x", "motor_y")),
+    4: ("batch", None, ()),
+    5: ("batch", struct.Struct("<d"), ("sent_at",)),  # Timed batch, the readings follow the sent_at field
+}
+BATCH_CODE = 4
+TIMED_BATCH_CODE = 5
+TYPE_CODES = {msg_id: code for code, (msg_id, _, _) in MESSAGE_TYPES.items() if code != TIMED_BATCH_CODE}
+
+class FrameError(ValueError):
+    """A binary frame could not be decoded"""
+
+class NodeCodes:
+    """Interning table for node names, shared by every connection of a server"""
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def code_for(self, node_name):
+        code = self.codes.get(node_name)
+        if code is None:
+            if len(self.names) > 0xFFFF:
+                raise FrameError("node code space exhausted")
+            code = len(self.names)
+            self.codes[node_name] = code
+            self.names.append(node_name)
+        return code
+
+    def name_for(self, code):
+        if code < len(self.names):
+            return self.names[code]
+        return None
+
+def negotiate(offered):
+    """Pick the encoding for a connection from the node's offered list"""
+    if isinstance(offered, (list, tuple)) and ENCODING in offered:
+        return ENCODING
+    return "json"
+
+def encode_json(message):
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+def encode_binary(message, node_code, seq=0):
+    """Encode a message as a binary frame, None when it has no binary layout"""
+    code = TYPE_CODES.get(message.get("msg_id"))
+    if code is None:
+        return None
+    if code == BATCH_CODE:
+        parts = []
+        for reading in message.get("readings", ()):
+            nested = not isinstance(reading, dict) or reading.get("msg_id") == "batch"
+            frame = None if nested else encode_binary(reading, node_code)
+            if frame is None:
+                return None
+            parts.append(frame)
+        payload = b"".join(parts)
+        sent_at = _field_values(message, ("sent_at",))
+        if sent_at is not None:
+            code = TIMED_BATCH_CODE
+            payload = MESSAGE_TYPES[code][1].pack(*sent_at) + payload
+    else:
+        _, layout, fields = MESSAGE_TYPES[code]
+        values = _field_values(message, fields)
+        if values is None:
+            return None
+        payload = layout.pack(*values)
+    if len(payload) > MAX_PAYLOAD:
+        return None
+    return HEADER.pack(MAGIC, code, node_code, seq or 0, len(payload)) + payload
+
+def _field_values(message, fields):
+    values = []
+    for field in fields:
+        if field in ("motor_x", "motor_y"):
+            position = message.get("motor_position")
+            if not isinstance(position, (list, tuple)) or len(position) != 2:
+                return None
+            value = position[0 if field == "motor_x" else 1]
+        else:
+            value = message.get(field)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return None
+        values.append(value)
+    return values
+
+def decode_binary(frame, node_codes, offset=0, limit=None):
+    """Decode the binary frame at offset, returns (message, next offset).
+
+    limit is the end of the enclosing batch payload when decoding one of
+    its readings; a reading must not reach past it or be a batch itself.
+    """
+    in_batch = limit is not None
+    if not in_batch:
+        limit = len(frame)
+    if limit - offset < HEADER.size:
+        raise FrameError("truncated header")
+    magic, code, node_code, seq, length = HEADER.unpack_from(frame, offset)
+    if magic != MAGIC:
+        raise FrameError("bad magic")
+    entry = MESSAGE_TYPES.get(code)
+    if entry is None:
+        raise FrameError(f"unknown type code {code}")
+    start = offset + HEADER.size
+    end = start + length
+    if end > limit:
+        raise FrameError("reading overruns its batch" if in_batch else "truncated payload")
+
+    msg_id, layout, fields = entry
+    message = {"msg_id": msg_id}
+    if code in (BATCH_CODE, TIMED_BATCH_CODE):
+        if in_batch:
+            raise FrameError("nested batch")
+        readings = []
+        position = start
+        if code == TIMED_BATCH_CODE:
+            if length < layout.size:
+                raise FrameError("bad payload length for batch")
+            message["sent_at"] = layout.unpack_from(frame, start)[0]
+            position += layout.size
+        while position < end:
+            reading, position = decode_binary(frame, node_codes, position, end)
+            readings.append(reading)
+        message["readings"] = readings
+    else:
+        if length != layout.size:
+            raise FrameError(f"bad payload length for {msg_id}")
+        values = layout.unpack_from(frame, start)
+        for field, value in zip(fields, values):
+            if field not in ("motor_x", "motor_y"):
+                message[field] = value
+        if code == TYPE_CODES["motor_data"]:
+            message["motor_position"] = [values[1], values[2]]
+
+    node_name = node_codes.name_for(node_code)
+    if node_name is not None:
+        message["node_name"] = node_name
+    if seq:
+        message["seq"] = seq
+    return message, end
+
+async def read_frame(reader):
+    """Read one raw JSON line or binary frame from a StreamReader, b"" on EOF"""
+    first = await reader.read(1)
+    if not first:
+        return b""
+    if first[0] == MAGIC:
+        header = first + await reader.readexactly(HEADER.size - 1)
+        length = HEADER.unpack(header)[4]
+        return header + await reader.readexactly(length)
+    return first + await reader.readline()
+
+def decode_frame(frame, node_codes):
+    """Decode a frame returned by read_frame, raises ValueError if it is invalid"""
+    if frame[0] == MAGIC:
+        return decode_binary(frame, node_codes)[0]
+    return json.loads(frame.decode('utf-8'))
+
+async def read_message(reader, node_codes):
+    """Read one JSON line or binary frame from a StreamReader.
+
+    Returns (message, frame size in bytes), or (None, 0) when the peer
+    closed the connection. Raises ValueError for undecodable input.
+    """
+    frame = await read_frame(reader)
+    if not frame:
+        return None, 0
+    return decode_frame(frame, node_codes), len(frame)
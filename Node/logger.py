@@ -1,5 +1,17 @@
 import time
 
+try:
+    from micropython import const  # type: ignore
+except ImportError:
+    def const(value):
+        return value
+
+# Global kill switch. With LOGGING_ENABLED = const(0) every log call returns
+# on its first comparison and nothing is formatted, timestamped or printed.
+LOGGING_ENABLED = const(1)
+
+DEFAULT_RING_SIZE = 64  # Entries kept by the in-RAM sink
+
 
 class Logger:
     # Log levels
@@ -8,7 +20,8 @@ class Logger:
     WARNING = 30
     ERROR = 40
     CRITICAL = 50
-    
+    OFF = 100  # Above every level, disables all output
+
     # Level names for display
     LEVEL_NAMES = {
         DEBUG: "DEBUG",
@@ -17,7 +30,7 @@ class Logger:
         ERROR: "ERROR",
         CRITICAL: "CRITICAL"
     }
-    
+
     # ANSI color codes
     COLORS = {
         DEBUG: "\033[36m",      # Cyan
@@ -28,19 +41,84 @@ class Logger:
     }
 
     RESET = "\033[0m"
-    
+
     max_level_len = len(LEVEL_NAMES[CRITICAL])
-    
+
     def __init__(self, min_level=INFO, use_color=True):
         """Initialize logger with minimum level to display."""
-        self.min_level = min_level
+        self.min_level = min_level if LOGGING_ENABLED else self.OFF
         self.use_color = use_color
-    
-    def _log(self, level=DEBUG, driver_str=None, func_str=None, message=None):
-        """Internal logging method."""
+        self.print_enabled = True  # Write to the console/UART
+        self.ring = None  # In-RAM sink, see enable_ring()
+        self.ring_index = 0
+        self.ring_count = 0
+        self.ring_total = 0  # Entries ever put in the ring, marks what was already sent
+
+    def enabled(self, level):
+        """True if a message at level would be logged, to guard expensive call sites."""
+        return level >= self.min_level
+
+    def enable_ring(self, size=DEFAULT_RING_SIZE, print_enabled=False):
+        """Keep the last size entries in RAM, optionally stop printing them."""
+        self.ring = [None] * size
+        self.ring_index = 0
+        self.ring_count = 0
+        self.print_enabled = print_enabled
+
+    def disable_ring(self):
+        self.ring = None
+        self.ring_count = 0
+        self.print_enabled = True
+
+    def peek_ring(self):
+        """Return (entries, mark) without emptying the ring.
+
+        Each entry is [timestamp, level name, driver, function, message].
+        Pass mark to discard_ring() once the entries are safely elsewhere;
+        entries logged in the meantime are kept.
+        """
+        if self.ring is None or not self.ring_count:
+            return [], self.ring_total
+        size = len(self.ring)
+        start = (self.ring_index - self.ring_count) % size
+        return [self.ring[(start + i) % size] for i in range(self.ring_count)], self.ring_total
+
+    def discard_ring(self, mark):
+        """Drop the entries logged up to mark, as returned by peek_ring()"""
+        if self.ring is None:
+            return
+        keep = min(self.ring_count, self.ring_total - mark)
+        size = len(self.ring)
+        start = (self.ring_index - self.ring_count) % size
+        for i in range(self.ring_count - keep):
+            self.ring[(start + i) % size] = None
+        self.ring_count = keep
+
+    def _log(self, level=DEBUG, driver_str=None, func_str=None, message=None, args=None):
+        """Internal logging method.
+
+        message may be a format string filled from args with str.format, or
+        a callable returning the message. Either way the work is only done
+        for messages that are actually logged.
+        """
         if level < self.min_level:
             return
-            
+        if callable(message):
+            message = message()
+        elif args:
+            message = message.format(*args)
+
+        level_name = self.LEVEL_NAMES.get(level, "UNKNOWN")
+
+        if self.ring is not None:
+            self.ring[self.ring_index] = [time.time(), level_name, driver_str, func_str, message]
+            self.ring_index = (self.ring_index + 1) % len(self.ring)
+            if self.ring_count < len(self.ring):
+                self.ring_count += 1
+            self.ring_total += 1
+        if not self.print_enabled:
+            return
+
         # Get current timestamp
         timestamp = time.localtime()
         time_str = "{:02d}:{:02d}:{:02d}".format(
@@ -48,14 +126,10 @@ class Logger:
             timestamp[4],  # Minute
             timestamp[5],  # Second
         )
-        
-        # Format and print message
-        level_name = self.LEVEL_NAMES.get(level, "UNKNOWN")
-        
 
         # Add color if enabled
         if self.use_color:
-            
+
             color_level = self.COLORS.get(level, self.RESET)
 
             color_driver = self.COLORS.get(logger.WARNING, self.RESET)
@@ -64,31 +138,40 @@ class Logger:
             print(f"[{time_str}]*[{color_level}{level_name}{self.RESET}]*[{color_driver}{driver_str}{self.RESET}]*[{color_func}{func_str}{self.RESET}] -> {message}")
         else:
             print(f"[{time_str}]*[{level_name}]*[{driver_str}]*[{func_str}] -> {message}")
-    
-    def debug(self, driver_str, func_str, message):
+
+    # The level check is repeated in each method so a disabled call costs a
+    # single comparison and no further function call.
+    def debug(self, driver_str, func_str, message, *args):
         """Log debug message."""
-        self._log(self.DEBUG, driver_str, func_str, message)
-    
-    def info(self, driver_str, func_str, message):
+        if self.DEBUG >= self.min_level:
+            self._log(self.DEBUG, driver_str, func_str, message, args)
+
+    def info(self, driver_str, func_str, message, *args):
         """Log info message."""
-        self._log(self.INFO, driver_str, func_str, message)
-    
-    def warning(self, driver_str, func_str, message):
+        if self.INFO >= self.min_level:
+            self._log(self.INFO, driver_str, func_str, message, args)
+
+    def warning(self, driver_str, func_str, message, *args):
         """Log warning message."""
-        self._log(self.WARNING, driver_str, func_str, message)
-    
-    def error(self, driver_str, func_str, message):
+        if self.WARNING >= self.min_level:
+            self._log(self.WARNING, driver_str, func_str, message, args)
+
+    def error(self, driver_str, func_str, message, *args):
         """Log error message."""
-        self._log(self.ERROR, driver_str, func_str, message)
-    
-    def critical(self, driver_str, func_str, message):
+        if self.ERROR >= self.min_level:
+            self._log(self.ERROR, driver_str, func_str, message, args)
+
+    def critical(self, driver_str, func_str, message, *args):
         """Log critical message."""
-        self._log(self.CRITICAL, driver_str, func_str, message)
+        if self.CRITICAL >= self.min_level:
+            self._log(self.CRITICAL, driver_str, func_str, message, args)
 
 
 """
 For development set to Level DEBUG
 logger = Logger(Logger.DEBUG)
+To keep logs in RAM instead of printing them to the UART, call
+logger.enable_ring(); the server can fetch them with a log_dump message.
 Global logger for the node
 """
-logger = Logger(Logger.INFO, use_color=True)
\ No newline at end of file
+logger = Logger(Logger.INFO, use_color=True)
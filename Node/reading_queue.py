@@ -0,0 +1,185 @@
+import json
+import os
+from logger import logger
+
+# Overflow policies
+DROP_OLDEST = "drop_oldest"  # Overwrite the oldest reading
+DOWNSAMPLE = "downsample"  # Thin the buffered readings to every other one
+SPILL = "spill"  # Move the oldest readings to an append log on flash
+
+DEFAULT_CAPACITY = 200  # Readings held in RAM
+DEFAULT_SPILL_PATH = "spill.log"
+DEFAULT_SPILL_BATCH = 10  # Readings moved to flash per write
+DEFAULT_SPILL_MAX_BYTES = 256 * 1024  # Beyond this the spill log behaves like drop_oldest
+
+class ReadingQueue:
+    """Fixed-capacity FIFO of readings waiting to be transmitted.
+
+    Readings live in a preallocated ring, so append and take are O(1) per
+    reading and RAM use stays flat however long the link is down. When the
+    ring is full the overflow policy decides what happens to the next
+    reading.
+
+    With SPILL the oldest readings go to a JSON-lines log on flash, which
+    take() drains first since it holds the oldest data. A log left over
+    from before a reboot is picked up again.
+
+    Readings of a failed send go back through requeue() into a small retry
+    list, sized for the batches that can be in flight, and are taken
+    before anything else.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, policy=DROP_OLDEST, reserve=0,
+                 spill_path=DEFAULT_SPILL_PATH, spill_batch=DEFAULT_SPILL_BATCH,
+                 spill_max_bytes=DEFAULT_SPILL_MAX_BYTES):
+        self.drv_str = "Reading_Queue"
+        self.ring = [None] * capacity
+        self.capacity = capacity
+        self.head = 0  # Oldest reading
+        self.count = 0
+        self.policy = policy
+        self.reserve = reserve
+        self.retry = []  # Requeued readings, oldest first
+
+        self.spill_path = spill_path
+        self.spill_batch = spill_batch
+        self.spill_max_bytes = spill_max_bytes
+        self.spill_offset = 0  # Read position in the spill log
+        self.spill_size = 0  # Bytes written to the spill log
+        self.spilled = 0  # Readings in the spill log not read yet
+
+        # Overflow accounting
+        self.dropped = 0
+        self.downsampled = 0
+
+        if policy == SPILL:
+            self._recover_spill()
+
+    def __len__(self):
+        return len(self.retry) + self.spilled + self.count
+
+    def append(self, reading):
+        """Queue a reading, applying the overflow policy when the ring is full"""
+        if self.count == self.capacity:
+            self._overflow()
+        self.ring[(self.head + self.count) % self.capacity] = reading
+        self.count += 1
+
+    def take(self, n):
+        """Remove and return up to n of the oldest readings"""
+        batch = []
+        if self.retry:
+            batch = self.retry[:n]
+            del self.retry[:n]
+        if len(batch) < n and self.spilled:
+            batch.extend(self._read_spill(n - len(batch)))
+        while len(batch) < n and self.count:
+            batch.append(self.ring[self.head])
+            self.ring[self.head] = None
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        return batch
+
+    def requeue(self, batch):
+        """Put back readings that could not be sent, ahead of everything else"""
+        self.retry[:0] = batch
+        excess = len(self.retry) - max(self.reserve, len(batch))
+        if excess > 0:
+            # Only happens when more than reserve readings were in flight
+            del self.retry[:excess]
+            self.dropped += excess
+
+    def _overflow(self):
+        if self.policy == DOWNSAMPLE:
+            self._downsample()
+            return
+        if self.policy == SPILL and self.spill_size < self.spill_max_bytes and self._spill():
+            return
+        self._pop_oldest()
+        self.dropped += 1
+
+    def _pop_oldest(self):
+        reading = self.ring[self.head]
+        self.ring[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        return reading
+
+    def _downsample(self):
+        """Keep every other buffered reading, halving the backlog's resolution"""
+        kept = 0
+        for i in range(self.count):
+            reading = self.ring[(self.head + i) % self.capacity]
+            self.ring[(self.head + i) % self.capacity] = None
+            if i % 2:
+                self.ring[(self.head + kept) % self.capacity] = reading
+                kept += 1
+        self.downsampled += self.count - kept
+        self.count = kept
+
+    def _spill(self):
+        """Move the oldest readings to the spill log, False if flash failed"""
+        func_str = "_spill"
+        n = min(self.spill_batch, self.count)
+        lines = []
+        for i in range(n):
+            lines.append(json.dumps(self.ring[(self.head + i) % self.capacity]) + "\n")
+        data = "".join(lines)
+        try:
+            with open(self.spill_path, "a") as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(self.drv_str, func_str, "Spill to {} failed: {}", self.spill_path, e)
+            return False
+        for _ in range(n):
+            self._pop_oldest()
+        self.spill_size += len(data)
+        self.spilled += n
+        return True
+
+    def _read_spill(self, n):
+        """Read up to n readings from the spill log, removing it once drained"""
+        func_str = "_read_spill"
+        readings = []
+        try:
+            with open(self.spill_path, "r") as f:
+                f.seek(self.spill_offset)
+                while len(readings) < n:
+                    line = f.readline()
+                    if not line:
+                        break
+                    self.spilled -= 1
+                    try:
+                        readings.append(json.loads(line))
+                    except ValueError:
+                        # Torn write from a power loss
+                        self.dropped += 1
+                self.spill_offset = f.tell()
+        except OSError as e:
+            logger.error(self.drv_str, func_str, "Reading spill log {} failed: {}", self.spill_path, e)
+            self.spilled = 0
+        if self.spilled <= 0 or self.spill_offset >= self.spill_size:
+            self._remove_spill()
+        return readings
+
+    def _recover_spill(self):
+        """Pick up a spill log written before the last reboot"""
+        func_str = "_recover_spill"
+        try:
+            with open(self.spill_path, "r") as f:
+                for line in f:
+                    self.spilled += 1
+                    self.spill_size += len(line)
+        except OSError:
+            return
+        if self.spilled:
+            logger.info(self.drv_str, func_str, "Recovered {} spilled readings", self.spilled)
+
+    def _remove_spill(self):
+        self.spill_offset = 0
+        self.spill_size = 0
+        self.spilled = 0
+        try:
+            os.remove(self.spill_path)
+        except OSError:
+            pass
@@ -8,6 +8,8 @@ import time
 from neopixel import NeoPixel # type: ignore
 from wifi_driver import WiFiDriver
 from socket_driver import SocketDriver
+from reading_queue import ReadingQueue, SPILL
+import wire_protocol
 from logger import logger
 
 
@@ -33,6 +35,22 @@ smoke_msg = {
 }
 
 
+# Uplink batching defaults
+BATCH_SIZE = 10  # Readings per batch frame
+FLUSH_INTERVAL = 30  # Max seconds a reading waits before a partial batch is sent
+TRANSMIT_POLL_INTERVAL = 1  # Seconds between checks of the data queue
+MAX_IN_FLIGHT = 4  # Batches awaiting a response at the same time
+QUEUE_CAPACITY = 200  # Readings buffered in RAM
+QUEUE_POLICY = SPILL  # What happens to readings once the RAM buffer is full
+
+# Connection supervision
+HEARTBEAT_INTERVAL = 15  # Seconds without received data before a heartbeat is sent
+HEARTBEAT_TIMEOUT = 5  # Seconds to wait for the heartbeat response
+
+# Fire alerts pushed by the server
+ALERT_ACK_TIMEOUT = 5  # Seconds to wait for the server to take an alert_ack
+LOG_DUMP_TIMEOUT = 10  # Seconds to wait for the server to take a node_logs dump
+
 
 def is_micropython():
     """Returns True if running on MicroPython (ESP32, etc.)"""
@@ -42,7 +60,8 @@ def is_micropython():
     except ImportError:
         return False
 class AsyncNode:
-    def __init__(self, node_name : str="Generic Node", config : dict=None):
+    def __init__(self, node_name : str="Generic Node", config : dict=None, batch_size : int=BATCH_SIZE, flush_interval : float=FLUSH_INTERVAL,
+                 queue_capacity : int=QUEUE_CAPACITY, queue_policy : str=QUEUE_POLICY, subscribe_alerts : bool=False):
         self.drv_str = "Scheduler_Driver"
         self.version = "0.0.1"
         self.node_name : str = node_name
@@ -50,9 +69,15 @@ class AsyncNode:
         self.wifi_driver : WiFiDriver = WiFiDriver(config)
         self.socket_driver : SocketDriver = SocketDriver(config)
 
-        self.data_queue = []
+        # Failed batches come back through requeue, reserve room for all of them
+        self.data_queue : ReadingQueue = ReadingQueue(queue_capacity, queue_policy, reserve=MAX_IN_FLIGHT * batch_size)
+        self.batch_size : int = batch_size
+        self.flush_interval : float = flush_interval
+        self.in_flight : int = 0
         self.connected = False
         self.server_port = 8765 
+        self.subscribe_alerts : bool = subscribe_alerts  # Actuators ask the server for fire alerts
+        self.active_alerts : dict = {}  # "rule@node" -> last raised alert
 
 
         self.driver_table_status = {
@@ -94,34 +119,61 @@ class AsyncNode:
                 'humidity': 50 + (time.time() % 20),
                 'pressure': 1000 + (time.time() % 50)
             }
-            self.data_queue.append(sensor_data)
+            sensor_data["timestamp"] = time.time()
+            # Queue a copy, the templates above are reused for every reading
+            self.data_queue.append(dict(sensor_data))
             await asyncio.sleep(5)  # Read every 5 seconds
 
     async def transmit_data(self):
+        """Send queued readings in batch frames.
+
+        A batch goes out once batch_size readings are queued or the oldest
+        queued reading has waited flush_interval seconds. The whole batch is
+        acknowledged by a single batch_response; on failure the readings are
+        put back at the front of the queue. Up to MAX_IN_FLIGHT batches wait
+        for their response at the same time.
+        """
         func_str = "transmit_data"
+        last_flush = time.time()
         while True:
-            if self.data_queue and self.socket_driver.connected:
-                data = self.data_queue.pop(0)
-                # Simulate data transmission
-                json_data = json.dumps(data) + '\n'
-                logger.info(self.drv_str, func_str, f'Transmitting data to {self.socket_driver.server_ip[self.socket_driver.server_ip_index]}:{self.server_port}')
-                await self.send_message_with_response(json_data)
-            else:
-                await asyncio.sleep(10)
+            if len(self.data_queue) == 0 or not self.socket_driver.connected:
+                last_flush = time.time()
+            elif self.in_flight < MAX_IN_FLIGHT and (len(self.data_queue) >= self.batch_size or time.time() - last_flush >= self.flush_interval):
+                batch = self.data_queue.take(self.batch_size)
+                logger.info(self.drv_str, func_str, 'Transmitting {} readings to {}:{}', len(batch), self.socket_driver.current_server_ip, self.server_port)
+                self.in_flight += 1
+                asyncio.create_task(self.transmit_batch(batch))
+                last_flush = time.time()
+                continue
+            await asyncio.sleep(TRANSMIT_POLL_INTERVAL)
+    async def transmit_batch(self, batch):
+        """Send one batch frame and requeue its readings if it is not acknowledged"""
+        frame = {
+            "msg_id": "batch",
+            "node_name": self.node_name,
+            "sent_at": time.time(),  # Lets the server place each reading in time
+            "readings": batch
+        }
+        try:
+            success, resp = await self.send_message_with_response(frame, "batch_response")
+            if not success:
+                self.data_queue.requeue(batch)
+        finally:
+            self.in_flight -= 1
     async def send_data(self, data):
         func_str = "send_data"
-        logger.info(self.drv_str, func_str, f'Sending data to {self.socket_driver.server_ip[self.socket_driver.server_ip_index]}:{self.server_port}')
+        logger.info(self.drv_str, func_str, 'Sending data to {}:{}', self.socket_driver.current_server_ip, self.server_port)
         try:    
             await self.socket_driver.send_data(data)
-            logger.info(self.drv_str, func_str, f'Data sent to {self.socket_driver.server_ip[self.socket_driver.server_ip_index]}:{self.server_port}')
+            logger.info(self.drv_str, func_str, 'Data sent to {}:{}', self.socket_driver.current_server_ip, self.server_port)
         except Exception as e:
             logger.error(self.drv_str, func_str, f'Error sending data: {e}')
     async def receive_data(self) -> dict:
         func_str = "receive_data"
         try:
-            logger.info(self.drv_str, func_str, f'Receiving data from {self.socket_driver.server_ip[self.socket_driver.server_ip_index]}:{self.server_port}')
+            logger.info(self.drv_str, func_str, 'Receiving data from {}:{}', self.socket_driver.current_server_ip, self.server_port)
             resp = await self.socket_driver.receive_data()
-            logger.info(self.drv_str, func_str, f'Data received from central compute node @ {resp}')
+            logger.info(self.drv_str, func_str, 'Data received from central compute node @ {}', resp)
             return resp
         except Exception as e:
             logger.error(self.drv_str, func_str, f'Error receiving data: {e}')
@@ -131,11 +183,11 @@ class AsyncNode:
         func_str = "process_messages"
         
         while True:
-            # Non-blocking check for new messages
-            message = await self.socket_driver.get_next_message(timeout=0.5)
+            # Sleeps until the socket driver queues a message
+            message = await self.socket_driver.get_next_message(timeout=None)
             
-            if message:
-                logger.info(self.drv_str, func_str, f"Processing message: {message}")
+            if isinstance(message, dict):
+                logger.info(self.drv_str, func_str, "Processing message: {}", message)
                 msg_id = message.get("msg_id", "unknown")
                 
                 # Handle different message types
@@ -143,15 +195,77 @@ class AsyncNode:
                     await self.handle_command(message)
                 elif msg_id == "config_update":
                     await self.handle_config_update(message)
-                # Add more handlers as needed
-                
-            await asyncio.sleep(0.1)
+                elif msg_id == "log_dump":
+                    await self.send_log_dump()
+                elif msg_id == "alert":
+                    await self.handle_alert(message)
+                else:
+                    # Add more handlers as needed
+                    logger.warning(self.drv_str, func_str, f"Unhandled message from server: {msg_id}")
     
+    async def handle_command(self, message):
+        func_str = "handle_command"
+        logger.info(self.drv_str, func_str, f"Received command: {message.get('command')}")
+
+    async def handle_config_update(self, message):
+        func_str = "handle_config_update"
+        logger.info(self.drv_str, func_str, "Received config update: {}", message)
+
+    async def handle_alert(self, message):
+        """Track a fire alert and acknowledge it so the server can time the delivery"""
+        func_str = "handle_alert"
+        key = "{}@{}".format(message.get("rule"), message.get("node"))
+        if message.get("state") == "raised":
+            self.active_alerts[key] = message
+            logger.warning(self.drv_str, func_str, "Alert {} raised: {} {}", key, message.get("stat"), message.get("value"))
+        else:
+            self.active_alerts.pop(key, None)
+            # Cleared, or expired because the reporting node went away
+            logger.info(self.drv_str, func_str, "Alert {} {}, {} still active", key, message.get("state"), len(self.active_alerts))
+        # Acknowledge in the background, process_messages keeps draining the queue
+        asyncio.create_task(self.socket_driver.send_and_receive(
+            {"msg_id": "alert_ack", "alert_id": message.get("alert_id")},
+            timeout=ALERT_ACK_TIMEOUT
+        ))
+
+    async def send_alert_subscribe(self) -> bool:
+        """Ask the server to push fire alerts to this node"""
+        func_str = "send_alert_subscribe"
+        data = {
+            "msg_id": "alert_subscribe",
+            "node_name": self.node_name,
+        }
+        success, resp = await self.send_message_with_response(data, "alert_subscribe_response")
+        if success:
+            logger.info(self.drv_str, func_str, "Subscribed to alerts: {}", resp.get("rules"))
+        else:
+            logger.error(self.drv_str, func_str, "Alert subscription was not accepted")
+        return success
+
+    async def send_log_dump(self):
+        """Send the entries buffered in the logger's RAM ring to the server.
+
+        The ring is only emptied once the server acknowledged the dump, a
+        failed send leaves the entries for the next log_dump.
+        """
+        func_str = "send_log_dump"
+        entries, mark = logger.peek_ring()
+        response = await self.socket_driver.send_and_receive({
+            "msg_id": "node_logs",
+            "node_name": self.node_name,
+            "entries": entries
+        }, timeout=LOG_DUMP_TIMEOUT, expected_msg_id="node_logs_response")
+        if response and response.get("status") == "success":
+            logger.discard_ring(mark)
+            logger.info(self.drv_str, func_str, "Sent {} buffered log entries", len(entries))
+        else:
+            logger.warning(self.drv_str, func_str, "Log dump of {} entries was not acknowledged, keeping them", len(entries))
+
     async def send_message_with_response(self, message_data, expected_msg_id=None) -> tuple[bool, dict]:
         func_str = "send_message_with_response"
         """Example of sending a command and waiting for a specific response"""
         # This is a blocking call that waits for the specific response
-        logger.info(self.drv_str, func_str, f"Data: {message_data} Expected response: {expected_msg_id}")
+        logger.info(self.drv_str, func_str, "Data: {} Expected response: {}", message_data, expected_msg_id)
         response = await self.socket_driver.send_and_receive(
             message_data,
             timeout=10.0,
@@ -176,12 +290,14 @@ class AsyncNode:
         data = {
             "msg_id": "node_update",
             "node_name": self.node_name,
+            "encodings": [wire_protocol.ENCODING, "json"],
         }
         expected_msg_id = "node_update_response"
         logger.info(self.drv_str, func_str, f"Sending node update to central compute node")
         success, resp = await self.send_message_with_response(data, expected_msg_id)
         if success:
             logger.info(self.drv_str, func_str, f"Node update was received by central compute node")
+            self.socket_driver.use_encoding(resp.get("encoding"), resp.get("node_code"))
             return True, resp
         else:
             logger.error(self.drv_str, func_str, f"Node update was not received by central compute node")
@@ -189,6 +305,56 @@ class AsyncNode:
 
 
 
+    def set_status_led(self, connected):
+        self.neopixel.fill((0,25,0) if connected else (25,0,0))  # Green connected, red not connected
+        self.neopixel.write()
+
+    async def connection_monitor(self):
+        """Supervise the server connection and reconnect when it dies.
+
+        A connection is dead after a send error, EOF or a heartbeat that got
+        no answer; the socket driver flags the first two itself. Reconnects
+        back off exponentially with jitter and try the servers fastest
+        first. Readings keep accumulating in data_queue meanwhile and
+        transmit_data sends them once the node is back.
+        """
+        func_str = "connection_monitor"
+        driver = self.socket_driver
+        self.driver_table_status["Connection_Monitor"] = True
+        while True:
+            if driver.connected:
+                idle = time.time() - driver.last_rx
+                if idle < HEARTBEAT_INTERVAL:
+                    # Sleep until the connection dies or a heartbeat is due
+                    try:
+                        await asyncio.wait_for(driver.dead_event.wait(), HEARTBEAT_INTERVAL - idle)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                response = await driver.send_and_receive(
+                    {"msg_id": "heartbeat", "node_name": self.node_name},
+                    timeout=HEARTBEAT_TIMEOUT
+                )
+                if response is None and driver.connected:
+                    driver.mark_dead("heartbeat timeout")
+                continue
+
+            self.set_status_led(False)
+            logger.warning(self.drv_str, func_str, "Server connection lost, reconnecting")
+            if await driver.reconnect():
+                driver.reset_backoff()
+                await driver.start_background_listener()
+                # Announce ourselves again, this also renegotiates the encoding
+                await self.send_node_update()
+                if self.subscribe_alerts:
+                    await self.send_alert_subscribe()
+                self.set_status_led(True)
+                logger.info(self.drv_str, func_str, "Reconnected to {} with {} readings queued", driver.current_server_ip, len(self.data_queue))
+            else:
+                delay = driver.next_backoff()
+                logger.info(self.drv_str, func_str, "Next reconnect attempt in {} s", delay)
+                await asyncio.sleep(delay)
+
     async def scheduler_run(self):
         func_str = "scheduler_run"
         # Create tasks for all our async functions
@@ -215,23 +381,24 @@ class AsyncNode:
         print("\n\n*******************************\n\n")
         logger.info(self.drv_str,func_str, f"Starting main application")
 
+        #start background listener for incoming messages, it routes every response
+        logger.info(self.drv_str, func_str, f"starting background listener for incoming messages")
+        await self.socket_driver.start_background_listener()
+        logger.info(self.drv_str, func_str, f"background listener started")
+
         #send node update to central compute node
         await self.send_node_update()
-
-       
-
-        #start background listener for incoming messages
-        #logger.info(self.drv_str, func_str, f"starting background listener for incoming messages")
-        #await self.socket_driver.start_background_listener()
-        #logger.info(self.drv_str, func_str, f"background listener started")
+        if self.subscribe_alerts:
+            await self.send_alert_subscribe()
+        self.set_status_led(True)
 
         logger.info(self.drv_str, func_str, f"scheduler has finished all setup tasks!")
 
         tasks = [
             asyncio.create_task(self.simulate_sensor_reading()),
             asyncio.create_task(self.transmit_data()),
-            #asyncio.create_task(self.connection_monitor()),
-            #asyncio.create_task(self.process_messages())
+            asyncio.create_task(self.connection_monitor()),
+            asyncio.create_task(self.process_messages())
         ]
         logger.info(self.drv_str, func_str, f"starting tasks: {tasks}")
         await asyncio.gather(*tasks)
@@ -244,7 +411,7 @@ def main():
         print("Please supply a config file")
         return
     version_str = ""
-    node = AsyncNode(node_name="Motor Node",config=config)
+    node = AsyncNode(node_name="Motor Node",config=config,subscribe_alerts=True)
     version_str = f"Running node: {node.node_name} Version: {node.version}"
     if is_micropython():
         version_str += " MicroPython"
@@ -5,6 +5,103 @@ import time
 from collections import deque
 from logger import logger
 import errno
+import random
+import wire_protocol
+
+try:
+    import select
+except ImportError:
+    import uselect as select  # type: ignore
+
+RECV_BUFFER_SIZE = 4096  # Largest message the node can receive
+SEQ_MODULUS = 1 << 30  # Request sequence ids wrap at this value
+CONNECT_TIMEOUT = 3  # Seconds allowed for one connect attempt
+CONNECT_POLL_MS = 20  # How often a pending MicroPython connect is checked
+RECONNECT_BASE_DELAY = 1  # First reconnect backoff in seconds
+RECONNECT_MAX_DELAY = 60  # Backoff ceiling in seconds
+MAX_LATENCY_PENALTY_MS = 60000
+
+if hasattr(time, "ticks_ms"):
+    ticks_ms = time.ticks_ms
+    ticks_diff = time.ticks_diff
+else:
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+class LineFramer:
+    """Incremental newline framing over a preallocated receive buffer.
+
+    Bytes are read directly into free_space(), complete lines are handed
+    out by messages() and a trailing partial line stays in the buffer for
+    the next read. A line longer than the buffer is discarded up to its
+    newline and counted in dropped.
+    """
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.size = size
+        self.start = 0  # First unconsumed byte
+        self.end = 0  # One past the last received byte
+        self.discarding = False
+        self.dropped = 0
+    
+    def reset(self):
+        self.start = 0
+        self.end = 0
+        self.discarding = False
+        self.dropped = 0
+    
+    def free_space(self):
+        """Return a writable view of the free tail of the buffer"""
+        if self.start:
+            # Move the partial line to the front, memoryview copies handle the overlap
+            pending = self.end - self.start
+            self.view[0:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        if self.end == self.size:
+            # The buffer is full without a newline, drop what we have
+            self.dropped += self.end
+            self.end = 0
+            self.discarding = True
+        return self.view[self.end:]
+    
+    def commit(self, n):
+        """Account for n bytes written into the last free_space()"""
+        self.end += n
+    
+    def _find_newline(self, start, end):
+        buffer = self.buffer
+        if hasattr(buffer, "find"):
+            return buffer.find(b'\n', start, end)
+        # Ports whose bytearray has no find
+        for i in range(start, end):
+            if buffer[i] == 10:
+                return i
+        return -1
+    
+    def messages(self):
+        """Yield every complete line in the buffer, without the newline"""
+        while self.start < self.end:
+            newline = self._find_newline(self.start, self.end)
+            if newline < 0:
+                break
+            line_start = self.start
+            self.start = newline + 1
+            if self.discarding:
+                # Tail of an oversized message
+                self.dropped += newline - line_start
+                self.discarding = False
+                continue
+            if newline > line_start:
+                yield bytes(self.view[line_start:newline])
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+
 class SocketDriver:
     def __init__(self, config=None):
         self.version_str = "1.0.0"
@@ -16,11 +113,24 @@ class SocketDriver:
         self.dedicated_server_ip = "68.8.86.82"
         self.server_port = 8765
         self.server_ip_index = 1  # Start with the second IP in the list
+        self.current_server_ip = None
+        self.prefer_dedicated = True
+        self.connect_latency = {}  # ip -> smoothed connect time in ms, failures are penalised
+        self.backoff = RECONNECT_BASE_DELAY
+        self.last_rx = 0  # time.time() of the last received bytes
+        self.dead_event = asyncio.Event()  # Set when the connection is found dead
         self.drv_str = "Socket_Driver"
         func_str = "__init__"
         self.message_queue = deque([],20)
         self._listening_task = None
         self._stop_listening = False
+        self._seq = 0
+        self._pending = {}  # seq -> [Event, response]
+        self.framer = LineFramer()
+        self._stream = None  # MicroPython asyncio stream over the socket
+        self.message_event = asyncio.Event()  # Set whenever message_queue gets a message
+        self.encoding = "json"  # Uplink encoding, negotiated by node_update
+        self.node_code = None  # Our interned name for binary frames
         logger.info(self.drv_str, func_str, f"Socket driver version {self.version_str}")
 
 
@@ -33,58 +143,168 @@ class SocketDriver:
         func_str = "init_socket_driver"
         """Initialize socket connection to central compute node"""
         self.connected = False
+        self.prefer_dedicated = use_dedicated_server
         logger.info(self.drv_str, func_str, f"setting up socket to central compute node")
 
-        # Create socket
-        reconnect_count = 0
-        #Either no retry and attempt one connection or retry forever
+        #Either no retry and attempt one pass over the servers or retry forever
         if retry:
             logger.info(self.drv_str, func_str, f"retry={retry} -> socket driver will retry connection indefinitely")
         else:
             logger.info(self.drv_str, func_str, f"retry={retry} -> socket driver will attempt 1 connection")
 
-        while (not self.connected) and ((not retry and reconnect_count < 1) or (retry)):
-            try:
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                self.socket.settimeout(3)
-                # Get address info for the server
-                if use_dedicated_server:
-                    current_server_ip = self.dedicated_server_ip
-                else:
-                    current_server_ip = self.server_ip[self.server_ip_index]
-                self.addrinfo = socket.getaddrinfo(current_server_ip, self.server_port)
-                logger.info(self.drv_str, func_str, f"socket connecting to {current_server_ip}:{self.server_port}")
-                
-                # Connect to the server
-            
-                self.socket.connect(self.addrinfo[0][-1])
-            
-                self.connected = True
-                logger.info(self.drv_str, func_str, f"socket connected to {current_server_ip}:{self.server_port}")
-                driver_table_status["Socket_Driver"] = True
+        self.reset_backoff()
+        while True:
+            if await self.reconnect():
+                if driver_table_status is not None:
+                    driver_table_status["Socket_Driver"] = True
                 return True
+            if not retry:
+                logger.error(self.drv_str, func_str, f"Socket connection failed")
+                break
+            await asyncio.sleep(self.next_backoff())
 
-            except Exception as e:
-                if e.errno == errno.ECONNREFUSED:
-                    pass
-                elif e.errno == errno.ETIMEDOUT:
-                    logger.error(self.drv_str, func_str, f"Socket connection timed out")
-                    if use_dedicated_server:
-                        logger.error(self.drv_str, func_str, f"Socket connection timed out to dedicated server")
-                        pass
-                    else:
-                        self.server_ip_index = (self.server_ip_index + 1) % len(self.server_ip)
-                if retry:
-                    await asyncio.sleep(1)
-                else:
-                    logger.error(self.drv_str, func_str, f"Socket connection failed")
+        if driver_table_status is not None:
+            driver_table_status["Socket_Driver"] = False
+        return False
 
-                
-          
-        if driver_table_status:
-            driver_table_status["Socket Driver"] = False
+    def servers(self):
+        """Server addresses to try, fastest measured connect first.
+
+        Servers that were never tried sort first so each one gets measured,
+        the dedicated server leads ties when prefer_dedicated is set.
+        """
+        if self.prefer_dedicated:
+            candidates = [self.dedicated_server_ip] + self.server_ip
+        else:
+            candidates = self.server_ip + [self.dedicated_server_ip]
+        order = {ip: i for i, ip in enumerate(candidates)}
+        return sorted(candidates, key=lambda ip: (self.connect_latency.get(ip, 0), order[ip]))
+
+    async def reconnect(self):
+        """Make one pass over the servers, True once one of them accepted"""
+        func_str = "reconnect"
+        await self.disconnect()
+        for server_ip in self.servers():
+            if await self.connect_once(server_ip):
+                return True
+        logger.warning(self.drv_str, func_str, "No server reachable")
         return False
+
+    async def connect_once(self, server_ip):
+        """Try one server, recording how long the connect took"""
+        func_str = "connect_once"
+        start = ticks_ms()
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # Get address info for the server
+            self.addrinfo = socket.getaddrinfo(server_ip, self.server_port)
+            logger.info(self.drv_str, func_str, "socket connecting to {}:{}", server_ip, self.server_port)
+
+            # Connect to the server
+            loop = asyncio.get_event_loop()
+            if hasattr(loop, "sock_connect"):
+                self.socket.setblocking(False)
+                await asyncio.wait_for(loop.sock_connect(self.socket, self.addrinfo[0][-1]), CONNECT_TIMEOUT)
+            else:
+                await self._connect_polled(self.addrinfo[0][-1], CONNECT_TIMEOUT)
+            self._attach_stream()
+            # A new connection starts in JSON until node_update negotiates again
+            self.use_encoding("json")
+        except Exception as e:
+            # Failed servers sink to the back of the rotation
+            penalty = max(2 * self.connect_latency.get(server_ip, 0), CONNECT_TIMEOUT * 1000)
+            self.connect_latency[server_ip] = min(penalty, MAX_LATENCY_PENALTY_MS)
+            if getattr(e, "errno", None) == errno.ECONNREFUSED:
+                logger.warning(self.drv_str, func_str, "Connection refused by {}", server_ip)
+            else:
+                logger.error(self.drv_str, func_str, "Socket connection to {} failed: {}", server_ip, e)
+            self._close_socket()
+            return False
+
+        elapsed = ticks_diff(ticks_ms(), start)
+        previous = self.connect_latency.get(server_ip)
+        # Smooth the measurement, one slow connect should not reorder the servers
+        self.connect_latency[server_ip] = elapsed if not previous else (3 * previous + elapsed) // 4
+        self.current_server_ip = server_ip
+        if server_ip in self.server_ip:
+            self.server_ip_index = self.server_ip.index(server_ip)
+        self.connected = True
+        self.last_rx = time.time()
+        self.dead_event.clear()
+        logger.info(self.drv_str, func_str, "socket connected to {}:{} in {} ms", server_ip, self.server_port, elapsed)
+        return True
+
+    async def _connect_polled(self, address, timeout):
+        """Non-blocking connect for MicroPython, whose asyncio has no sock_connect.
+
+        The connect is started on a non-blocking socket and polled for
+        completion between short sleeps, so sensor reads, the queue and
+        heartbeats keep running while a dead server times out.
+        """
+        self.socket.setblocking(False)
+        try:
+            self.socket.connect(address)
+        except OSError as e:
+            if e.errno not in (errno.EINPROGRESS, errno.EALREADY, errno.EAGAIN):
+                raise
+        poller = select.poll()
+        poller.register(self.socket, select.POLLOUT | select.POLLERR | select.POLLHUP)
+        start = ticks_ms()
+        while True:
+            for _, flags in poller.poll(0):
+                if flags & (select.POLLERR | select.POLLHUP):
+                    raise OSError(errno.ECONNREFUSED, "connection refused")
+                if flags & select.POLLOUT:
+                    return
+            if ticks_diff(ticks_ms(), start) >= timeout * 1000:
+                raise OSError(errno.ETIMEDOUT, "connect timed out")
+            await asyncio.sleep(CONNECT_POLL_MS / 1000)
+
+    def mark_dead(self, reason):
+        """Flag the connection as lost, the supervisor reconnects"""
+        func_str = "mark_dead"
+        if self.connected:
+            logger.warning(self.drv_str, func_str, "Connection lost: {}", reason)
+        self.connected = False
+        self.dead_event.set()
+
+    async def disconnect(self):
+        """Stop the listener, close the socket and fail the pending requests"""
+        self.connected = False
+        task = self._listening_task
+        if task is not None:
+            self._listening_task = None
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._close_socket()
+        for pending in self._pending.values():
+            pending[0].set()
+
+    def _close_socket(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except Exception:
+                pass
+        self.socket = None
+        self._stream = None
+
+    def reset_backoff(self):
+        self.backoff = RECONNECT_BASE_DELAY
+
+    def next_backoff(self):
+        """Return the next reconnect delay and double the backoff.
+
+        The delay is drawn between half and all of the current backoff so
+        nodes that lost the server together do not come back in lockstep.
+        """
+        delay = self.backoff * (0.5 + random.getrandbits(16) / 131072)
+        self.backoff = min(self.backoff * 2, RECONNECT_MAX_DELAY)
+        return delay
     
     async def send_data(self, data):
         """Send data to the server"""
@@ -94,91 +314,89 @@ class SocketDriver:
             return False
         
         try:
-            # If data is a string, encode it
-            if isinstance(data, str):
-                data_bytes = data.encode('utf-8')
-            # If data is a dict, convert to JSON string and encode
-            elif isinstance(data, dict):
-                data_bytes = (json.dumps(data) + '\n').encode('utf-8')
-            # If data is already bytes, use it directly
-            elif isinstance(data, bytes):
-                data_bytes = data
-            else:
-                data_bytes = str(data).encode('utf-8')
+            data_bytes = None
+            # Readings go out as binary frames once the server agreed to it
+            if isinstance(data, dict) and self.encoding == wire_protocol.ENCODING:
+                data_bytes = wire_protocol.encode_binary(data, self.node_code, data.get("seq", 0))
             
-            # Ensure the data ends with a newline
-            if not data_bytes.endswith(b'\n'):
-                data_bytes += b'\n'
+            if data_bytes is None:
+                # If data is a string, encode it
+                if isinstance(data, str):
+                    data_bytes = data.encode('utf-8')
+                # If data is a dict, convert to JSON string and encode
+                elif isinstance(data, dict):
+                    data_bytes = (json.dumps(data) + '\n').encode('utf-8')
+                # If data is already bytes, use it directly
+                elif isinstance(data, bytes):
+                    data_bytes = data
+                else:
+                    data_bytes = str(data).encode('utf-8')
+                
+                # Ensure the data ends with a newline
+                if not data_bytes.endswith(b'\n'):
+                    data_bytes += b'\n'
             
             # Send the data
-            self.socket.send(data_bytes)
-            logger.info(self.drv_str, func_str, f"Sent {len(data_bytes)} bytes")
+            await self._send_all(data_bytes)
+            logger.info(self.drv_str, func_str, "Sent {} bytes", len(data_bytes))
             return True
         except Exception as e:
             logger.error(self.drv_str, func_str, f"Error sending data: {e}")
-            self.connected = False
+            self.mark_dead("send failed")
             return False
     
+    def use_encoding(self, encoding, node_code=None):
+        """Switch the uplink encoding, binary needs the node code from the server"""
+        func_str = "use_encoding"
+        if encoding == wire_protocol.ENCODING and node_code is not None:
+            self.encoding = encoding
+            self.node_code = node_code
+        else:
+            self.encoding = "json"
+            self.node_code = None
+        logger.info(self.drv_str, func_str, f"Uplink encoding: {self.encoding}")
+    
+    def _attach_stream(self):
+        """Switch the connected socket to non-blocking, event-loop driven I/O.
+
+        CPython's loop exposes sock_recv_into/sock_sendall; MicroPython's
+        asyncio instead wraps the socket in a Stream that waits on poll
+        readiness. Either way no read or write ever blocks the loop.
+        """
+        self.socket.setblocking(False)
+        loop = asyncio.get_event_loop()
+        if hasattr(loop, "sock_recv_into"):
+            self._stream = None
+        else:
+            self._stream = asyncio.StreamReader(self.socket)
+    
+    async def _send_all(self, data_bytes):
+        """Write all bytes, suspending until the socket is writable"""
+        if self._stream is not None:
+            self._stream.write(data_bytes)
+            await self._stream.drain()
+        else:
+            await asyncio.get_event_loop().sock_sendall(self.socket, data_bytes)
+    
     async def receive_data(self, timeout=3):
-        """Receive data from the server"""
+        """Receive the next message from the server.
+
+        Incoming data is read by the background listener, this waits for the
+        next message it did not match to a pending request.
+        """
         func_str = "receive_data"
         if not self.connected or not self.socket:
             logger.error(self.drv_str, func_str, "Cannot receive data: not connected")
             return None
-        logger.info(self.drv_str, func_str, f"Receiving data from server with timeout {timeout} seconds")
-        try:
-            # Set timeout for this operation
-            #original_timeout = self.socket.gettimeout()
-            self.socket.settimeout(timeout)
-            
-            # Wait for data
-            data = b""
-            try:
-                chunk = self.socket.recv(4096)
-                if chunk:
-                    data += chunk
-                else:
-                    # Empty chunk means connection closed
-                    logger.warning(self.drv_str, func_str, "Connection closed by server")
-                    self.connected = False
-                    return None
-            except Exception as e:
-                if e.errno == errno.ETIMEDOUT:
-                    logger.warning(self.drv_str, func_str, "Socket receive timeout")
-                    return None
-            
-            # Restore original timeout
-            #self.socket.settimeout(original_timeout)
-            
-            # Process received data
-            if data:
-                try:
-                    # Decode and parse JSON
-                    decoded = data.decode('utf-8').strip()
-                    parsed = json.loads(decoded)
-                    logger.info(self.drv_str, func_str, f"Received JSON data: {str(parsed)[:50]}...")
-                    return parsed
-                except json.JSONDecodeError:
-                    # Not JSON, return as string
-                    decoded = data.decode('utf-8').strip()
-                    logger.info(self.drv_str, func_str, f"Received text data: {decoded[:50]}...")
-                    return decoded
-                except UnicodeError:
-                    # Can't decode as UTF-8, return raw bytes
-                    logger.info(self.drv_str, func_str, f"Received binary data: {len(data)} bytes")
-                    return data
-            
-            return None
-        except Exception as e:
-            pass
-            #logger.error(self.drv_str, func_str, f"Error receiving data: {e}")
-            #return None
+        await self.start_background_listener()
+        logger.info(self.drv_str, func_str, "Receiving data from server with timeout {} seconds", timeout)
+        return await self.get_next_message(timeout=timeout)
     
     async def start_background_listener(self):
         """Start a background task to listen for incoming messages"""
         func_str = "start_background_listener"
         if self._listening_task is not None:
-            logger.warning(self.drv_str, func_str, "Background listener already running")
+            logger.debug(self.drv_str, func_str, "Background listener already running")
             return
         
         self._stop_listening = False
@@ -206,72 +424,114 @@ class SocketDriver:
         logger.info(self.drv_str, func_str, "Stopped background listener task")
     
     async def _background_listener(self):
-        """Background task that continuously listens for messages"""
+        """Background task that reads every incoming message.
+
+        This is the only reader of the socket. Responses carrying the seq of
+        a pending request wake that request, everything else is queued for
+        get_next_message.
+        """
         func_str = "_background_listener"
         logger.info(self.drv_str, func_str, "Background listener started")
         
+        framer = self.framer
+        framer.reset()
+        
         while not self._stop_listening and self.connected:
             try:
-                # Non-blocking socket operation
-                self.socket.setblocking(False)
+                # Suspends until the socket is readable and reads straight into
+                # the framer's free space, no timers and no per-read allocation
+                n = await self._recv_into(framer.free_space())
                 
-                try:
-                    data = b""
-                    chunk = self.socket.recv(4096)
-                    if chunk:
-                        data += chunk
-                    else:
-                        # Connection closed
-                        logger.warning(self.drv_str, func_str, "Connection closed by server")
-                        self.connected = False
-                        break
-                    
-                    # Process data if received
-                    if data:
-                        try:
-                            # Try to parse as JSON
-                            decoded = data.decode('utf-8').strip()
-                            parsed = json.loads(decoded)
-                            logger.debug(self.drv_str, func_str, f"Queued message: {str(parsed)[:50]}...")
-                            self.message_queue.append(parsed)
-                        except json.JSONDecodeError:
-                            # Not JSON, queue as string
-                            decoded = data.decode('utf-8').strip()
-                            logger.debug(self.drv_str, func_str, f"Queued text message: {decoded[:50]}...")
-                            self.message_queue.append(decoded)
-                        except UnicodeError:
-                            # Binary data
-                            logger.debug(self.drv_str, func_str, f"Queued binary message: {len(data)} bytes")
-                            self.message_queue.append(data)
-                            
-                except BlockingIOError:
-                    # No data available, this is normal
-                    pass
-                except Exception as e:
-                    logger.error(self.drv_str, func_str, f"Error in background listener: {e}")
+                if n is None:
+                    # Spurious wakeup, nothing was read
+                    continue
                 
-                # Restore blocking mode
-                self.socket.setblocking(True)
+                if n == 0:
+                    # Connection closed
+                    logger.warning(self.drv_str, func_str, "Connection closed by server")
+                    self.mark_dead("EOF")
+                    break
                 
-                # Small delay to prevent CPU hogging
-                await asyncio.sleep(0.1)
+                self.last_rx = time.time()
                 
+                # A read can hold several messages and end in the middle of one
+                framer.commit(n)
+                for line in framer.messages():
+                    self._dispatch_message(self._decode_message(line))
+                if framer.dropped:
+                    logger.warning(self.drv_str, func_str, f"Dropped {framer.dropped} bytes of an oversized message")
+                    framer.dropped = 0
+                
+            except OSError as e:
+                # Reset or aborted, the socket is unusable
+                logger.error(self.drv_str, func_str, f"Background listener socket error: {e}")
+                self.mark_dead("receive failed")
+                break
             except Exception as e:
                 logger.error(self.drv_str, func_str, f"Background listener error: {e}")
                 await asyncio.sleep(1)  # Longer delay after error
-                
+        
+        # Wake everybody still waiting, their responses will never arrive
+        for pending in self._pending.values():
+            pending[0].set()
+        self._listening_task = None
         logger.info(self.drv_str, func_str, "Background listener stopped")
     
+    async def _recv_into(self, buf):
+        """Wait for the socket to be readable and read into buf, 0 means EOF"""
+        if self._stream is not None:
+            return await self._stream.readinto(buf)
+        return await asyncio.get_event_loop().sock_recv_into(self.socket, buf)
+    
+    def _decode_message(self, data):
+        """Decode one received message as JSON, falling back to text or bytes"""
+        try:
+            # Try to parse as JSON
+            return json.loads(data.decode('utf-8').strip())
+        except UnicodeError:
+            # Binary data
+            return data
+        except ValueError:
+            # Not JSON, queue as string
+            return data.decode('utf-8').strip()
+    
+    def _dispatch_message(self, message):
+        """Hand a received message to the request waiting for it or queue it"""
+        func_str = "_dispatch_message"
+        if isinstance(message, dict):
+            pending = self._pending.get(message.get("seq"))
+            if pending is not None:
+                pending[1] = message
+                pending[0].set()
+                return
+        logger.debug(self.drv_str, func_str, lambda: "Queued message: " + str(message)[:50] + "...")
+        self.message_queue.append(message)
+        self.message_event.set()
+    
     async def get_next_message(self, timeout=0):
-        """Get the next message from the queue if available"""
+        """Get the next message from the queue.
+
+        timeout=0 returns immediately, None waits until a message arrives.
+        Waiting consumers are woken by message_event as soon as the listener
+        queues a message.
+        """
         func_str = "get_next_message"
         
         if not self.message_queue:
-            if timeout > 0:
-                # Wait for a message if timeout specified
-                start_time = time.time()
-                while not self.message_queue and time.time() - start_time < timeout:
-                    await asyncio.sleep(0.1)
+            if timeout is None or timeout > 0:
+                deadline = None if timeout is None else time.time() + timeout
+                while not self.message_queue:
+                    self.message_event.clear()
+                    try:
+                        if deadline is None:
+                            await self.message_event.wait()
+                        else:
+                            remaining = deadline - time.time()
+                            if remaining <= 0:
+                                break
+                            await asyncio.wait_for(self.message_event.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
             
             # Return None if no message
             if not self.message_queue:
@@ -279,40 +539,54 @@ class SocketDriver:
         
         # Return and remove the first message
         message = self.message_queue.popleft()
-        logger.debug(self.drv_str, func_str, f"Retrieved message from queue, {len(self.message_queue)} remaining")
+        logger.debug(self.drv_str, func_str, "Retrieved message from queue, {} remaining", len(self.message_queue))
         return message
     
+    def _next_seq(self):
+        self._seq = (self._seq + 1) % SEQ_MODULUS
+        return self._seq
+    
     async def send_and_receive(self, data, timeout=5.0, expected_msg_id=None):
-        """Send data and wait for a specific response"""
+        """Send a request and wait for the response carrying the same seq.
+
+        Any number of requests can be in flight at once, the background
+        listener routes each response to its request.
+        """
         func_str = "send_and_receive"
         
-        # Send the data
-        if not await self.send_data(data):
-            logger.error(self.drv_str, func_str, "Failed to send data")
-            return None
+        if isinstance(data, (str, bytes)):
+            data = json.loads(data)
         
-        # Wait for response
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            # Try to receive data
-            response = await self.receive_data(timeout=1)
-            
-            if response:
-                logger.info(self.drv_str, func_str, f"Received response: {response}")
-                # If we're not looking for a specific message ID, return any response
-                if not expected_msg_id:
-                    return response
-                
-                # If we have a dict response with matching msg_id, return it
-                if isinstance(response, dict) and response.get("msg_id") == expected_msg_id:
-                    return response
-                
-                # Otherwise keep waiting for the right response
-                logger.debug(self.drv_str, func_str, f"Received response but not the expected message ID")
+        await self.start_background_listener()
+        
+        # Stamp the request and register it before sending so a fast reply is not missed
+        seq = self._next_seq()
+        data["seq"] = seq
+        pending = [asyncio.Event(), None]
+        self._pending[seq] = pending
+        
+        try:
+            # Send the data
+            if not await self.send_data(data):
+                logger.error(self.drv_str, func_str, "Failed to send data")
+                return None
             
-            # Small delay between attempts
-            await asyncio.sleep(0.1)
+            try:
+                await asyncio.wait_for(pending[0].wait(), timeout)
+            except asyncio.TimeoutError:
+                # Timeout occurred
+                logger.warning(self.drv_str, func_str, f"Timeout waiting for response after {timeout} seconds")
+                return None
+        finally:
+            self._pending.pop(seq, None)
+        
+        response = pending[1]
+        if response is None:
+            logger.warning(self.drv_str, func_str, "Connection lost while waiting for response")
+            return None
         
-        # Timeout occurred
-        logger.warning(self.drv_str, func_str, f"Timeout waiting for response after {timeout} seconds")
-        return None
\ No newline at end of file
+        logger.info(self.drv_str, func_str, "Received response: {}", response)
+        if expected_msg_id and response.get("msg_id") != expected_msg_id:
+            # Still the answer to this request, let the caller decide what it means
+            logger.warning(self.drv_str, func_str, f"Expected {expected_msg_id} but got {response.get('msg_id')}")
+        return response
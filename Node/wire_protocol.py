@@ -0,0 +1,66 @@
+"""Binary uplink frames for readings, encoder side.
+
+Mirror of Central_Compute/wire_protocol.py, keep MESSAGE_TYPES in sync.
+A frame is a <BBHIH header (magic, type code, node code, seq, payload
+length) followed by the packed fields. A batch carrying sent_at uses the
+timed batch code: sent_at, then the frames of its readings. The node code is handed out by the
+server in the node_update response once both sides agreed on ENCODING.
+"""
+import struct
+
+ENCODING = "bin1"
+MAGIC = 0xFB
+HEADER_FORMAT = "<BBHIH"
+MAX_PAYLOAD = 0xFFFF
+
+# msg_id -> (type code, payload format, field names)
+MESSAGE_TYPES = {
+    "dhtt_data": (1, "<dff", ("timestamp", "temperature", "humidity")),
+    "smoke_data": (2, "<df", ("timestamp", "smoke_level")),
+    "motor_data": (3, "<dff", ("timestamp", "motor_x", "motor_y")),
+    "batch": (4, None, ()),
+}
+TIMED_BATCH = (5, "<d", ("sent_at",))
+
+def _field_values(message, fields):
+    values = []
+    for field in fields:
+        if field == "motor_x" or field == "motor_y":
+            position = message.get("motor_position")
+            if not isinstance(position, (list, tuple)) or len(position) != 2:
+                return None
+            value = position[0 if field == "motor_x" else 1]
+        else:
+            value = message.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        values.append(value)
+    return values
+
+def encode_binary(message, node_code, seq=0):
+    """Encode a message as a binary frame, None when it has no binary layout"""
+    entry = MESSAGE_TYPES.get(message.get("msg_id"))
+    if entry is None:
+        return None
+    code, layout, fields = entry
+    if layout is None:
+        # Batch, the payload is the frames of the readings back to back
+        parts = []
+        for reading in message.get("readings", ()):
+            frame = encode_binary(reading, node_code) if isinstance(reading, dict) else None
+            if frame is None:
+                return None
+            parts.append(frame)
+        payload = b"".join(parts)
+        sent_at = _field_values(message, TIMED_BATCH[2])
+        if sent_at is not None:
+            code = TIMED_BATCH[0]
+            payload = struct.pack(TIMED_BATCH[1], *sent_at) + payload
+    else:
+        values = _field_values(message, fields)
+        if values is None:
+            return None
+        payload = struct.pack(layout, *values)
+    if len(payload) > MAX_PAYLOAD:
+        return None
+    return struct.pack(HEADER_FORMAT, MAGIC, code, node_code, seq or 0, len(payload)) + payload